@@ -0,0 +1,290 @@
+import logging
+import re
+import sqlite3
+
+from flask import Blueprint, jsonify, request
+
+import state
+from db import connect, list_accounts, get_account, ACCOUNT_FIELDS, ACCOUNT_FILTERS
+from importer import import_accounts, load_providers, read_rows
+from responses import conditional_json, json_body
+from state import DB_PATH
+
+accounts_bp = Blueprint('accounts', __name__)
+log = logging.getLogger(__name__)
+
+def is_valid_email(email):
+    email_pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
+    return re.match(email_pattern, email) is not None
+
+@accounts_bp.route('/api/accounts', methods=['GET'])
+def get_items():
+    # Keyset pagination: ?after_id=<last id of previous page>&limit=<page size>
+    after_id = request.args.get('after_id', 0, type=int)
+    limit = min(max(request.args.get('limit', 100, type=int), 1), 1000)
+    filters = {column: request.args[column] for column in ACCOUNT_FILTERS if column in request.args}
+    fields = tuple(request.args['fields'].split(',')) if request.args.get('fields') else ACCOUNT_FIELDS
+    unknown_fields = [field for field in fields if field not in ACCOUNT_FIELDS]
+    if unknown_fields:
+        return {"error": f"Unknown fields: {', '.join(unknown_fields)}"}, 400
+
+    def load(conn):
+        accounts_dict, next_after_id = list_accounts(conn, after_id, limit, filters, fields)
+        return (accounts_dict, next_after_id, *json_body(accounts_dict))
+
+    key = ('page', after_id, limit, tuple(sorted(filters.items())), fields)
+    accounts_dict, next_after_id, body, etag = state.read_cache.get('accounts', key, load)
+    log.debug("Listed accounts", extra={'after_id': after_id, 'count': len(accounts_dict)})
+    response = conditional_json(body, etag)
+    if next_after_id is not None:
+        response.headers['X-Next-After-Id'] = str(next_after_id)
+    return response
+
+@accounts_bp.route('/api/account/getone/<int:id>', methods=['GET'])
+def get_account_by_email(id):
+    try:
+        # Public columns only: never the password or OAuth tokens
+        account = state.read_cache.get('accounts', ('id', id, ACCOUNT_FIELDS), lambda conn: get_account(conn, "id = ?", (id,)))
+        if account is not None:
+            return conditional_json(*json_body(account))
+        else:
+            return jsonify({'message': 'Account not found'}), 404
+                
+    except sqlite3.Error as db_error:
+        log.error("Database error: %s", db_error)
+        return jsonify({'message': 'Database error occurred'}), 500
+        
+    except Exception:
+        log.exception("Unexpected error")
+        return jsonify({'message': 'Internal server error'}), 500
+
+@accounts_bp.route('/api/account/create/smtp', methods=['POST'])
+def create_smtp_one():
+    account_data = request.get_json()
+    required_fields = ['email', 'password', 'provider', 'provider_name', 'imap_server', 'smtp_server', 'imap_port', 'smtp_port', 'warmup_style']
+    
+    try:
+        with connect(DB_PATH) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''SELECT email FROM accounts WHERE email = ?''', (account_data['email'],))
+            existing_account = cursor.fetchone()
+            if existing_account:
+                return {"error": "Account with this email already exists"}, 400  
+            provider_ids = state.read_cache.get('providers', 'by_smtp_server', load_providers)
+            if account_data['smtp_server'] in provider_ids:
+                account_data['provider'] = provider_ids[account_data['smtp_server']]
+            else:
+                cursor.execute('''
+                    INSERT INTO providers (smtp_server, imap_server, provider_name, smtp_port, imap_port)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', (account_data['smtp_server'], account_data['imap_server'], account_data['provider_name'], account_data['smtp_port'], account_data['imap_port']))
+                account_data['provider'] = cursor.lastrowid 
+                state.read_cache.invalidate('providers')
+                log.info("New provider has been created", extra={'provider_id': account_data['provider'], 'smtp_server': account_data['smtp_server']})
+            account_data['daily_limit'] = account_data.get('daily_limit', 100)
+            account_data['status'] = account_data.get('status', 0) 
+            cursor.execute('''
+                INSERT INTO accounts (email, password, provider, daily_limit, warmup_style, created_at, updated_at, status, language) 
+                VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP, ?, ?)
+            ''', (
+                account_data['email'], 
+                account_data['password'], 
+                account_data['provider'], 
+                account_data['daily_limit'],
+                account_data['warmup_style'],
+                account_data['status'],
+                account_data.get('language')
+            ))
+            conn.commit()
+        state.read_cache.invalidate('accounts')
+        log.info("New account has been created", extra={'email': account_data['email']})
+        with connect(DB_PATH) as conn:
+            account = get_account(conn, "email = ?", (account_data['email'],))
+        return jsonify(account)
+        
+    except sqlite3.Error as e:
+        log.error("Database error: %s", e)
+        return {"error": "Database error"}, 500
+
+@accounts_bp.route('/api/account/import', methods=['POST'])
+def import_many():
+    # Upload as multipart "file" or as the raw body; ?format=csv|jsonl overrides detection
+    upload = request.files.get('file')
+    stream = upload.stream if upload else request.stream
+    name = upload.filename if upload else ''
+    fmt = request.args.get('format') or ('jsonl' if name.endswith(('.jsonl', '.ndjson')) or 'ndjson' in (request.content_type or '') else 'csv')
+    if fmt not in ('csv', 'jsonl'):
+        return {"error": "format must be csv or jsonl"}, 400
+    try:
+        with connect(DB_PATH) as conn:
+            providers = state.read_cache.get('providers', 'by_smtp_server', load_providers)
+            report = import_accounts(conn, read_rows(stream, fmt), is_valid_email, providers)
+        log.info("Imported %d accounts, %d failed", report['imported'], report['failed'])
+        return jsonify(report), 201 if report['imported'] else 400
+    except ValueError as e:
+        # Includes UnicodeDecodeError; read_rows turns those into an error row, so this is a last resort
+        log.warning("Import could not be read: %s", e)
+        return jsonify({'imported': 0, 'failed': 0, 'errors': [{'row': None, 'email': None, 'error': str(e)}]}), 400
+    except sqlite3.Error as e:
+        log.error("Database error: %s", e)
+        return {"error": "Database error"}, 500
+    finally:
+        # Chunks committed before a failure are visible too
+        state.read_cache.invalidate('accounts')
+        state.read_cache.invalidate('providers')
+
+@accounts_bp.route('/api/account/create', methods=['POST'])
+def create_one():
+    account_data = request.get_json()
+    required_fields = ['email', 'password', 'provider', 'imap_server', 'smtp_server', 'imap_port', 'smtp_port', 'app_password', 'warmup_stage', 'sent', 'received']
+    try:
+        with connect(DB_PATH) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''SELECT email FROM accounts WHERE email = ?''', (account_data['email'],))
+            existing_account = cursor.fetchone()
+            if existing_account:
+                return {"error": "Account with this email already exists"}, 400
+            
+            # Insert the new account data
+            cursor.execute(''' 
+                INSERT INTO accounts (email, password, provider, imap_server, smtp_server, imap_port, smtp_port, app_password, warmup_stage, status, sent, received) 
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 0, 0)
+            ''', (
+                account_data['email'], 
+                account_data['password'], 
+                account_data['provider'], 
+                account_data['imap_server'], 
+                account_data['smtp_server'], 
+                account_data['imap_port'], 
+                account_data['smtp_port'], 
+                account_data['appword'], 
+                account_data['warmup_stage'],
+                0
+            ))
+
+            # Commit changes to the database
+            conn.commit()
+        state.read_cache.invalidate('accounts')
+
+        with connect(DB_PATH) as conn:
+            account = get_account(conn, "email = ?", (account_data['email'],))
+        return jsonify(account)
+
+    except sqlite3.Error as e:
+        log.error("Database error: %s", e)
+        return {"error": "Database error"}, 500
+    
+@accounts_bp.route('/api/account/delete/<int:id>', methods=['GET'])
+def delete_one(id):
+    try:
+        if not id:
+            return jsonify({'message': 'id is required'}), 400
+        with connect(DB_PATH) as conn:
+            cursor = conn.cursor()
+
+            # Delete the account with the given email
+            cursor.execute("DELETE FROM accounts WHERE id = ?", (id,))
+            conn.commit()
+            state.read_cache.invalidate('accounts')
+
+            # Check if any record was deleted
+            if cursor.rowcount > 0:
+                return jsonify({'id': id})
+            else:
+                return jsonify({'message': 'Account not found'}), 404
+
+    except Exception:
+        log.exception("Unexpected error")
+        return jsonify({'message': 'Internal server error'}), 500
+    
+@accounts_bp.route('/api/account/edit', methods=['POST'])
+def edit_one():
+    account_data = request.get_json()
+    log.info("Editing account", extra={'email': account_data.get('email')})
+
+    required_fields = ['email', 'password', 'provider', 'imap_server', 'smtp_server', 'imap_port', 'smtp_port', 'appword', 'warmup_stage', 'status']
+    missing_fields = [field for field in required_fields if field not in account_data]
+
+    if missing_fields:
+        return {"error": f"Missing required fields: {', '.join(missing_fields)}"}, 400
+
+    try:
+        with connect(DB_PATH) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE accounts 
+                SET password = ?, 
+                    provider = ?, 
+                    imap_server = ?, 
+                    smtp_server = ?, 
+                    imap_port = ?, 
+                    smtp_port = ?, 
+                    app_password = ?, 
+                    warmup_stage = ?, 
+                    status = ?
+                WHERE email = ?
+            ''', (
+                account_data['password'],
+                account_data['provider'],
+                account_data['imap_server'],
+                account_data['smtp_server'],
+                account_data['imap_port'],
+                account_data['smtp_port'],
+                account_data['appword'],
+                account_data['warmup_stage'],
+                account_data['status'],
+                account_data['email']
+            ))
+
+            conn.commit()
+        state.read_cache.invalidate('accounts')
+
+        with connect(DB_PATH) as conn:
+            account = get_account(conn, "email = ?", (account_data['email'],))
+        return jsonify(account)
+
+    except sqlite3.Error as e:
+        log.error("Database error: %s", e)
+        return {"error": "Database error occurred. Please try again later."}, 500
+
+    except Exception:
+        log.exception("Unexpected error")
+        return {"error": "Internal server error. Please try again later."}, 500
+
+@accounts_bp.route('/api/account/warm', methods=['POST'])
+def warm():
+    # Get email data from the frontend
+    email_json = request.get_json(silent=True) or {}
+    if 'email' not in email_json:
+        return {"error": "Missing required fields: email"}, 400
+    sender_email = email_json['email']
+    try:
+        with connect(DB_PATH) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''SELECT status FROM accounts WHERE email = ?''', (sender_email,))
+            account = cursor.fetchone()
+            if account is None:
+                return jsonify({'message': 'Account not found'}), 404
+            if account[0]:
+                cursor.execute('''
+                    UPDATE accounts 
+                    SET status = ?
+                    WHERE email = ?
+                ''', (0, sender_email ))
+            else:
+                cursor.execute('''
+                    UPDATE accounts 
+                    SET status = ?
+                    WHERE email = ?
+                ''', (1, sender_email ))
+        state.read_cache.invalidate('accounts')
+        # The dispatcher picks up the new status on its next poll; it stays off
+        # while sharded workers send, and they schedule the account themselves
+        state.dispatcher.start()
+        with connect(DB_PATH) as conn:
+            account = get_account(conn, "email = ?", (sender_email,))
+        return jsonify(account)
+
+    except sqlite3.Error as e:
+        log.error("Database error: %s", e)
+        return {"error": "Database error occurred. Please try again later."}, 500
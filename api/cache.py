@@ -0,0 +1,78 @@
+import threading
+from collections import OrderedDict
+
+from db import connect
+
+TABLES = ('accounts', 'providers', 'templates')
+MAX_ACCOUNTS = 1024
+
+class ReadCache:
+    """Reads of the accounts, providers and templates tables, kept in memory until they change.
+
+    Values are whatever `load(conn)` returns for a (table, key): whole-table
+    snapshots for providers and templates, single rows and list pages for
+    accounts, which are bounded to `max_accounts` entries in LRU order.
+
+    Write routes call invalidate() right after committing. Writes from other
+    connections (other threads, worker processes, the importer) are caught
+    through PRAGMA data_version: when it moves, the table_versions counters
+    (bumped by triggers on each table) tell which tables to drop.
+    """
+
+    def __init__(self, db_path, max_accounts=MAX_ACCOUNTS):
+        self.db_path = db_path
+        self.max_accounts = max_accounts
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._entries = {table: OrderedDict() for table in TABLES}
+        self._generations = dict.fromkeys(TABLES, 0)
+        self._versions = {}
+        self.hits = dict.fromkeys(TABLES, 0)
+        self.misses = dict.fromkeys(TABLES, 0)
+
+    def _check(self, conn):
+        """Drop the tables another connection has written to since this thread last looked."""
+        data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+        if getattr(self._local, 'data_version', None) == data_version:
+            return
+        self._local.data_version = data_version
+        versions = dict(conn.execute("SELECT name, version FROM table_versions"))
+        with self._lock:
+            changed = [table for table in TABLES if self._versions.get(table) != versions.get(table)]
+            self._versions.update(versions)
+        for table in changed:
+            self.invalidate(table)
+
+    def get(self, table, key, load):
+        conn = connect(self.db_path)
+        self._check(conn)
+        entries = self._entries[table]
+        with self._lock:
+            if key in entries:
+                entries.move_to_end(key)
+                self.hits[table] += 1
+                return entries[key]
+            self.misses[table] += 1
+            generation = self._generations[table]
+        value = load(conn)
+        with self._lock:
+            # Not stored if the table was invalidated while loading
+            if self._generations[table] == generation:
+                entries[key] = value
+                if table == 'accounts' and len(entries) > self.max_accounts:
+                    entries.popitem(last=False)
+        return value
+
+    def invalidate(self, table):
+        """Forget everything cached for table."""
+        with self._lock:
+            self._entries[table].clear()
+            self._generations[table] += 1
+
+    def status(self):
+        with self._lock:
+            return {table: {
+                'entries': len(self._entries[table]),
+                'hits': self.hits[table],
+                'misses': self.misses[table],
+            } for table in TABLES}
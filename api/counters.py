@@ -0,0 +1,101 @@
+import atexit
+import logging
+import sqlite3
+import threading
+from collections import defaultdict
+from datetime import datetime
+
+from db import connect
+from metrics import write_rollups
+
+log = logging.getLogger(__name__)
+
+UPSERT_METRICS = """
+    INSERT INTO metrics (email, date, sent_count, received_count, spam_count)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT (email, date) DO UPDATE SET
+        sent_count = COALESCE(sent_count, 0) + excluded.sent_count,
+        received_count = COALESCE(received_count, 0) + excluded.received_count,
+        spam_count = COALESCE(spam_count, 0) + excluded.spam_count
+"""
+
+def by_day(pending):
+    """Sum {(email, hour): counts} increments per (email, date)."""
+    days = defaultdict(lambda: [0, 0, 0])
+    for (email, hour), counts in pending.items():
+        current = days[email, hour[:10]]
+        for i, count in enumerate(counts):
+            current[i] += count
+    return days
+
+class CounterAggregator:
+    """Buffers per-account, per-hour metric increments and writes them in batches.
+
+    Increments accumulate in memory and are flushed as one upsert transaction
+    into `metrics` (per day) and the hourly, daily and weekly rollups (see
+    metrics.py) every `flush_interval` seconds, once `flush_events`
+    increments are pending, and at interpreter exit.
+    """
+
+    def __init__(self, db_path, flush_interval=1.0, flush_events=500):
+        self.db_path = db_path
+        self.flush_interval = flush_interval
+        self.flush_events = flush_events
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending = {}
+        self._events = 0
+        self._wake = threading.Event()
+        self._thread = None
+
+    def incr(self, email, sent=0, received=0, spam=0, at=None):
+        key = (email, (at or datetime.now()).strftime('%Y-%m-%d %H:00'))
+        with self._lock:
+            counts = self._pending.get(key)
+            if counts is None:
+                counts = self._pending[key] = [0, 0, 0]
+            counts[0] += sent
+            counts[1] += received
+            counts[2] += spam
+            self._events += 1
+            full = self._events >= self.flush_events
+            if self._thread is None:
+                self._start()
+        if full:
+            self._wake.set()
+
+    def _start(self):
+        self._thread = threading.Thread(target=self._run, name="metrics-flush", daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+    def flush(self):
+        """Write all pending increments in one transaction; returns the number of rows upserted."""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+                self._events = 0
+            if not pending:
+                return 0
+            try:
+                with connect(self.db_path) as conn:
+                    conn.executemany(UPSERT_METRICS, [(email, day, *counts) for (email, day), counts in by_day(pending).items()])
+                    write_rollups(conn, pending)
+            except sqlite3.Error as e:
+                log.error("Could not flush metrics: %s", e, extra={'pending': len(pending)})
+                self._restore(pending)
+                return 0
+            return len(pending)
+
+    def _restore(self, pending):
+        with self._lock:
+            for key, counts in pending.items():
+                current = self._pending.setdefault(key, [0, 0, 0])
+                for i, count in enumerate(counts):
+                    current[i] += count
@@ -0,0 +1,328 @@
+"""SQLite access for the API: shared connections, migrations and row serialization.
+
+Rows are serialized straight from sqlite3 cursors, without pandas. Values
+keep their SQLite types (INTEGER -> int, NULL -> None), so nullable integer
+columns are not turned into floats/NaN on the way to JSON.
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from instrumentation import record
+
+log = logging.getLogger(__name__)
+
+JOURNAL_MODE = 'WAL'
+PRAGMAS = (
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA mmap_size = 268435456",
+    "PRAGMA temp_store = MEMORY",
+)
+CACHED_STATEMENTS = 256
+
+_local = threading.local()
+
+def _timed(method):
+    def timed(self, *args):
+        start = time.perf_counter()
+        try:
+            return method(self, *args)
+        finally:
+            record('sql', time.perf_counter() - start)
+    return timed
+
+class TimedCursor(sqlite3.Cursor):
+    """Adds the time spent executing and fetching to the 'sql' timer.
+
+    Iterating over the cursor is not timed; query_all fetches with fetchall().
+    """
+    execute = _timed(sqlite3.Cursor.execute)
+    executemany = _timed(sqlite3.Cursor.executemany)
+    executescript = _timed(sqlite3.Cursor.executescript)
+    fetchone = _timed(sqlite3.Cursor.fetchone)
+    fetchmany = _timed(sqlite3.Cursor.fetchmany)
+    fetchall = _timed(sqlite3.Cursor.fetchall)
+
+class TimedConnection(sqlite3.Connection):
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    # sqlite3.Connection.execute* do not go through cursor()
+    def execute(self, *args):
+        return self.cursor().execute(*args)
+
+    def executemany(self, *args):
+        return self.cursor().executemany(*args)
+
+    def executescript(self, *args):
+        return self.cursor().executescript(*args)
+
+def configure(conn):
+    """Apply the journal mode and pragmas every connection should run with."""
+    try:
+        conn.execute(f"PRAGMA journal_mode = {JOURNAL_MODE}")
+    except sqlite3.OperationalError as e:
+        # Read-only deployments (e.g. Vercel) keep the file's journal mode
+        log.warning("Could not set journal mode: %s", e)
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+def connect(db_path):
+    """This thread's connection to db_path, opened and configured once and then reused.
+
+    Use it as `with connect(DB_PATH) as conn:` like sqlite3.connect; the block
+    commits or rolls back but leaves the connection open for the next request.
+    """
+    connections = getattr(_local, 'connections', None)
+    if connections is None or _local.pid != os.getpid():
+        # Never reuse a connection inherited across fork()
+        connections = _local.connections = {}
+        _local.pid = os.getpid()
+    conn = connections.get(db_path)
+    if conn is None:
+        conn = sqlite3.connect(db_path, timeout=5, cached_statements=CACHED_STATEMENTS, factory=TimedConnection)
+        connections[db_path] = configure(conn)
+    return conn
+
+def close_thread_connections():
+    for conn in getattr(_local, 'connections', {}).values():
+        conn.close()
+    _local.connections = {}
+
+def query_all(conn, query, params=()):
+    """Run a query and return the rows as a list of column -> value dicts."""
+    cursor = conn.execute(query, params)
+    columns = [column[0] for column in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+def query_one(conn, query, params=()):
+    """Run a query and return the first row as a dict, or None."""
+    cursor = conn.execute(query, params)
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    return dict(zip([column[0] for column in cursor.description], row))
+
+# Columns the API may return for an account; credentials never leave the server
+ACCOUNT_FIELDS = ('id', 'email', 'provider', 'daily_limit', 'warmup_style', 'started_at', 'created_at', 'updated_at', 'status', 'language')
+ACCOUNT_FILTERS = ('status', 'provider', 'warmup_style')
+
+# Applied in order; PRAGMA user_version records how many have run
+MIGRATIONS = (
+    (
+        "CREATE INDEX IF NOT EXISTS idx_accounts_email ON accounts (email)",
+        "CREATE INDEX IF NOT EXISTS idx_accounts_status ON accounts (status, id)",
+        "CREATE INDEX IF NOT EXISTS idx_accounts_provider ON accounts (provider, id)",
+    ),
+    (
+        "CREATE INDEX IF NOT EXISTS idx_providers_smtp_server ON providers (smtp_server)",
+        "CREATE INDEX IF NOT EXISTS idx_templates_subject ON templates (subject)",
+        "CREATE INDEX IF NOT EXISTS idx_records_sender ON records (sender)",
+        "CREATE INDEX IF NOT EXISTS idx_records_receiver ON records (receiver)",
+    ),
+    (
+        # Lets the placement monitor match fetched Message-IDs back to sends
+        "ALTER TABLE records ADD COLUMN message_id TEXT",
+        "CREATE INDEX IF NOT EXISTS idx_records_message_id ON records (message_id)",
+    ),
+    (
+        # Reply chains are walked through reply_to
+        "CREATE INDEX IF NOT EXISTS idx_records_reply_to ON records (reply_to)",
+    ),
+    (
+        # Picks the template language for an account's sends; NULL means DEFAULT_LANGUAGE
+        "ALTER TABLE accounts ADD COLUMN language TEXT",
+    ),
+    (
+        # Decayed per-domain counts behind the reputation scores, and the
+        # last records id each incremental job has processed
+        "ALTER TABLE reputations ADD COLUMN reply_rate REAL",
+        "ALTER TABLE reputations ADD COLUMN sent_weight REAL NOT NULL DEFAULT 0",
+        "ALTER TABLE reputations ADD COLUMN observed_weight REAL NOT NULL DEFAULT 0",
+        "ALTER TABLE reputations ADD COLUMN spam_weight REAL NOT NULL DEFAULT 0",
+        "ALTER TABLE reputations ADD COLUMN reply_weight REAL NOT NULL DEFAULT 0",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_reputations_domain ON reputations (domain)",
+        "CREATE TABLE IF NOT EXISTS watermarks (name TEXT PRIMARY KEY, last_id INTEGER NOT NULL)",
+    ),
+    (
+        # Rollups behind /api/metrics, kept up to date by CounterAggregator;
+        # scope is 'account' (key = email), 'provider' (key = accounts.provider) or 'total'
+        *(f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                scope TEXT NOT NULL,
+                key TEXT NOT NULL,
+                bucket TEXT NOT NULL,
+                sent INTEGER NOT NULL DEFAULT 0,
+                received INTEGER NOT NULL DEFAULT 0,
+                spam INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (scope, key, bucket)
+            ) WITHOUT ROWID
+        """ for table in ('metrics_hourly', 'metrics_daily', 'metrics_weekly')),
+        # Existing per-day metrics seed the daily and weekly rollups; they have no hours
+        """
+            INSERT INTO metrics_daily (scope, key, bucket, sent, received, spam)
+            SELECT 'account', email, date, COALESCE(sent_count, 0), COALESCE(received_count, 0), COALESCE(spam_count, 0)
+            FROM metrics
+            WHERE email IS NOT NULL AND date IS NOT NULL
+        """,
+        """
+            INSERT INTO metrics_daily (scope, key, bucket, sent, received, spam)
+            SELECT 'provider', a.provider, d.bucket, SUM(d.sent), SUM(d.received), SUM(d.spam)
+            FROM metrics_daily d
+            JOIN accounts a ON a.email = d.key
+            WHERE d.scope = 'account' AND a.provider IS NOT NULL
+            GROUP BY a.provider, d.bucket
+        """,
+        """
+            INSERT INTO metrics_daily (scope, key, bucket, sent, received, spam)
+            SELECT 'total', '', bucket, SUM(sent), SUM(received), SUM(spam)
+            FROM metrics_daily
+            WHERE scope = 'account'
+            GROUP BY bucket
+        """,
+        """
+            INSERT INTO metrics_weekly (scope, key, bucket, sent, received, spam)
+            SELECT scope, key, date(bucket, 'weekday 0', '-6 days'), SUM(sent), SUM(received), SUM(spam)
+            FROM metrics_daily
+            GROUP BY scope, key, date(bucket, 'weekday 0', '-6 days')
+        """,
+    ),
+    (
+        # Bumped on every write so ReadCache can tell which tables changed
+        # when PRAGMA data_version reports a write from another connection
+        "CREATE TABLE IF NOT EXISTS table_versions (name TEXT PRIMARY KEY, version INTEGER NOT NULL DEFAULT 0)",
+        "INSERT OR IGNORE INTO table_versions (name) VALUES ('accounts'), ('providers'), ('templates')",
+        *(f"""
+            CREATE TRIGGER IF NOT EXISTS {table}_{event.lower()}_version AFTER {event} ON {table}
+            BEGIN
+                UPDATE table_versions SET version = version + 1 WHERE name = '{table}';
+            END
+        """ for table in ('accounts', 'providers', 'templates') for event in ('INSERT', 'UPDATE', 'DELETE')),
+    ),
+    (
+        # Time-range exports (export.py) scan records by sent_time
+        "CREATE INDEX IF NOT EXISTS idx_records_sent_time ON records (sent_time)",
+    ),
+    (
+        # The subject as rendered for the recipient, which replies quote
+        "ALTER TABLE records ADD COLUMN subject TEXT",
+    ),
+    (
+        # Durable send queue (jobs.py); scheduled_days marks the senders whose day is queued
+        """
+            CREATE TABLE IF NOT EXISTS send_jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                sender INTEGER NOT NULL,
+                receiver INTEGER NOT NULL,
+                template INTEGER,
+                reply_to INTEGER,
+                run_at REAL NOT NULL,
+                status TEXT NOT NULL DEFAULT 'queued',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                lease_owner TEXT,
+                lease_until REAL,
+                last_error TEXT
+            )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_send_jobs_claim ON send_jobs (status, run_at)",
+        """
+            CREATE TABLE IF NOT EXISTS scheduled_days (
+                day TEXT NOT NULL,
+                sender INTEGER NOT NULL,
+                PRIMARY KEY (day, sender)
+            ) WITHOUT ROWID
+        """,
+    ),
+    (
+        # Token buckets of the shared rate limiter (ratelimit.py), per provider and recipient domain
+        """
+            CREATE TABLE IF NOT EXISTS rate_buckets (
+                key TEXT PRIMARY KEY,
+                rate REAL NOT NULL,
+                capacity REAL NOT NULL,
+                tokens REAL NOT NULL,
+                updated REAL NOT NULL,
+                penalty REAL NOT NULL DEFAULT 1.0,
+                throttled_at REAL NOT NULL DEFAULT 0,
+                backoff REAL NOT NULL DEFAULT 0,
+                backoff_until REAL NOT NULL DEFAULT 0,
+                throttles INTEGER NOT NULL DEFAULT 0
+            )
+        """,
+    ),
+    (
+        # Worker heartbeats and shard ownership of the sharded workers (worker.py)
+        """
+            CREATE TABLE IF NOT EXISTS worker_leases (
+                worker_id TEXT PRIMARY KEY,
+                started REAL NOT NULL,
+                lease_until REAL NOT NULL
+            )
+        """,
+        """
+            CREATE TABLE IF NOT EXISTS shard_leases (
+                shard INTEGER PRIMARY KEY,
+                owner TEXT,
+                lease_until REAL
+            )
+        """,
+    ),
+)
+
+def migrate(db_path):
+    """Bring the schema up to date with MIGRATIONS."""
+    try:
+        conn = connect(db_path)
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        for number, statements in enumerate(MIGRATIONS[version:], start=version + 1):
+            with conn:
+                # Worker processes starting together race to migrate: the
+                # write lock decides, and the others find it done
+                conn.execute("BEGIN IMMEDIATE")
+                if conn.execute("PRAGMA user_version").fetchone()[0] >= number:
+                    continue
+                for statement in statements:
+                    conn.execute(statement)
+                conn.execute(f"PRAGMA user_version = {number}")
+            log.info("Applied migration %d", number, extra={'migration': number})
+    except sqlite3.Error as e:
+        log.error("Could not migrate database: %s", e)
+
+def insert_records(conn, rows):
+    """Insert sends as (template, sender, receiver, reply_to, message_id, sent_time, subject) tuples.
+
+    isspam stays NULL until the placement monitor has seen the message.
+    """
+    conn.executemany('''
+        INSERT INTO records (template, sender, receiver, isspam, isreply, reply_to, message_id, sent_time, subject)
+        VALUES (?1, ?2, ?3, NULL, ?4 IS NOT NULL, ?4, ?5, ?6, ?7)
+    ''', rows)
+
+def list_accounts(conn, after_id=0, limit=100, filters=None, fields=ACCOUNT_FIELDS):
+    """One keyset page of accounts: rows with id > after_id, in id order."""
+    where = ["id > ?"]
+    params = [after_id]
+    for column, value in (filters or {}).items():
+        where.append(f"{column} = ?")
+        params.append(value)
+    columns = ", ".join(fields if 'id' in fields else ('id',) + tuple(fields))
+    rows = query_all(conn, f"""
+        SELECT {columns}
+        FROM accounts
+        WHERE {' AND '.join(where)}
+        ORDER BY id
+        LIMIT ?
+    """, (*params, limit))
+    next_after_id = rows[-1]['id'] if len(rows) == limit else None
+    if 'id' not in fields:
+        for row in rows:
+            del row['id']
+    return rows, next_after_id
+
+def get_account(conn, where, params):
+    """A single account's public columns, e.g. get_account(conn, "email = ?", (email,))."""
+    return query_one(conn, f"SELECT {', '.join(ACCOUNT_FIELDS)} FROM accounts WHERE {where}", params)
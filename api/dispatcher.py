@@ -0,0 +1,275 @@
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+
+import numpy as np
+
+from db import connect, insert_records, query_all
+from pairing import REPEAT_WINDOW, PairingEngine
+from planner import load_accounts, plan_day
+from worker import ShardLeases
+
+log = logging.getLogger(__name__)
+
+ACTIVE_ACCOUNTS_QUERY = """
+    SELECT a.id, a.email, a.password, a.daily_limit, a.warmup_style, a.language,
+           a.provider, p.smtp_server, p.smtp_port
+    FROM accounts a
+    LEFT JOIN providers p ON p.id = a.provider
+    WHERE a.status = 1
+"""
+
+# Warmup sends (not replies) each account made today, by any path: the
+# dispatcher, the job workers or an earlier run of either
+SENT_TODAY_QUERY = """
+    SELECT sender, COUNT(*)
+    FROM records
+    WHERE sent_time >= ? AND NOT isreply
+    GROUP BY sender
+"""
+
+def planned_sends(plan, now):
+    """{account id: (sends planned for the day, [its planned send times from `now` on])} of a planner.DayPlan."""
+    order = np.argsort(plan.sender, kind='stable')
+    ids, starts, counts = np.unique(plan.sender[order], return_index=True, return_counts=True)
+    times = np.split(plan.send_at[order], starts[1:]) if len(ids) else []
+    return {account_id: (count, [send_at for send_at in account_times.tolist() if send_at >= now])
+            for account_id, count, account_times in zip(ids.tolist(), counts.tolist(), times)}
+
+class WarmupDispatcher:
+    """Long-lived asyncio loop that owns the send schedule of every active account.
+
+    The loop runs in its own thread and re-reads `accounts.status` every
+    `poll_interval` seconds (when the accounts table changed), so toggling an
+    account is all it takes to start or stop its sends. Accounts send at the
+    times planner.plan_day gives them for the day, spread over `window`
+    (seconds after local midnight), so their volume follows the ramp of
+    their warmup_style. Receivers come from a PairingEngine, and a refused
+    send is retried like a queued job. The day's sent counts are read back
+    from `records` on every poll, so neither a restart nor the job workers
+    sending for the same account take it past its planned volume. Blocking
+    SMTP calls are bridged to a thread pool with at most `max_in_flight` in
+    flight. The sharded workers (worker.py) send for the same accounts, so
+    the dispatcher does not start while one holds a live lease and stops
+    when one appears.
+    """
+
+    def __init__(self, db_path, send_func, poll_interval=5, max_in_flight=200, repeat_window=REPEAT_WINDOW,
+                 window=(0, 24 * 3600), max_attempts=5, retry_delay=30):
+        self.db_path = db_path
+        self.send_func = send_func
+        self.poll_interval = poll_interval
+        self.max_in_flight = max_in_flight
+        self.window = window
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self._lock = threading.Lock()
+        self._thread = None
+        self._loop = None
+        self._stopping = None
+        self._tasks = {}
+        self._sends = set()
+        self._records = []
+        self._accounts = {}
+        self._accounts_version = None
+        self._planned = {}      # account id -> (sends planned today, send times left when planned)
+        self.pairing = PairingEngine(repeat_window)
+        self.leases = ShardLeases(db_path)
+        self._sent_today = {}   # account id -> warmup sends recorded today
+        self._pending = {}      # account id -> sends in flight or waiting for a retry
+        self._day = None
+        self.in_flight = 0
+        self.sent = 0
+        self.failed = 0
+
+    def start(self):
+        """Start the loop; False if it is running already or the sharded workers own sending."""
+        with self._lock:
+            if self.running or self.leases.alive():
+                return False
+            self._loop = asyncio.new_event_loop()
+            self._stopping = asyncio.Event()
+            self._thread = threading.Thread(target=self._run_loop, name="warmup-dispatcher", daemon=True)
+            self._thread.start()
+            return True
+
+    def stop(self, timeout=10):
+        with self._lock:
+            if not self.running:
+                return False
+            self._loop.call_soon_threadsafe(self._stopping.set)
+            self._thread.join(timeout)
+            return True
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def status(self):
+        return {
+            'running': self.running,
+            'accounts': [
+                {
+                    'email': account['email'],
+                    'daily_limit': account['daily_limit'],
+                    'planned_today': self._planned.get(account['id'], (0, []))[0],
+                    'sent_today': self._sent_today.get(account['id'], 0),
+                }
+                for account in list(self._accounts.values())
+            ],
+            'pairing': self.pairing.status(),
+            'in_flight': self.in_flight,
+            'sent': self.sent,
+            'failed': self.failed,
+        }
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self._loop)
+        try:
+            self._loop.run_until_complete(self._main())
+        finally:
+            self._loop.close()
+
+    def _load_active_accounts(self):
+        """(active accounts by email, today's planned sends), or None if neither the accounts table nor the day changed since the last load."""
+        day = date.today()
+        with connect(self.db_path) as conn:
+            version = conn.execute("SELECT version FROM table_versions WHERE name = 'accounts'").fetchone()
+            if version is not None and version[0] == self._accounts_version and day == self._day:
+                return None
+            rows = query_all(conn, ACTIVE_ACCOUNTS_QUERY)
+            # Seeded by the day, so a restart plans the same times again
+            plan = plan_day(load_accounts(conn), day, self.window, seed=day.toordinal())
+        self._accounts_version = version and version[0]
+        return {row['email']: row for row in rows}, planned_sends(plan, time.time())
+
+    def _load_sent_today(self):
+        with connect(self.db_path) as conn:
+            return dict(conn.execute(SENT_TODAY_QUERY, (date.today().strftime('%Y-%m-%d 00:00:00'),)))
+
+    def _write_records(self, records):
+        """Store the sends completed since the last poll in one transaction."""
+        if not records:
+            return
+        try:
+            with connect(self.db_path) as conn:
+                insert_records(conn, records)
+        except sqlite3.Error as e:
+            log.error("Dispatcher could not write records: %s", e, extra={'records': len(records)})
+
+    async def _main(self):
+        self._semaphore = asyncio.Semaphore(self.max_in_flight)
+        executor = ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix="warmup-send")
+        try:
+            while not self._stopping.is_set():
+                try:
+                    if await self._loop.run_in_executor(executor, self.leases.alive):
+                        log.warning("Sharded workers are sending, stopping the dispatcher")
+                        # Also ends the retries waiting in _send
+                        self._stopping.set()
+                        break
+                    accounts = await self._loop.run_in_executor(executor, self._load_active_accounts)
+                except sqlite3.Error as e:
+                    log.error("Dispatcher could not load accounts: %s", e)
+                else:
+                    if accounts is not None:
+                        self._sync_accounts(*accounts, executor)
+                records, self._records = self._records, []
+                await self._loop.run_in_executor(executor, self._write_records, records)
+                try:
+                    sent_today = await self._loop.run_in_executor(executor, self._load_sent_today)
+                except sqlite3.Error as e:
+                    log.error("Dispatcher could not count today's sends: %s", e)
+                else:
+                    # Plus the sends completed since the write above
+                    for record in self._records:
+                        sent_today[record[1]] = sent_today.get(record[1], 0) + 1
+                    self._sent_today = sent_today
+                try:
+                    await asyncio.wait_for(self._stopping.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            tasks = list(self._tasks.values())
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            # Let sends that already reached the SMTP pool finish; retries give up
+            await asyncio.gather(*self._sends, return_exceptions=True)
+            self._write_records(self._records)
+            self._records = []
+            self._tasks.clear()
+            self._accounts.clear()
+            # Reloaded and planned again on the next start; the pairing engine keeps today's counts
+            self._accounts_version = None
+            executor.shutdown(wait=True)
+
+    def _sync_accounts(self, accounts, planned, executor):
+        """Start loops for newly activated accounts and cancel deactivated ones; restart them all on a new day."""
+        new_day = self._day != date.today()
+        self._day = date.today()
+        for email in list(self._tasks):
+            if new_day or email not in accounts or accounts[email] != self._accounts.get(email):
+                self._tasks.pop(email).cancel()
+        self._accounts = accounts
+        self._planned = planned
+        self.pairing.sync({account['id']: account for account in accounts.values()})
+        for email, account in accounts.items():
+            if email not in self._tasks:
+                volume, times = planned.get(account['id'], (0, []))
+                self._tasks[email] = asyncio.ensure_future(self._account_loop(account, volume, times, executor))
+
+    async def _account_loop(self, account, volume, times, executor):
+        """Start a send at each of `times` while fewer than `volume` sends are recorded or under way."""
+        for send_at in times:
+            await asyncio.sleep(max(0, send_at - time.time()))
+            if self._sent_today.get(account['id'], 0) + self._pending.get(account['id'], 0) >= volume:
+                # The day's volume is sent or spoken for, here or by the job workers
+                continue
+            self._pending[account['id']] = self._pending.get(account['id'], 0) + 1
+            send = asyncio.ensure_future(self._send(account, executor))
+            self._sends.add(send)
+            send.add_done_callback(self._sends.discard)
+
+    async def _send(self, account, executor):
+        """One planned send: a refusal is retried after retry_delay, doubling, up to max_attempts (as jobs.JobQueue does)."""
+        try:
+            for attempt in range(self.max_attempts):
+                if attempt:
+                    try:
+                        await asyncio.wait_for(self._stopping.wait(), self.retry_delay * 2 ** (attempt - 1))
+                        return
+                    except asyncio.TimeoutError:
+                        pass
+                receiver = self.pairing.pick(account['id'])
+                if receiver is None:
+                    continue
+                async with self._semaphore:
+                    if await self._attempt(account, receiver, executor):
+                        return
+        finally:
+            self._pending[account['id']] -= 1
+
+    async def _attempt(self, account, receiver, executor):
+        self.in_flight += 1
+        try:
+            ok = await self._loop.run_in_executor(executor, self.send_func, account, receiver['email'])
+        except Exception as e:
+            log.warning("Dispatcher send failed: %s", e, extra={'sender': account['email'], 'recipient': receiver['email']})
+            ok = False
+        finally:
+            self.in_flight -= 1
+        if not ok:
+            self.failed += 1
+            return False
+        # Only accepted sends count against the day's volume
+        self._sent_today[account['id']] = self._sent_today.get(account['id'], 0) + 1
+        self.sent += 1
+        message_id, template, subject = ok
+        self._records.append((template, account['id'], receiver['id'], None, message_id,
+                              datetime.now().strftime('%Y-%m-%d %H:%M:%S'), subject))
+        return True
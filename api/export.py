@@ -0,0 +1,206 @@
+"""Streaming export of the delivery history in `records`, joined with accounts and templates.
+
+The rows come from one cursor, fetchmany(CHUNK_ROWS) at a time. Each chunk
+is turned into columns and encoded on its own, and the bytes are handed out
+before the next chunk is read, so memory stays bounded by one chunk however
+large the table is. Formats:
+
+- arrow:   Arrow IPC stream, one record batch per chunk (needs pyarrow)
+- parquet: Parquet, one row group per chunk (needs pyarrow)
+- csv:     gzip'd CSV; always available, and the default without pyarrow
+
+Only the tables the requested columns come from are joined, and a time range
+on sent_time is answered from idx_records_sent_time.
+"""
+import csv
+import gzip
+import importlib.util
+import io
+import sqlite3
+
+from db import configure
+
+CHUNK_ROWS = 50000
+CSV_GZIP_LEVEL = 6
+
+# name -> (SQL expression, join it needs, Arrow type)
+COLUMNS = {
+    'id': ('r.id', None, 'int64'),
+    'sent_time': ('r.sent_time', None, 'timestamp'),
+    'sender_id': ('r.sender', None, 'int64'),
+    'sender': ('s.email', 'LEFT JOIN accounts s ON s.id = r.sender', 'string'),
+    'receiver_id': ('r.receiver', None, 'int64'),
+    'receiver': ('v.email', 'LEFT JOIN accounts v ON v.id = r.receiver', 'string'),
+    'template': ('r.template', None, 'int64'),
+    'subject': ('COALESCE(r.subject, t.subject)', 'LEFT JOIN templates t ON t.id = r.template', 'string'),
+    'language': ('t.language', 'LEFT JOIN templates t ON t.id = r.template', 'string'),
+    'isspam': ('r.isspam', None, 'int8'),
+    'isreply': ('r.isreply', None, 'int8'),
+    'reply_to': ('r.reply_to', None, 'int64'),
+    'message_id': ('r.message_id', None, 'string'),
+}
+
+# format -> (MIME type, file extension)
+FORMATS = {
+    'arrow': ('application/vnd.apache.arrow.stream', 'arrows'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+    'csv': ('application/gzip', 'csv.gz'),
+}
+
+class FormatUnavailable(ValueError):
+    """An export format this installation cannot write."""
+
+def has_pyarrow():
+    return importlib.util.find_spec('pyarrow') is not None
+
+def resolve_format(requested=None):
+    """The format to write: the one asked for, else Arrow if possible. Raises ValueError.
+
+    A format that needs pyarrow when it is missing raises FormatUnavailable
+    rather than silently becoming CSV.
+    """
+    if requested is None:
+        return 'arrow' if has_pyarrow() else 'csv'
+    if requested not in FORMATS:
+        raise ValueError(f"format must be one of {', '.join(FORMATS)}")
+    if requested != 'csv' and not has_pyarrow():
+        raise FormatUnavailable(f"{requested} needs pyarrow, which is not installed; use format=csv")
+    return requested
+
+def parse_columns(value=None):
+    """'sent_time,sender,isspam' -> a tuple of column names; every column if value is empty. Raises ValueError."""
+    if not value:
+        return tuple(COLUMNS)
+    columns = tuple(name.strip() for name in value.split(',') if name.strip())
+    unknown = [name for name in columns if name not in COLUMNS]
+    if unknown or not columns:
+        raise ValueError(f"unknown columns {', '.join(unknown)}; choose from {', '.join(COLUMNS)}")
+    return columns
+
+def sent_time(moment):
+    """A datetime as records.sent_time text, which is naive local time; aware ones are converted first."""
+    if moment.tzinfo is not None:
+        moment = moment.astimezone().replace(tzinfo=None)
+    return moment.strftime('%Y-%m-%d %H:%M:%S')
+
+def query(columns, start=None, end=None):
+    """(SQL, params) selecting the columns for records with start <= sent_time < end."""
+    joins = dict.fromkeys(COLUMNS[name][1] for name in columns if COLUMNS[name][1])
+    where, params = [], []
+    if start is not None:
+        where.append("r.sent_time >= ?")
+        params.append(sent_time(start))
+    if end is not None:
+        where.append("r.sent_time < ?")
+        params.append(sent_time(end))
+    sql = f'''
+        SELECT {', '.join(COLUMNS[name][0] for name in columns)}
+        FROM records r
+        {' '.join(joins)}
+        {'WHERE ' + ' AND '.join(where) if where else ''}
+        ORDER BY {'r.sent_time' if where else 'r.id'}
+    '''
+    return sql, params
+
+def export(db_path, fmt, columns=None, start=None, end=None, chunk_rows=CHUNK_ROWS):
+    """Start the export and return a generator of output bytes.
+
+    The query runs here, so sqlite3 errors are raised before anything has
+    been streamed. The connection is closed when the generator finishes.
+    """
+    columns = columns or tuple(COLUMNS)
+    conn = configure(sqlite3.connect(db_path, timeout=30, check_same_thread=False))
+    # A full scan would otherwise map up to mmap_size of the file into the process
+    conn.execute("PRAGMA mmap_size = 0")
+    try:
+        cursor = conn.execute(*query(columns, start, end))
+    except sqlite3.Error:
+        conn.close()
+        raise
+    return _stream(conn, cursor, fmt, columns, chunk_rows)
+
+def _stream(conn, cursor, fmt, columns, chunk_rows):
+    def chunks():
+        while True:
+            rows = cursor.fetchmany(chunk_rows)
+            if not rows:
+                return
+            yield rows
+
+    try:
+        if fmt == 'csv':
+            yield from _write_csv(chunks(), columns)
+        else:
+            yield from _write_arrow(chunks(), columns, parquet=fmt == 'parquet')
+    finally:
+        conn.close()
+
+class _Sink(io.RawIOBase):
+    """A write-only file that keeps what is written until take() hands it out."""
+
+    def __init__(self):
+        self._parts = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def take(self):
+        data = b''.join(self._parts)
+        self._parts = []
+        return data
+
+def _write_csv(chunks, columns):
+    sink = _Sink()
+    compressed = gzip.GzipFile(fileobj=sink, mode='wb', compresslevel=CSV_GZIP_LEVEL)
+    text = io.StringIO()
+    writer = csv.writer(text, lineterminator='\n')
+    writer.writerow(columns)
+    for rows in chunks:
+        writer.writerows(rows)
+        compressed.write(text.getvalue().encode())
+        text.seek(0)
+        text.truncate()
+        yield sink.take()
+    compressed.write(text.getvalue().encode())
+    compressed.close()
+    yield sink.take()
+
+def _write_arrow(chunks, columns, parquet=False):
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    types = {'int64': pa.int64(), 'int8': pa.int8(), 'string': pa.string(), 'timestamp': pa.timestamp('s')}
+    schema = pa.schema([(name, types[COLUMNS[name][2]]) for name in columns])
+
+    def array(values, kind):
+        if kind != 'timestamp':
+            return pa.array(values, types[kind])
+        # sent_time is 'YYYY-MM-DD HH:MM:SS', sometimes with fractional seconds
+        text = pc.utf8_slice_codeunits(pa.array(values, pa.string()), 0, 19)
+        return pc.strptime(text, format='%Y-%m-%d %H:%M:%S', unit='s', error_is_null=True)
+
+    sink = _Sink()
+    if parquet:
+        import pyarrow.parquet as pq
+        writer = pq.ParquetWriter(sink, schema)
+    else:
+        writer = pa.ipc.new_stream(sink, schema)
+    for rows in chunks:
+        # Column arrays straight from the chunk's tuples, no per-row dicts
+        batch = pa.record_batch([array(values, COLUMNS[name][2]) for name, values in zip(columns, zip(*rows))], schema=schema)
+        if parquet:
+            writer.write_table(pa.Table.from_batches([batch]))
+        else:
+            writer.write_batch(batch)
+        yield sink.take()
+    writer.close()
+    yield sink.take()
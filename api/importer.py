@@ -0,0 +1,127 @@
+import csv
+import io
+import json
+from itertools import islice
+
+REQUIRED_FIELDS = ('email', 'password', 'provider_name', 'imap_server', 'smtp_server', 'imap_port', 'smtp_port', 'warmup_style')
+TEXT_FIELDS = ('email', 'password', 'provider_name', 'imap_server', 'smtp_server', 'language')
+INTEGER_FIELDS = ('imap_port', 'smtp_port', 'warmup_style', 'daily_limit', 'status')
+CHUNK_SIZE = 1000
+MAX_REPORTED_ERRORS = 1000
+
+def read_rows(stream, fmt):
+    """Yield dicts from a binary CSV or JSONL stream one row at a time.
+
+    If the stream stops decoding (invalid UTF-8, malformed CSV), one error
+    row stands in for the rest of it.
+    """
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    try:
+        if fmt == 'csv':
+            yield from csv.DictReader(text)
+            return
+        for line in text:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                row = {'__error__': f"Invalid JSON: {e}"}
+            yield row if isinstance(row, dict) else {'__error__': "Expected a JSON object"}
+    except (UnicodeDecodeError, csv.Error) as e:
+        yield {'__error__': f"Could not read the rest of the file: {e}"}
+
+def coerce_types(row):
+    """The row with INTEGER_FIELDS as ints; raises ValueError naming a field of the wrong type."""
+    row = dict(row)
+    for field in TEXT_FIELDS:
+        if row.get(field) not in (None, '') and not isinstance(row[field], str):
+            raise ValueError(f"{field} must be a string")
+    for field in INTEGER_FIELDS:
+        value = row.get(field)
+        if value in (None, ''):
+            continue
+        if isinstance(value, bool) or not isinstance(value, (int, str)):
+            raise ValueError(f"{field} must be a whole number")
+        try:
+            row[field] = int(value)
+        except ValueError:
+            raise ValueError(f"{field} must be a whole number") from None
+    return row
+
+def load_providers(conn):
+    """{smtp_server: provider id}; of several providers with one smtp_server, the oldest is used."""
+    return dict(conn.execute("SELECT smtp_server, id FROM providers ORDER BY id DESC"))
+
+def import_accounts(conn, rows, is_valid_email, providers=None):
+    """Insert accounts from an iterable of dicts in chunked transactions.
+
+    `providers` is a load_providers() lookup to start from (it is not
+    modified); it is read from conn if not given. Returns {"imported",
+    "failed", "errors"}; errors lists up to MAX_REPORTED_ERRORS of {"row",
+    "email", "error"}, row numbers starting at 1.
+    """
+    providers = dict(providers) if providers is not None else load_providers(conn)
+    report = {'imported': 0, 'failed': 0, 'errors': []}
+
+    def fail(number, row, error):
+        report['failed'] += 1
+        if len(report['errors']) < MAX_REPORTED_ERRORS:
+            report['errors'].append({'row': number, 'email': row.get('email'), 'error': error})
+
+    numbered = enumerate(rows, start=1)
+    while True:
+        chunk = list(islice(numbered, CHUNK_SIZE))
+        if not chunk:
+            return report
+        valid = []
+        for number, row in chunk:
+            if '__error__' in row:
+                fail(number, row, row['__error__'])
+                continue
+            missing = [field for field in REQUIRED_FIELDS if row.get(field) in (None, '')]
+            if missing:
+                fail(number, row, f"Missing required fields: {', '.join(missing)}")
+                continue
+            try:
+                row = coerce_types(row)
+            except ValueError as e:
+                fail(number, row, str(e))
+                continue
+            if not is_valid_email(row['email']):
+                fail(number, row, "Invalid email")
+            else:
+                valid.append((number, row))
+
+        with conn:
+            emails = [row['email'] for _, row in valid]
+            existing = {email for (email,) in conn.execute(
+                f"SELECT email FROM accounts WHERE email IN ({', '.join('?' * len(emails))})", emails)} if emails else set()
+            accounts = []
+            for number, row in valid:
+                if row['email'] in existing:
+                    fail(number, row, "Account with this email already exists")
+                    continue
+                existing.add(row['email'])
+                provider = providers.get(row['smtp_server'])
+                if provider is None:
+                    cursor = conn.execute('''
+                        INSERT INTO providers (smtp_server, imap_server, provider_name, smtp_port, imap_port)
+                        VALUES (?, ?, ?, ?, ?)
+                    ''', (row['smtp_server'], row['imap_server'], row['provider_name'], row['smtp_port'], row['imap_port']))
+                    provider = providers[row['smtp_server']] = cursor.lastrowid
+                accounts.append((
+                    row['email'],
+                    row['password'],
+                    provider,
+                    row['daily_limit'] if row.get('daily_limit') not in (None, '') else 100,
+                    row['warmup_style'],
+                    row.get('status') or 0,
+                    row.get('language') or None,
+                ))
+            conn.executemany('''
+                INSERT INTO accounts (email, password, provider, daily_limit, warmup_style, created_at, updated_at, status, language)
+                VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP, ?, ?)
+            ''', accounts)
+            report['imported'] += len(accounts)
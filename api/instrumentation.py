@@ -0,0 +1,197 @@
+"""Latency histograms, per-request phase timers, the opt-in profiler and JSON logging.
+
+Code on the hot paths calls record(phase, seconds) (or uses timer(phase)):
+inside a request the time adds up per phase and is observed once per request
+in http_request_phase_seconds{route, phase}; outside one (workers, the
+dispatcher) it goes to background_phase_seconds_total. SMTP phases also feed
+smtp_phase_duration_seconds per call. Everything renders in the Prometheus
+text format for /api/debug/metrics.
+"""
+import io
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+SMTP_PHASES = {'smtp_connect': 'connect', 'smtp_tls': 'tls', 'smtp_login': 'login', 'smtp_send': 'send'}
+
+# The profiler only runs when the process was started with this set to 1,
+# and then only for requests carrying the header
+PROFILE_ENV = 'EMAIL_WARMUP_PROFILING'
+PROFILE_HEADER = 'X-Profile'
+PROFILE_LINES = 40
+
+LOG_LEVEL_ENV = 'EMAIL_WARMUP_LOG_LEVEL'
+
+_local = threading.local()
+
+def _labels(names, values):
+    return ','.join(f'{name}="{str(value)}"' for name, value in zip(names, values))
+
+class Histogram:
+    def __init__(self, name, help, labels, buckets=BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def observe(self, value, *label_values):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = [(key, list(counts), total, count) for key, (counts, total, count) in sorted(self._series.items())]
+        for key, counts, total, count in series:
+            labels = _labels(self.labels, key)
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, '+Inf'), counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{{{labels}{"," if labels else ""}le="{bound}"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{labels}}} {total}")
+            lines.append(f"{self.name}_count{{{labels}}} {count}")
+        return lines
+
+class Counter:
+    def __init__(self, name, help, labels):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, value, *label_values):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = sorted(self._values.items())
+        lines += [f"{self.name}{{{_labels(self.labels, key)}}} {value}" for key, value in values]
+        return lines
+
+REQUEST_SECONDS = Histogram('http_request_duration_seconds', "Time to serve a request.", ('method', 'route', 'status'))
+PHASE_SECONDS = Histogram('http_request_phase_seconds', "Time per request spent in SQL, JSON serialization and SMTP phases.",
+                          ('route', 'phase'))
+SMTP_SECONDS = Histogram('smtp_phase_duration_seconds', "SMTP connect, TLS, login and send times.", ('phase',))
+BACKGROUND_SECONDS = Counter('background_phase_seconds_total', "Time spent in each phase outside requests.", ('phase',))
+METRICS = [REQUEST_SECONDS, PHASE_SECONDS, SMTP_SECONDS, BACKGROUND_SECONDS]
+
+def record(phase, seconds):
+    totals = getattr(_local, 'totals', None)
+    if totals is not None:
+        totals[phase] = totals.get(phase, 0.0) + seconds
+    else:
+        BACKGROUND_SECONDS.inc(seconds, phase)
+    if phase in SMTP_PHASES:
+        SMTP_SECONDS.observe(seconds, SMTP_PHASES[phase])
+
+@contextmanager
+def timer(phase):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(phase, time.perf_counter() - start)
+
+def render(extra=()):
+    """All metrics, plus any extra pre-rendered lines, in the Prometheus text format."""
+    lines = [line for metric in METRICS for line in metric.render()]
+    return '\n'.join([*lines, *extra]) + '\n'
+
+def profile_report(profiler):
+    import pstats
+    out = io.StringIO()
+    pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(PROFILE_LINES)
+    return out.getvalue()
+
+def instrument(app):
+    """Time every request of app and its JSON serialization, and honour PROFILE_HEADER when enabled."""
+    from flask import request
+    from flask.json.provider import DefaultJSONProvider
+
+    class TimedJSONProvider(DefaultJSONProvider):
+        def dumps(self, obj, **kwargs):
+            with timer('serialization'):
+                return super().dumps(obj, **kwargs)
+
+    app.json = TimedJSONProvider(app)
+    profiling = os.environ.get(PROFILE_ENV) == '1'
+
+    @app.before_request
+    def start_timers():
+        _local.totals = {}
+        _local.start = time.perf_counter()
+        _local.status = None
+        _local.profiler = None
+        if profiling and request.headers.get(PROFILE_HEADER):
+            import cProfile
+            _local.profiler = cProfile.Profile()
+            _local.profiler.enable()
+
+    @app.after_request
+    def keep_status(response):
+        _local.status = response.status_code
+        if _local.profiler is not None:
+            _local.profiler.disable()
+            # The report replaces the body; the real status travels in a header
+            report = profile_report(_local.profiler)
+            response = app.response_class(report, mimetype='text/plain')
+            response.headers['X-Profile-Status'] = str(_local.status)
+        return response
+
+    @app.teardown_request
+    def observe(error=None):
+        # Runs for unhandled exceptions too, which skip after_request: those count as 500s
+        start = getattr(_local, 'start', None)
+        if start is not None:
+            elapsed = time.perf_counter() - start
+            route = request.url_rule.rule if request.url_rule else 'unmatched'
+            REQUEST_SECONDS.observe(elapsed, request.method, route, _local.status or 500)
+            for phase, seconds in _local.totals.items():
+                PHASE_SECONDS.observe(seconds, route, phase)
+        profiler = getattr(_local, 'profiler', None)
+        if profiler is not None:
+            profiler.disable()
+        _local.totals = _local.profiler = _local.start = _local.status = None
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message and any `extra` fields."""
+    STANDARD = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record, '%Y-%m-%dT%H:%M:%S'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        entry.update((key, value) for key, value in vars(record).items() if key not in self.STANDARD)
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+def configure_logging(level=None):
+    """Send JSON log lines to stderr, at EMAIL_WARMUP_LOG_LEVEL (default INFO), unless logging is set up already."""
+    root = logging.getLogger()
+    if root.handlers:
+        return
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(JSONFormatter())
+    root.addHandler(handler)
+    root.setLevel(level or os.environ.get(LOG_LEVEL_ENV, 'INFO').upper())
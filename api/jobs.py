@@ -0,0 +1,312 @@
+import argparse
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import closing
+from datetime import date, datetime
+from multiprocessing import Process
+
+from db import configure, insert_records
+
+log = logging.getLogger(__name__)
+
+CLAIMED_JOB_QUERY = """
+    SELECT j.id, j.sender, j.receiver, j.template, j.reply_to, j.attempts,
+           s.email AS sender_email, s.password, s.language, p.smtp_server, p.smtp_port,
+           r.email AS receiver_email
+    FROM send_jobs j
+    JOIN accounts s ON s.id = j.sender
+    JOIN accounts r ON r.id = j.receiver
+    LEFT JOIN providers p ON p.id = s.provider
+    WHERE j.id IN ({ids})
+"""
+
+class JobQueue:
+    """Durable send queue in the `send_jobs` table.
+
+    Workers claim due jobs under a lease; a job whose lease runs out without
+    being completed (the worker died) becomes claimable again, and counts as
+    a failed attempt. Completed sends are written to `records`.
+    `scheduled_days` remembers which senders already have a day's jobs. Both
+    tables are created by db.migrate.
+    """
+
+    def __init__(self, db_path, lease_seconds=60, max_attempts=5, retry_delay=30):
+        self.db_path = db_path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return configure(conn)
+
+    def enqueue_many(self, jobs):
+        """Insert (sender, receiver, template, run_at) tuples in one transaction."""
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany('''
+                INSERT INTO send_jobs (sender, receiver, template, run_at)
+                VALUES (?, ?, ?, ?)
+            ''', jobs)
+            conn.execute("COMMIT")
+        return len(jobs)
+
+    def enqueue_day(self, day, senders, jobs):
+        """Enqueue `day`'s jobs of the senders (account ids) not yet scheduled for it; returns how many were queued.
+
+        Marking the senders and queueing their jobs is one transaction, so
+        schedulers running at once (the API and every worker shard) never
+        queue a sender's day twice.
+        """
+        day = day.isoformat()
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DELETE FROM scheduled_days WHERE day < ?", (day,))
+            scheduled = {sender for (sender,) in conn.execute("SELECT sender FROM scheduled_days WHERE day = ?", (day,))}
+            new = set(senders) - scheduled
+            conn.executemany("INSERT INTO scheduled_days (day, sender) VALUES (?, ?)", [(day, sender) for sender in new])
+            jobs = [job for job in jobs if job[0] in new]
+            conn.executemany('''
+                INSERT INTO send_jobs (sender, receiver, template, run_at)
+                VALUES (?, ?, ?, ?)
+            ''', jobs)
+            conn.execute("COMMIT")
+        return len(jobs)
+
+    def claim(self, worker_id, limit=50, partition=None):
+        """Atomically lease up to `limit` due jobs for this worker.
+
+        `partition`, a predicate on the sender's account id, restricts the
+        claim to the senders this worker owns (see worker.py).
+        """
+        now = time.time()
+        conn = self._connect()
+        try:
+            if partition is not None:
+                conn.create_function('in_partition', 1, partition, deterministic=True)
+            conn.execute("BEGIN IMMEDIATE")
+            ids = [row[0] for row in conn.execute(f'''
+                SELECT id FROM send_jobs
+                WHERE status = 'queued' AND run_at <= ?{' AND in_partition(sender)' if partition is not None else ''}
+                ORDER BY run_at
+                LIMIT ?
+            ''', (now, limit))]
+            if not ids:
+                conn.execute("COMMIT")
+                return []
+            placeholders = ", ".join("?" * len(ids))
+            conn.execute(f'''
+                UPDATE send_jobs
+                SET status = 'leased', lease_owner = ?, lease_until = ?
+                WHERE id IN ({placeholders})
+            ''', (worker_id, now + self.lease_seconds, *ids))
+            jobs = [dict(row) for row in conn.execute(CLAIMED_JOB_QUERY.format(ids=placeholders), ids)]
+            conn.execute("COMMIT")
+            return jobs
+        except sqlite3.Error:
+            # BEGIN IMMEDIATE itself fails when the database stays locked
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def renew(self, worker_id, jobs):
+        """Extend this worker's lease on the claimed jobs it still holds; returns how many it holds."""
+        if not jobs:
+            return 0
+        ids = [job['id'] for job in jobs]
+        with closing(self._connect()) as conn:
+            return conn.execute(f'''
+                UPDATE send_jobs SET lease_until = ?
+                WHERE status = 'leased' AND lease_owner = ? AND id IN ({", ".join("?" * len(ids))})
+            ''', (time.time() + self.lease_seconds, worker_id, *ids)).rowcount
+
+    def complete(self, worker_id, results):
+        """Record (job, ok, error) results: successes go to `records`, failures are retried.
+
+        Only jobs this worker still holds the lease of are touched; a job
+        whose lease ran out belongs to whoever claims it next.
+        """
+        now = time.time()
+        sent_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            done = []
+            for job, ok, _ in results:
+                if ok and conn.execute('''
+                    UPDATE send_jobs SET status = 'done', lease_owner = NULL, lease_until = NULL
+                    WHERE id = ? AND lease_owner = ?
+                ''', (job['id'], worker_id)).rowcount:
+                    done.append((job['template'], job['sender'], job['receiver'], job['reply_to'], job.get('message_id'),
+                                 sent_time, job.get('subject')))
+            insert_records(conn, done)
+            conn.executemany('''
+                UPDATE send_jobs
+                SET status = CASE WHEN attempts + 1 >= ? THEN 'failed' ELSE 'queued' END,
+                    attempts = attempts + 1,
+                    run_at = ?,
+                    last_error = ?,
+                    lease_owner = NULL,
+                    lease_until = NULL
+                WHERE id = ? AND lease_owner = ?
+            ''', [(self.max_attempts, now + self.retry_delay * 2 ** job['attempts'], error, job['id'], worker_id)
+                  for job, ok, error in results if not ok])
+            conn.execute("COMMIT")
+
+    def requeue_expired(self):
+        """Put jobs whose lease ran out back in the queue, or fail them after max_attempts."""
+        with closing(self._connect()) as conn:
+            cursor = conn.execute('''
+                UPDATE send_jobs
+                SET status = CASE WHEN attempts + 1 >= ? THEN 'failed' ELSE 'queued' END,
+                    attempts = attempts + 1,
+                    last_error = 'Lease expired',
+                    lease_owner = NULL,
+                    lease_until = NULL
+                WHERE status = 'leased' AND lease_until < ?
+            ''', (self.max_attempts, time.time()))
+            return cursor.rowcount
+
+    def counts(self):
+        with closing(self._connect()) as conn:
+            rows = conn.execute("SELECT status, COUNT(*) FROM send_jobs GROUP BY status").fetchall()
+        return {status: count for status, count in rows}
+
+def schedule_day(queue, day=None, senders=None):
+    """Enqueue the rest of `day`'s ramp plan (see planner.plan_day) for all active accounts.
+
+    With `senders`, a predicate on the account id, only those accounts' sends
+    are queued; receivers are still drawn from every active account. Accounts
+    that already have `day` scheduled are skipped, so calling it again queues
+    only newly active accounts.
+    """
+    from planner import load_accounts, plan_day
+    day = day or date.today()
+    with closing(queue._connect()) as conn:
+        accounts = load_accounts(conn)
+    plan = plan_day(accounts, day)
+    now = time.time()
+    ids = [sender for sender in accounts['id'].tolist() if senders is None or senders(sender)]
+    return queue.enqueue_day(day, ids, [job for job in plan.jobs() if job[3] >= now])
+
+def keep_leased(queue, worker_id, jobs, done):
+    """Renew the lease on `jobs` every third of a lease until `done` is set.
+
+    A batch can outlast one lease (the rate limiter may hold each send back
+    for up to its max_wait); without renewal another worker would requeue
+    the jobs and send them again.
+    """
+    while not done.wait(queue.lease_seconds / 3):
+        try:
+            queue.renew(worker_id, jobs)
+        except sqlite3.Error as e:
+            log.error("Could not renew job leases: %s", e, extra={'worker_id': worker_id, 'jobs': len(jobs)})
+
+def run_worker(db_path, send_func, batch_size=50, idle_sleep=1.0, stop_when_empty=False, send_many=None,
+               partition=None, stop=None, lease_seconds=60):
+    """Claim, send and complete jobs until the queue is empty (or forever, or until `stop` is set).
+
+    With send_many, each claimed batch goes to it whole (see send_jobs)
+    instead of one send_func call per job. `partition` is passed on to
+    JobQueue.claim. Leases are renewed while a batch is sending.
+    """
+    queue = JobQueue(db_path, lease_seconds=lease_seconds)
+    worker_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+    next_requeue = 0
+    while stop is None or not stop.is_set():
+        if time.time() >= next_requeue:
+            queue.requeue_expired()
+            next_requeue = time.time() + queue.lease_seconds / 2
+        jobs = queue.claim(worker_id, batch_size, partition)
+        if not jobs:
+            if stop_when_empty:
+                return
+            if stop is not None:
+                stop.wait(idle_sleep)
+            else:
+                time.sleep(idle_sleep)
+            continue
+        sending = threading.Event()
+        renewer = threading.Thread(target=keep_leased, args=(queue, worker_id, jobs, sending), name="job-leases", daemon=True)
+        renewer.start()
+        try:
+            if send_many is not None:
+                results = send_many(jobs)
+            else:
+                results = []
+                for job in jobs:
+                    try:
+                        results.append((job, bool(send_func(job)), None))
+                    except Exception as e:
+                        results.append((job, False, str(e)))
+        finally:
+            sending.set()
+            renewer.join()
+        queue.complete(worker_id, results)
+
+def send_job(job):
+    from sending import send_warmup_email
+    account = {
+        'email': job['sender_email'],
+        'password': job['password'],
+        'smtp_server': job['smtp_server'],
+        'smtp_port': job['smtp_port'],
+        'language': job['language'],
+    }
+    sent = send_warmup_email(account, job['receiver_email'], job['template'])
+    if sent is None:
+        return False
+    # Recorded with the send, so replies can quote the subject
+    job['message_id'], job['template'], job['subject'] = sent
+    return True
+
+def send_jobs(jobs):
+    """Send claimed jobs grouped by sender, each group pipelined over one SMTP session; returns run_worker results."""
+    from sending import render_warmup, send_batch
+    groups = {}
+    for job in jobs:
+        groups.setdefault((job['sender_email'], job['smtp_server'], job['smtp_port']), []).append(job)
+    results = []
+    for group in groups.values():
+        account = {
+            'email': group[0]['sender_email'],
+            'password': group[0]['password'],
+            'smtp_server': group[0]['smtp_server'],
+            'smtp_port': group[0]['smtp_port'],
+            'language': group[0]['language'],
+        }
+        try:
+            messages = []
+            for job in group:
+                message_id, message, job['template'], job['subject'] = render_warmup(account, job['receiver_email'], job['template'])
+                messages.append((job['receiver_email'], message_id, message))
+            message_ids = send_batch(account, messages)
+        except Exception as e:
+            results += [(job, False, str(e)) for job in group]
+            continue
+        for job, message_id in zip(group, message_ids):
+            job['message_id'] = message_id
+            results.append((job, message_id is not None, None))
+    return results
+
+if __name__ == '__main__':
+    from instrumentation import configure_logging
+    from state import DB_PATH
+    configure_logging()
+    parser = argparse.ArgumentParser(description="Run warmup send workers against the job queue.")
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--batch-size', type=int, default=50)
+    parser.add_argument('--db', default=DB_PATH)
+    args = parser.parse_args()
+    processes = [Process(target=run_worker, args=(args.db, send_job, args.batch_size),
+                         kwargs={'send_many': send_jobs}) for _ in range(args.workers)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
@@ -0,0 +1,135 @@
+"""Pre-aggregated sent/received/spam series for the dashboard.
+
+CounterAggregator writes every flush into hourly, daily and weekly rollup
+tables at three scopes: per account (key = email), per provider (key =
+accounts.provider) and in total (key = ''). A series is then one primary key
+range scan over a single rollup table, whatever the size of records.
+"""
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+PERIODS = {
+    'hour': ('metrics_hourly', timedelta(hours=1)),
+    'day': ('metrics_daily', timedelta(days=1)),
+    'week': ('metrics_weekly', timedelta(weeks=1)),
+}
+DEFAULT_DAYS = 30
+HOURLY_DAYS = 3      # ranges up to this long default to hourly points
+DAILY_DAYS = 180     # and up to this long to daily ones
+MAX_POINTS = 1000    # per series; longer ranges need a coarser granularity
+
+def bucket(period, moment):
+    """Start of the hour, day or (Monday-based) week containing moment, as stored in the rollups."""
+    if period == 'hour':
+        return moment.strftime('%Y-%m-%d %H:00')
+    day = moment.date()
+    if period == 'week':
+        day -= timedelta(days=day.weekday())
+    return day.isoformat()
+
+def parse_bucket(period, value):
+    return datetime.strptime(value, '%Y-%m-%d %H:00' if period == 'hour' else '%Y-%m-%d')
+
+def account_providers(conn, emails):
+    """email -> accounts.provider for the emails that belong to an account."""
+    emails = list(emails)
+    providers = {}
+    for start in range(0, len(emails), 500):
+        chunk = emails[start:start + 500]
+        providers.update(conn.execute(f'''
+            SELECT email, provider FROM accounts WHERE email IN ({', '.join('?' * len(chunk))})
+        ''', chunk).fetchall())
+    return providers
+
+def write_rollups(conn, pending):
+    """Add {(email, hour): [sent, received, spam]} increments to every rollup table and scope."""
+    providers = account_providers(conn, {email for email, _ in pending})
+    for period, (table, _) in PERIODS.items():
+        rollup = defaultdict(lambda: [0, 0, 0])
+        for (email, hour), counts in pending.items():
+            key = bucket(period, datetime.strptime(hour, '%Y-%m-%d %H:00'))
+            scopes = [('account', email), ('total', '')]
+            if providers.get(email) is not None:
+                scopes.append(('provider', str(providers[email])))
+            for scope, name in scopes:
+                current = rollup[scope, name, key]
+                for i, count in enumerate(counts):
+                    current[i] += count
+        conn.executemany(f'''
+            INSERT INTO {table} (scope, key, bucket, sent, received, spam)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (scope, key, bucket) DO UPDATE SET
+                sent = sent + excluded.sent,
+                received = received + excluded.received,
+                spam = spam + excluded.spam
+        ''', [(*key, *counts) for key, counts in rollup.items()])
+
+def parse_moment(value):
+    """An ISO date or datetime as naive local time, which the rollup buckets are in."""
+    moment = datetime.fromisoformat(value)
+    if moment.tzinfo is not None:
+        try:
+            moment = moment.astimezone().replace(tzinfo=None)
+        except OverflowError:
+            raise ValueError(f"{value} is out of range") from None
+    return moment
+
+def parse_range(args, now=None):
+    """(period, start, end) from request args start, end (ISO dates or datetimes) and granularity.
+
+    Defaults to the last DEFAULT_DAYS days, and to the finest granularity
+    that keeps the number of points reasonable. A series has at most
+    MAX_POINTS points. Raises ValueError.
+    """
+    now = now or datetime.now()
+    end = parse_moment(args['end']) if args.get('end') else now
+    start = parse_moment(args['start']) if args.get('start') else end - timedelta(days=DEFAULT_DAYS)
+    if start > end:
+        raise ValueError("start must not be after end")
+    period = args.get('granularity')
+    if period is None:
+        days = (end - start).days
+        period = 'hour' if days <= HOURLY_DAYS else 'day' if days <= DAILY_DAYS else 'week'
+    if period not in PERIODS:
+        raise ValueError(f"granularity must be one of {', '.join(PERIODS)}")
+    _, step = PERIODS[period]
+    first, last = parse_bucket(period, bucket(period, start)), parse_bucket(period, bucket(period, end))
+    if (last - first) // step + 1 > MAX_POINTS:
+        raise ValueError(f"more than {MAX_POINTS} {period} buckets; choose a shorter range or a coarser granularity")
+    if last > datetime.max - step:
+        raise ValueError("end is out of range")
+    return period, start, end
+
+def series(conn, period, scope, key, start, end):
+    """Every bucket from start to end for one key, zero-filled: [{bucket, sent, received, spam}]."""
+    table, _ = PERIODS[period]
+    rows = conn.execute(f'''
+        SELECT bucket, sent, received, spam
+        FROM {table}
+        WHERE scope = ? AND key = ? AND bucket BETWEEN ? AND ?
+    ''', (scope, key, bucket(period, start), bucket(period, end))).fetchall()
+    return fill(period, start, end, {row[0]: row[1:] for row in rows})
+
+def all_series(conn, period, scope, start, end):
+    """series() for every key of a scope, as {key: points}."""
+    table, _ = PERIODS[period]
+    found = defaultdict(dict)
+    for key, name, sent, received, spam in conn.execute(f'''
+        SELECT key, bucket, sent, received, spam
+        FROM {table}
+        WHERE scope = ? AND bucket BETWEEN ? AND ?
+    ''', (scope, bucket(period, start), bucket(period, end))):
+        found[key][name] = (sent, received, spam)
+    return {key: fill(period, start, end, values) for key, values in found.items()}
+
+def fill(period, start, end, values):
+    _, step = PERIODS[period]
+    points = []
+    moment, last = parse_bucket(period, bucket(period, start)), bucket(period, end)
+    while True:
+        name = bucket(period, moment)
+        if name > last:
+            return points
+        sent, received, spam = values.get(name, (0, 0, 0))
+        points.append({'bucket': name, 'sent': sent, 'received': received, 'spam': spam})
+        moment += step
@@ -0,0 +1,91 @@
+import logging
+import sqlite3
+
+from flask import Blueprint, jsonify, request
+
+import state
+from db import connect, query_all, get_account
+from instrumentation import render
+from metrics import parse_range, series, all_series
+from state import DB_PATH
+
+metrics_bp = Blueprint('metrics', __name__)
+log = logging.getLogger(__name__)
+
+@metrics_bp.route('/api/debug/metrics', methods=['GET'])
+def debug_metrics():
+    """Request, phase and SMTP histograms plus read cache counters, in the Prometheus text format."""
+    extra = []
+    cache = state.peek('read_cache')
+    if cache is not None:
+        for name in ('hits', 'misses'):
+            extra += [f"# HELP read_cache_{name}_total Read cache {name} per table.", f"# TYPE read_cache_{name}_total counter"]
+            extra += [f'read_cache_{name}_total{{table="{table}"}} {counts[name]}' for table, counts in cache.status().items()]
+    return render(extra), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+@metrics_bp.route('/api/cache/status', methods=['GET'])
+def cache_status():
+    return jsonify(state.read_cache.status())
+
+@metrics_bp.route('/api/reputations', methods=['GET'])
+def get_reputations():
+    domain = request.args.get('domain')
+    try:
+        with connect(DB_PATH) as conn:
+            rows = query_all(conn, f"""
+                SELECT domain, rep_value, spam_rate, reply_rate, sent_weight, created_at, updated_at
+                FROM reputations
+                {'WHERE domain = ?' if domain else ''}
+                ORDER BY domain
+            """, (domain.lower(),) if domain else ())
+        if domain and not rows:
+            return jsonify({"error": "No reputation for this domain yet."}), 404
+        return jsonify(rows[0] if domain else rows)
+    except sqlite3.Error as e:
+        log.error("Database error: %s", e)
+        return jsonify({"error": "Database error occurred. Please try again later."}), 500
+
+@metrics_bp.route('/api/reputations/refresh', methods=['POST'])
+def refresh_reputations():
+    # Pulls in NumPy, so only imported when a refresh is asked for
+    from reputation import update_reputations
+    try:
+        with connect(DB_PATH) as conn:
+            return jsonify(update_reputations(conn))
+    except sqlite3.Error as e:
+        log.error("Database error: %s", e)
+        return jsonify({"error": "Database error occurred. Please try again later."}), 500
+
+def metrics_response(scope, key=None):
+    try:
+        period, start, end = parse_range(request.args)
+    except ValueError as e:
+        return jsonify({"error": f"Invalid range: {e}"}), 400
+    try:
+        with connect(DB_PATH) as conn:
+            if scope == 'account':
+                account = get_account(conn, "id = ?", (key,))
+                if account is None:
+                    return jsonify({"error": "Account not found"}), 404
+                key = account['email']
+            points = all_series(conn, period, scope, start, end) if key is None else series(conn, period, scope, key, start, end)
+        return jsonify({'granularity': period, 'start': start.isoformat(), 'end': end.isoformat(), 'series': points})
+    except sqlite3.Error as e:
+        log.error("Database error: %s", e)
+        return jsonify({"error": "Database error occurred. Please try again later."}), 500
+
+@metrics_bp.route('/api/metrics', methods=['GET'])
+def total_metrics():
+    return metrics_response('total', '')
+
+@metrics_bp.route('/api/metrics/providers', methods=['GET'])
+def provider_metrics():
+    return metrics_response('provider')
+
+@metrics_bp.route('/api/metrics/provider/<int:id>', methods=['GET'])
+def one_provider_metrics(id):
+    return metrics_response('provider', str(id))
+
+@metrics_bp.route('/api/metrics/account/<int:id>', methods=['GET'])
+def account_metrics(id):
+    return metrics_response('account', id)
@@ -0,0 +1,179 @@
+import threading
+import time
+from collections import deque
+from datetime import date
+
+REPEAT_WINDOW = 3600        # seconds before the same sender may pick the same receiver again
+DAY_SECONDS = 24 * 3600
+DEFAULT_CAP = 100           # receives per day for accounts without a daily_limit
+MAX_PROBES = 16             # candidates looked at per pick before giving up
+
+class _Rotation:
+    """Keys taken in turn; add and remove are O(1) (the last key fills the gap)."""
+
+    def __init__(self):
+        self.keys = []
+        self.index = {}
+        self.cursor = 0
+
+    def __len__(self):
+        return len(self.keys)
+
+    def add(self, key):
+        self.index[key] = len(self.keys)
+        self.keys.append(key)
+
+    def remove(self, key):
+        position = self.index.pop(key)
+        last = self.keys.pop()
+        if position < len(self.keys):
+            self.keys[position] = last
+            self.index[last] = position
+
+    def next(self):
+        if self.cursor >= len(self.keys):
+            self.cursor = 0
+        key = self.keys[self.cursor]
+        self.cursor += 1
+        return key
+
+class PairingEngine:
+    """Hands out warmup receivers for a sender in constant time.
+
+    Active accounts are indexed by provider and by recipient domain. A pick
+    chooses the provider by smooth weighted round-robin (weight: its number of
+    active accounts, so every receiver gets about the same share) and then
+    the provider's next account in turn. A candidate is skipped if it is the
+    sender, has reached its daily receive cap (its daily_limit), its domain
+    has reached `domain_cap` receives today, or it was paired with the
+    sender within the repeat window; after MAX_PROBES skips the pick
+    returns None. The repeat window is `repeat_window` seconds, shortened
+    when there are too few accounts for the sender to reach its daily_limit
+    with pairs that far apart. Accounts are added and removed one at a time as their
+    status changes. The cost of a pick depends on the number of providers,
+    never on the number of accounts.
+    """
+
+    def __init__(self, repeat_window=REPEAT_WINDOW, default_cap=DEFAULT_CAP, domain_cap=None):
+        self.repeat_window = repeat_window
+        self.default_cap = default_cap
+        self.domain_cap = domain_cap
+        self._lock = threading.Lock()
+        self._accounts = {}
+        self._providers = {}    # provider -> _Rotation of its account ids
+        self._domains = {}      # domain -> active accounts
+        self._current = {}      # provider -> smooth weighted round-robin state
+        self._received = {}
+        self._domain_received = {}
+        self._day = date.today()
+        self._recent = {}       # (sender, receiver) -> time paired
+        self._expiry = deque()  # (time paired, pair), oldest first
+
+    def __len__(self):
+        return len(self._accounts)
+
+    @staticmethod
+    def _key(account):
+        return account.get('provider'), account['email'].rpartition('@')[2].lower()
+
+    def add(self, account):
+        """Index an active account (a dict with id, email, provider and daily_limit), or update it."""
+        with self._lock:
+            if account['id'] in self._accounts:
+                self._remove(account['id'])
+            provider, domain = self._key(account)
+            self._accounts[account['id']] = account
+            members = self._providers.get(provider)
+            if members is None:
+                members = self._providers[provider] = _Rotation()
+                self._current[provider] = 0
+            members.add(account['id'])
+            self._domains[domain] = self._domains.get(domain, 0) + 1
+
+    def remove(self, account_id):
+        """Drop an account that is no longer active."""
+        with self._lock:
+            if account_id in self._accounts:
+                self._remove(account_id)
+
+    def _remove(self, account_id):
+        provider, domain = self._key(self._accounts.pop(account_id))
+        members = self._providers[provider]
+        members.remove(account_id)
+        if not members:
+            del self._providers[provider], self._current[provider]
+        self._domains[domain] -= 1
+        if not self._domains[domain]:
+            del self._domains[domain]
+
+    def sync(self, accounts):
+        """Bring the index in line with the active accounts {id: account}; returns (added or changed, removed)."""
+        removed = [account_id for account_id in self._accounts if account_id not in accounts]
+        for account_id in removed:
+            self.remove(account_id)
+        changed = [account for account_id, account in accounts.items() if self._accounts.get(account_id) != account]
+        for account in changed:
+            self.add(account)
+        return len(changed), len(removed)
+
+    def _next_provider(self, total):
+        # Smooth weighted round-robin (as in nginx): spreads each provider's turns evenly
+        best = None
+        for provider, members in self._providers.items():
+            self._current[provider] += len(members)
+            if best is None or self._current[provider] > self._current[best]:
+                best = provider
+        self._current[best] -= total
+        return best
+
+    def _window(self, sender_id, total):
+        """Seconds before this sender may repeat a receiver, with `total` active accounts."""
+        sender = self._accounts.get(sender_id) or {}
+        return min(self.repeat_window, DAY_SECONDS * (total - 1) / (sender.get('daily_limit') or self.default_cap))
+
+    def _expire(self, now):
+        while self._expiry and self._expiry[0][0] <= now - self.repeat_window:
+            paired_at, pair = self._expiry.popleft()
+            if self._recent.get(pair) == paired_at:
+                del self._recent[pair]
+
+    def pick(self, sender_id, now=None):
+        """A receiver account for the sender, counted against its cap and the repeat window; None if none is free."""
+        now = time.time() if now is None else now
+        with self._lock:
+            if date.today() != self._day:
+                self._day = date.today()
+                self._received.clear()
+                self._domain_received.clear()
+            self._expire(now)
+            total = len(self._accounts)
+            if total < 2:
+                return None
+            window = self._window(sender_id, total)
+            for _ in range(MAX_PROBES):
+                receiver_id = self._providers[self._next_provider(total)].next()
+                paired_at = self._recent.get((sender_id, receiver_id))
+                if receiver_id == sender_id or paired_at is not None and now - paired_at < window:
+                    continue
+                receiver = self._accounts[receiver_id]
+                if self._received.get(receiver_id, 0) >= (receiver.get('daily_limit') or self.default_cap):
+                    continue
+                domain = self._key(receiver)[1]
+                if self.domain_cap is not None and self._domain_received.get(domain, 0) >= self.domain_cap:
+                    continue
+                self._received[receiver_id] = self._received.get(receiver_id, 0) + 1
+                self._domain_received[domain] = self._domain_received.get(domain, 0) + 1
+                self._recent[sender_id, receiver_id] = now
+                self._expiry.append((now, (sender_id, receiver_id)))
+                return receiver
+            return None
+
+    def status(self):
+        with self._lock:
+            return {
+                'accounts': len(self._accounts),
+                'providers': {str(provider): len(members) for provider, members in self._providers.items()},
+                'domains': len(self._domains),
+                'received_today': sum(self._received.values()),
+                'recent_pairs': len(self._recent),
+            }
@@ -0,0 +1,252 @@
+import imaplib
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from db import connect, query_all
+from smtp import EmailManager
+
+log = logging.getLogger(__name__)
+
+MONITORED_ACCOUNTS_QUERY = """
+    SELECT a.id, a.email, a.password, p.imap_server, p.imap_port
+    FROM accounts a
+    JOIN providers p ON p.id = a.provider
+    WHERE a.status = 1 AND p.imap_server IS NOT NULL
+"""
+
+class Mailbox:
+    """One warmup account's IMAP session plus the last UID seen per folder."""
+
+    def __init__(self, account, use_tls=True):
+        self.account = account
+        self.manager = EmailManager(None, 0, account['imap_server'], account['imap_port'],
+                                    account['email'], account['password'], use_tls=use_tls)
+        self.spam_folder = None
+        self.cursors = {}  # folder -> (uidvalidity, last uid seen)
+        self.last_used = 0
+
+    def connect(self):
+        self.manager.connect_imap()
+        self.spam_folder = self.manager.find_spam_folder()
+
+    def detach(self):
+        """Hand over the IMAP session, leaving the mailbox disconnected (its UID cursors are kept)."""
+        conn, self.manager.imap_conn = self.manager.imap_conn, None
+        return conn
+
+    def close(self):
+        logout(self.detach())
+
+    def new_message_ids(self, folder):
+        """Message-IDs that arrived in `folder` since the last poll."""
+        uidvalidity, uidnext = self.manager.select_folder(folder)
+        seen_validity, last_uid = self.cursors.get(folder, (uidvalidity, 0))
+        if seen_validity != uidvalidity:
+            last_uid = 0
+        if uidnext and uidnext - 1 <= last_uid:
+            self.cursors[folder] = (uidvalidity, last_uid)
+            return {}
+        message_ids = self.manager.fetch_message_ids(last_uid)
+        self.cursors[folder] = (uidvalidity, max([last_uid, uidnext - 1, *message_ids]))
+        return message_ids
+
+def logout(conn):
+    try:
+        conn.logout()
+    except (imaplib.IMAP4.error, OSError, AttributeError):
+        pass
+
+def match_records(conn, receiver_id, message_ids):
+    """records rows (id, message_id, sender email) for warmup messages among message_ids."""
+    found = {}
+    ids = list(message_ids)
+    for start in range(0, len(ids), 500):
+        chunk = ids[start:start + 500]
+        for row in query_all(conn, f"""
+            SELECT r.id, r.message_id, s.email AS sender_email
+            FROM records r
+            JOIN accounts s ON s.id = r.sender
+            WHERE r.receiver = ? AND r.message_id IN ({', '.join('?' * len(chunk))})
+        """, (receiver_id, *chunk)):
+            found[row['message_id']] = row
+    return found
+
+class PlacementMonitor:
+    """Polls every active account's INBOX and spam folder for warmup mail.
+
+    Each account keeps one IMAP session between polls and only fetches the
+    Message-ID header of messages above the last UID it saw. Warmup messages
+    found in spam are moved back to INBOX in one batch per mailbox and their
+    records are marked isspam = 1; those found in INBOX get isspam = 0.
+    Mailboxes are polled by a bounded pool of `max_workers` threads. At most
+    `max_sessions` sessions stay open: connecting one more closes the least
+    recently polled idle session, and sessions unused for `idle_seconds` are
+    closed before each poll. A mailbox whose poll fails is logged, counted
+    in `errors` and reconnected on the next poll. All warmup messages found
+    are handed to `replies` (a ReplyEngine), if given.
+    """
+
+    def __init__(self, db_path, max_workers=32, poll_interval=60, counters=None, replies=None, use_tls=True,
+                 max_sessions=256, idle_seconds=300):
+        self.db_path = db_path
+        self.max_workers = max_workers
+        # Sessions being polled cannot be closed, so there is room for one per worker
+        self.max_sessions = max(max_sessions, max_workers)
+        self.idle_seconds = idle_seconds
+        self.poll_interval = poll_interval
+        self.counters = counters
+        self.replies = replies
+        self.use_tls = use_tls
+        self._mailboxes = {}
+        self._sessions = OrderedDict()  # email -> connected Mailbox, least recently polled first
+        self._polling = set()           # emails of the mailboxes being polled
+        self._sessions_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+        self.polls = 0
+        self.rescued = 0
+        self.inbox = 0
+        self.errors = 0
+        self.last_poll_seconds = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        with self._lock:
+            if self.running:
+                return False
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name="placement-monitor", daemon=True)
+            self._thread.start()
+            return True
+
+    def stop(self, timeout=30):
+        with self._lock:
+            if not self.running:
+                return False
+            self._stopping.set()
+            self._thread.join(timeout)
+            return True
+
+    def status(self):
+        return {
+            'running': self.running,
+            'mailboxes': len(self._mailboxes),
+            'open_sessions': len(self._sessions),
+            'polls': self.polls,
+            'rescued_from_spam': self.rescued,
+            'seen_in_inbox': self.inbox,
+            'errors': self.errors,
+            'last_poll_seconds': self.last_poll_seconds,
+        }
+
+    def _run(self):
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="placement") as executor:
+            while not self._stopping.is_set():
+                try:
+                    self.poll_once(executor)
+                except sqlite3.Error as e:
+                    log.error("Placement monitor could not poll: %s", e)
+                self._stopping.wait(self.poll_interval)
+        for mailbox in self._mailboxes.values():
+            mailbox.close()
+        self._mailboxes.clear()
+        self._sessions.clear()
+
+    def poll_once(self, executor):
+        """Poll all monitored mailboxes once and store the placements found."""
+        start = time.perf_counter()
+        with connect(self.db_path) as conn:
+            accounts = query_all(conn, MONITORED_ACCOUNTS_QUERY)
+        active = {account['email'] for account in accounts}
+        for email in [email for email in self._mailboxes if email not in active]:
+            self._sessions.pop(email, None)
+            self._mailboxes.pop(email).close()
+        now = time.monotonic()
+        for email in [email for email, mailbox in self._sessions.items() if now - mailbox.last_used > self.idle_seconds]:
+            self._sessions.pop(email).close()
+        for account in accounts:
+            if account['email'] not in self._mailboxes:
+                self._mailboxes[account['email']] = Mailbox(account, self.use_tls)
+
+        placements = []
+        for result in executor.map(self._poll_mailbox, list(self._mailboxes.values())):
+            placements.extend(result)
+        spam = [(record_id,) for record_id, isspam in placements if isspam]
+        inbox = [(record_id,) for record_id, isspam in placements if not isspam]
+        with connect(self.db_path) as conn:
+            conn.executemany("UPDATE records SET isspam = 1 WHERE id = ?", spam)
+            conn.executemany("UPDATE records SET isspam = 0 WHERE id = ? AND isspam IS NULL", inbox)
+        self.rescued += len(spam)
+        self.inbox += len(inbox)
+        if self.replies and placements:
+            self.replies.add([record_id for record_id, _ in placements])
+        self.polls += 1
+        self.last_poll_seconds = time.perf_counter() - start
+        return placements
+
+    def _connect(self, mailbox):
+        """Open the mailbox's session, first closing the least recently polled idle ones beyond max_sessions."""
+        with self._sessions_lock:
+            excess = len(self._sessions) + 1 - self.max_sessions
+            idle = [email for email in self._sessions if email not in self._polling][:max(excess, 0)]
+            # Detached under the lock, so a poll starting meanwhile sees the mailbox disconnected
+            evicted = [self._sessions.pop(email).detach() for email in idle]
+            # Counted from now on, so concurrent connects leave room for it
+            self._sessions[mailbox.account['email']] = mailbox
+        for conn in evicted:
+            logout(conn)
+        mailbox.connect()
+
+    def _failed(self, mailbox):
+        with self._sessions_lock:
+            self.errors += 1
+            self._sessions.pop(mailbox.account['email'], None)
+        mailbox.close()
+
+    def _poll_mailbox(self, mailbox):
+        """Returns [(record id, isspam)] for warmup messages new in this mailbox."""
+        email = mailbox.account['email']
+        with self._sessions_lock:
+            self._polling.add(email)
+            connected = mailbox.manager.imap_conn is not None
+        placements = []
+        try:
+            if not connected:
+                self._connect(mailbox)
+            with connect(self.db_path) as conn:
+                spam_ids = mailbox.new_message_ids(mailbox.spam_folder)
+                matched = match_records(conn, mailbox.account['id'], spam_ids.values())
+                if matched:
+                    # Spam folder is still selected
+                    mailbox.manager.move_to_inbox([uid for uid, message_id in spam_ids.items() if message_id in matched])
+                    for row in matched.values():
+                        placements.append((row['id'], True))
+                        if self.counters:
+                            self.counters.incr(row['sender_email'], spam=1)
+                inbox_ids = mailbox.new_message_ids('INBOX')
+                rescued = set(matched)
+                for message_id, row in match_records(conn, mailbox.account['id'], inbox_ids.values()).items():
+                    if message_id not in rescued:
+                        placements.append((row['id'], False))
+        except (imaplib.IMAP4.error, OSError) as e:
+            log.warning("Placement monitor failed: %s", e, extra={'account': email})
+            self._failed(mailbox)
+        except Exception:
+            # An unexpected server reply or database error must not end the other mailboxes' polls
+            log.exception("Placement monitor failed", extra={'account': email})
+            self._failed(mailbox)
+        finally:
+            with self._sessions_lock:
+                self._polling.discard(email)
+                if email in self._sessions:
+                    self._sessions.move_to_end(email)
+                    mailbox.last_used = time.monotonic()
+        return placements
@@ -0,0 +1,98 @@
+import time
+from datetime import date, datetime
+
+import numpy as np
+
+# warmup_style -> ramp curve
+LINEAR, EXPONENTIAL, FLAT = 1, 2, 3
+RAMP_DAYS = 30          # linear: reach daily_limit after this many days
+RAMP_START = 2          # sends on day 0 for the ramped styles
+RAMP_GROWTH = 1.25      # exponential: day-over-day growth
+
+class DayPlan:
+    """One day of sends for every account, as parallel arrays sorted by send time."""
+
+    def __init__(self, send_at, sender, receiver):
+        self.send_at = send_at
+        self.sender = sender
+        self.receiver = receiver
+
+    def __len__(self):
+        return len(self.send_at)
+
+    def jobs(self, template=None):
+        """(sender, receiver, template, run_at) tuples for JobQueue.enqueue_many."""
+        return list(zip(self.sender.tolist(), self.receiver.tolist(), [template] * len(self), self.send_at.tolist()))
+
+def load_accounts(conn):
+    """Active accounts as column arrays: id, provider, daily_limit, warmup_style, started_at."""
+    rows = conn.execute('''
+        SELECT id, provider, daily_limit, warmup_style, started_at
+        FROM accounts
+        WHERE status = 1
+        ORDER BY id
+    ''').fetchall()
+    ids, providers, limits, styles, started = zip(*rows) if rows else ((),) * 5
+    return {
+        'id': np.array(ids, dtype=np.int64),
+        'provider': np.array([int(p) if p is not None else -1 for p in providers], dtype=np.int64),
+        'daily_limit': np.array([l if l is not None else 100 for l in limits], dtype=np.int64),
+        'warmup_style': np.array([s if s is not None else LINEAR for s in styles], dtype=np.int64),
+        'started_at': np.array([s[:10] if s else 'NaT' for s in started], dtype='datetime64[D]'),
+    }
+
+def daily_volume(daily_limit, warmup_style, days_active):
+    """Sends per account for a day, following the ramp curve of its warmup_style."""
+    days = days_active.astype(np.float64)
+    limit = daily_limit.astype(np.float64)
+    linear = RAMP_START + (limit - RAMP_START) * np.minimum(days / RAMP_DAYS, 1.0)
+    exponential = RAMP_START * RAMP_GROWTH ** np.minimum(days, 365)
+    volume = np.select([warmup_style == EXPONENTIAL, warmup_style == FLAT], [exponential, limit], linear)
+    return np.minimum(np.floor(volume), limit).astype(np.int64).clip(min=0)
+
+def assign_receivers(sender_idx, provider, rng):
+    """Pick a receiver for each send, cycling through providers so no provider takes the brunt."""
+    count = len(provider)
+    order = np.argsort(provider, kind='stable')
+    providers, starts, sizes = np.unique(provider[order], return_index=True, return_counts=True)
+    # Round-robin over providers per sender, random member within the provider
+    choice = (np.arange(len(sender_idx)) + sender_idx) % len(providers)
+    receiver_idx = order[starts[choice] + (rng.random(len(sender_idx)) * sizes[choice]).astype(np.int64)]
+    # Never send to self: fall back to any other account
+    own = receiver_idx == sender_idx
+    receiver_idx[own] = (sender_idx[own] + 1 + rng.integers(0, count - 1, own.sum())) % count
+    return receiver_idx
+
+def plan_day(accounts, day=None, window=(0, 24 * 3600), seed=None):
+    """Plan every account's sends for `day` in one pass over NumPy arrays.
+
+    Send times are stratified with jitter: an account with n sends gets one
+    send in each of n equal slots of `window` (seconds after local midnight),
+    at millisecond resolution.
+    """
+    day = day or date.today()
+    rng = np.random.default_rng(seed)
+    count = len(accounts['id'])
+    if count < 2:
+        return DayPlan(np.empty(0), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64))
+
+    today = np.datetime64(day, 'D')
+    started = accounts['started_at']
+    days_active = np.where(np.isnat(started), 0, (today - started).astype(np.int64)).clip(min=0)
+    volume = daily_volume(accounts['daily_limit'], accounts['warmup_style'], days_active)
+    total = int(volume.sum())
+
+    sender_idx = np.repeat(np.arange(count), volume)
+    slot_index = np.arange(total) - np.repeat(np.cumsum(volume) - volume, volume)
+    slot_ms = (window[1] - window[0]) * 1000 / np.maximum(volume, 1)
+    offset_ms = ((slot_index + rng.random(total, dtype=np.float32)) * slot_ms[sender_idx]).astype(np.int64)
+
+    # Sort by time with one value sort: (offset_ms << INDEX_BITS) | position
+    index_bits = max(total.bit_length(), 1)
+    keys = np.sort((offset_ms << index_bits) | np.arange(total))
+    order = keys & ((1 << index_bits) - 1)
+
+    receiver_idx = assign_receivers(sender_idx[order], accounts['provider'], rng)
+    midnight = time.mktime(datetime(day.year, day.month, day.day).timetuple())
+    send_at = midnight + window[0] + (keys >> index_bits) / 1000
+    return DayPlan(send_at, accounts['id'][sender_idx[order]], accounts['id'][receiver_idx])
@@ -0,0 +1,177 @@
+import logging
+import smtplib
+import sqlite3
+import threading
+import time
+
+from db import configure
+
+log = logging.getLogger(__name__)
+
+# Sends per minute and burst size per provider (keyed by smtp_server) and per recipient domain
+DEFAULT_PROVIDER_LIMIT = (60, 20)
+PROVIDER_LIMITS = {
+    'smtp.gmail.com': (120, 30),
+    'smtp.office365.com': (60, 20),
+    'smtp-mail.outlook.com': (60, 20),
+    'smtp.mail.yahoo.com': (60, 20),
+}
+DEFAULT_DOMAIN_LIMIT = (120, 30)
+DOMAIN_LIMITS = {
+    'gmail.com': (300, 60),
+    'outlook.com': (150, 30),
+    'hotmail.com': (150, 30),
+    'yahoo.com': (150, 30),
+}
+
+# Adaptive backoff: a temporary failure cuts the bucket's rate by DECREASE
+# (down to MIN_FACTOR) and pauses it for a backoff that doubles while failures
+# follow right after each pause; the rate then recovers linearly over RECOVERY_SECONDS. Failures
+# during a pause come from sends already in flight and are not counted again.
+DECREASE = 0.5
+MIN_FACTOR = 0.05
+BASE_BACKOFF = 5
+MAX_BACKOFF = 900
+RECOVERY_SECONDS = 600
+MAX_WAIT = 60
+
+# Share of `rate` currently allowed
+FACTOR = "MIN(1.0, penalty + (:now - throttled_at) / :recovery)"
+
+RESERVE = f"""
+    INSERT INTO rate_buckets (key, rate, capacity, tokens, updated)
+    VALUES (:key, :rate, :capacity, :capacity - :cost, :now)
+    ON CONFLICT (key) DO UPDATE SET
+        tokens = MIN(capacity, tokens + MAX(0, :now - updated) * rate * {FACTOR}) - :cost,
+        updated = MAX(updated, :now)
+    RETURNING tokens, rate * {FACTOR}, backoff_until
+"""
+
+# Doubles when the bucket fails again within one backoff of resuming
+NEXT_BACKOFF = "MIN(:max_backoff, CASE WHEN :now - backoff_until < backoff THEN MAX(backoff * 2, :base) ELSE :base END)"
+
+THROTTLE = f"""
+    UPDATE rate_buckets SET
+        penalty = MAX(:min_factor, {FACTOR} * :decrease),
+        backoff = {NEXT_BACKOFF},
+        backoff_until = :now + {NEXT_BACKOFF},
+        throttled_at = :now,
+        throttles = throttles + 1
+    WHERE key = :key AND backoff_until <= :now
+"""
+
+def temporary_failure(error):
+    """('provider' | 'domain', code) for a 4xx SMTP error, else None."""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        codes = [code for code, _ in error.recipients.values()]
+        return ('domain', codes[0]) if codes and all(400 <= code < 500 for code in codes) else None
+    code = getattr(error, 'smtp_code', None)
+    if code is not None and 400 <= code < 500:
+        return ('provider', code)
+    return None
+
+class RateLimiter:
+    """Token buckets per provider and per recipient domain, shared through SQLite.
+
+    Every worker process and thread reserves from the same `rate_buckets`
+    rows (created by db.migrate), so they respect one budget. A reservation is one UPSERT ... RETURNING
+    per bucket, refilling and taking tokens atomically. Temporary SMTP failures
+    (4xx) shrink the bucket's rate and pause it (see DECREASE, BASE_BACKOFF).
+    """
+
+    def __init__(self, db_path, max_wait=MAX_WAIT):
+        self.db_path = db_path
+        self.max_wait = max_wait
+        self._local = threading.local()
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn = self._local.conn = configure(conn)
+        return conn
+
+    @staticmethod
+    def keys(smtp_server, domain):
+        """The buckets a send through smtp_server to a recipient at domain draws from, with their default limits."""
+        return [
+            (f"provider:{smtp_server}", PROVIDER_LIMITS.get(smtp_server, DEFAULT_PROVIDER_LIMIT)),
+            (f"domain:{domain.lower()}", DOMAIN_LIMITS.get(domain.lower(), DEFAULT_DOMAIN_LIMIT)),
+        ]
+
+    def reserve(self, smtp_server, domain, cost=1):
+        """Take `cost` tokens from both buckets; returns the seconds to wait before sending."""
+        now = time.time()
+        wait = 0
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for key, (per_minute, burst) in self.keys(smtp_server, domain):
+                tokens, rate, backoff_until = conn.execute(RESERVE, {
+                    'key': key, 'rate': per_minute / 60, 'capacity': burst, 'cost': cost,
+                    'now': now, 'recovery': RECOVERY_SECONDS,
+                }).fetchone()
+                wait = max(wait, backoff_until - now, 0 if tokens >= 0 else -tokens / rate if rate > 0 else float('inf'))
+            conn.execute("COMMIT")
+        except sqlite3.Error:
+            conn.execute("ROLLBACK")
+            raise
+        return wait
+
+    def refund(self, smtp_server, domain, cost=1):
+        """Give back tokens of a reservation that was not used."""
+        conn = self._connect()
+        conn.executemany("UPDATE rate_buckets SET tokens = MIN(capacity, tokens + ?) WHERE key = ?",
+                         [(cost, key) for key, _ in self.keys(smtp_server, domain)])
+
+    def wait(self, smtp_server, domain):
+        """Block until a send may go out; False (and nothing reserved) if that would take over max_wait."""
+        wait = self.reserve(smtp_server, domain)
+        if wait > self.max_wait:
+            self.refund(smtp_server, domain)
+            return False
+        if wait > 0:
+            time.sleep(wait)
+        return True
+
+    def throttle(self, key):
+        """Back off the bucket `key` after a temporary failure."""
+        self._connect().execute(THROTTLE, {
+            'key': key, 'now': time.time(), 'recovery': RECOVERY_SECONDS, 'decrease': DECREASE,
+            'min_factor': MIN_FACTOR, 'base': BASE_BACKOFF, 'max_backoff': MAX_BACKOFF,
+        })
+
+    def record_failure(self, smtp_server, domain, error):
+        """Back off the provider or recipient-domain bucket if `error` is a temporary SMTP failure."""
+        failure = temporary_failure(error)
+        if failure is None:
+            return None
+        provider_key, domain_key = [key for key, _ in self.keys(smtp_server, domain)]
+        self.throttle(provider_key if failure[0] == 'provider' else domain_key)
+        return failure
+
+    def configure(self, key, per_minute, burst):
+        """Set the limit of one bucket, e.g. configure("provider:smtp.example.com", 30, 10)."""
+        self._connect().execute('''
+            INSERT INTO rate_buckets (key, rate, capacity, tokens, updated)
+            VALUES (?1, ?2, ?3, ?3, ?4)
+            ON CONFLICT (key) DO UPDATE SET rate = ?2, capacity = ?3, tokens = MIN(tokens, ?3)
+        ''', (key, per_minute / 60, burst, time.time()))
+
+    def budgets(self):
+        """Every bucket as it stands now: limits, tokens available, current rate and backoff."""
+        now = time.time()
+        rows = self._connect().execute(f'''
+            SELECT key, rate, capacity, tokens, updated, {FACTOR} AS factor, backoff_until, throttles
+            FROM rate_buckets
+            ORDER BY key
+        ''', {'now': now, 'recovery': RECOVERY_SECONDS}).fetchall()
+        return [{
+            'key': key,
+            'per_minute': rate * 60,
+            'burst': capacity,
+            'tokens': min(capacity, tokens + max(0, now - updated) * rate * factor),
+            'current_per_minute': rate * 60 * factor,
+            'backoff_seconds': max(0, backoff_until - now),
+            'throttles': throttles,
+        } for key, rate, capacity, tokens, updated, factor, backoff_until, throttles in rows]
@@ -0,0 +1,38 @@
+import logging
+import sqlite3
+
+from flask import Blueprint, current_app, jsonify, request
+
+from metrics import parse_moment
+from state import DB_PATH
+
+records_bp = Blueprint('records', __name__)
+log = logging.getLogger(__name__)
+
+@records_bp.route('/api/records/export', methods=['GET'])
+def export_records():
+    """Stream the delivery history as Arrow, Parquet or gzip'd CSV (see export.py).
+
+    ?format=arrow|parquet|csv, ?columns=sent_time,sender,receiver,... and
+    ?start=/?end= (ISO dates or datetimes, with an offset or in local time)
+    for start <= sent_time < end.
+    """
+    from export import FORMATS, FormatUnavailable, export, parse_columns, resolve_format
+    try:
+        fmt = resolve_format(request.args.get('format'))
+        columns = parse_columns(request.args.get('columns'))
+        start, end = (parse_moment(request.args[name]) if request.args.get(name) else None for name in ('start', 'end'))
+    except FormatUnavailable as e:
+        return jsonify({"error": str(e)}), 406
+    except ValueError as e:
+        return jsonify({"error": f"Invalid export request: {e}"}), 400
+    try:
+        output = export(DB_PATH, fmt, columns, start, end)
+    except sqlite3.Error as e:
+        log.error("Database error: %s", e)
+        return jsonify({"error": "Database error occurred. Please try again later."}), 500
+    mimetype, extension = FORMATS[fmt]
+    return current_app.response_class(output, mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename=records.{extension}',
+        'X-Export-Format': fmt,
+    })
@@ -0,0 +1,210 @@
+import base64
+import logging
+import random
+import threading
+from collections import OrderedDict
+from datetime import date
+from email.header import Header
+from email.utils import formatdate, make_msgid
+
+from jinja2 import Environment, TemplateSyntaxError, meta
+from markupsafe import escape
+
+from db import connect
+
+log = logging.getLogger(__name__)
+
+DEFAULT_LANGUAGE = 'English'
+BOUNDARY = '=_warmup_alternative_='
+
+env = Environment(autoescape=False, keep_trailing_newline=True)
+
+def encode_body(text):
+    """Base64 text/plain and text/html bodies (CRLF, 76-column lines) for one rendered text."""
+    html = str(escape(text)).replace('\n', '<br>\n')
+    return (base64.encodebytes(text.encode()).replace(b'\n', b'\r\n'),
+            base64.encodebytes(html.encode()).replace(b'\n', b'\r\n'))
+
+def encode_header(value):
+    return value if value.isascii() else Header(value, 'utf-8').encode()
+
+# Static MIME framing of every message: headers after the per-message ones,
+# then the text/plain and text/html part headers around the encoded bodies
+HEAD = (
+    'MIME-Version: 1.0\r\n'
+    f'Content-Type: multipart/alternative; boundary="{BOUNDARY}"\r\n'
+    '\r\n'
+    f'--{BOUNDARY}\r\n'
+    'Content-Type: text/plain; charset="utf-8"\r\n'
+    'Content-Transfer-Encoding: base64\r\n'
+    '\r\n'
+).encode()
+MIDDLE = (
+    f'--{BOUNDARY}\r\n'
+    'Content-Type: text/html; charset="utf-8"\r\n'
+    'Content-Transfer-Encoding: base64\r\n'
+    '\r\n'
+).encode()
+TAIL = f'--{BOUNDARY}--\r\n'.encode()
+
+def encode_message(sender_email, receiver_email, subject, text, headers=None, parts=None):
+    """Serialize a message to bytes ready for sendmail; returns (Message-ID, bytes).
+
+    `parts` are pre-encoded (plain, html) bodies, skipping the encoding of `text`.
+    """
+    message_id = make_msgid(domain=sender_email.rpartition('@')[2])
+    lines = [
+        f"From: {sender_email}",
+        f"To: {receiver_email}",
+        f"Subject: {encode_header(subject)}",
+        f"Date: {formatdate(localtime=True)}",
+        f"Message-ID: {message_id}",
+    ]
+    lines += [f"{name}: {value}" for name, value in (headers or {}).items()]
+    plain, html = parts or encode_body(text)
+    return message_id, b''.join((('\r\n'.join(lines) + '\r\n').encode(), HEAD, plain, MIDDLE, html, TAIL))
+
+def display_name(email):
+    """'john.smith@example.com' -> 'John'."""
+    local = email.partition('@')[0]
+    return local.replace('_', '.').replace('-', '.').split('.')[0].capitalize()
+
+def recipient_variables(sender_email, receiver_email):
+    """Variables every template can use."""
+    return {
+        'sender_email': sender_email,
+        'sender_name': display_name(sender_email),
+        'receiver_email': receiver_email,
+        'receiver_name': display_name(receiver_email),
+        'date': date.today().strftime('%B %d, %Y'),
+    }
+
+def compile_source(source):
+    """Compile a Jinja2 source; content that is not valid Jinja2 is sent as literal text."""
+    try:
+        template = env.from_string(source)
+        variables = meta.find_undeclared_variables(env.parse(source))
+    except TemplateSyntaxError as e:
+        log.warning("Template is not valid Jinja2, sending it as written: %s", e)
+        return None, source
+    # Templates without variables are rendered once here
+    return (template, None) if variables else (None, template.render())
+
+class CompiledTemplate:
+    """A templates row compiled once, with its static body pre-encoded when it has no variables."""
+
+    def __init__(self, row):
+        self.id = row['id']
+        self.language = row['language']
+        self.subject, self.static_subject = compile_source(row['subject'] or '')
+        self.body, static_body = compile_source(row['content'] or '')
+        self.parts = encode_body(static_body) if self.body is None else None
+
+    def render(self, variables):
+        """(subject, body) for one recipient."""
+        subject = self.static_subject if self.subject is None else self.subject.render(variables)
+        body = None if self.body is None else self.body.render(variables)
+        return subject, body
+
+    def message(self, sender_email, receiver_email, headers=None, variables=None):
+        """(Message-ID, bytes, subject) for one recipient."""
+        variables = dict(recipient_variables(sender_email, receiver_email), **(variables or {}))
+        subject, body = self.render(variables)
+        return (*encode_message(sender_email, receiver_email, subject, body, headers, self.parts), subject)
+
+class TemplateCache:
+    """Templates from the `templates` table, compiled once and kept in an LRU of `maxsize`.
+
+    All rows are loaded and compiled on first use; call invalidate() after
+    changing the table (the template endpoints do) to recompile on next use.
+    Changes made by other connections, such as the API's while this runs in
+    a job worker, are caught as cache.ReadCache catches them: when PRAGMA
+    data_version moves, the templates counter in table_versions tells
+    whether to drop everything.
+    """
+
+    def __init__(self, db_path, maxsize=256):
+        self.db_path = db_path
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._compiled = OrderedDict()
+        self._languages = None  # language -> [template ids]
+        self._version = None
+        self.hits = 0
+        self.misses = 0
+
+    def _check(self):
+        """Forget everything if another connection wrote to `templates` since this thread last looked."""
+        conn = connect(self.db_path)
+        data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+        if getattr(self._local, 'data_version', None) == data_version:
+            return
+        self._local.data_version = data_version
+        version = conn.execute("SELECT version FROM table_versions WHERE name = 'templates'").fetchone()
+        with self._lock:
+            changed = self._version != version
+            self._version = version
+        if changed:
+            self.invalidate()
+
+    def _load(self):
+        with connect(self.db_path) as conn:
+            rows = conn.execute("SELECT id, subject, language, content FROM templates ORDER BY id").fetchall()
+        languages = {}
+        for row in rows:
+            row = dict(zip(('id', 'subject', 'language', 'content'), row))
+            languages.setdefault(row['language'] or DEFAULT_LANGUAGE, []).append(row['id'])
+            if len(self._compiled) < self.maxsize and row['id'] not in self._compiled:
+                self._compiled[row['id']] = CompiledTemplate(row)
+        self._languages = languages
+
+    def get(self, template_id):
+        """The compiled template, or None if there is no such row."""
+        self._check()
+        with self._lock:
+            if self._languages is None:
+                self._load()
+            template = self._compiled.get(template_id)
+            if template is not None:
+                self._compiled.move_to_end(template_id)
+                self.hits += 1
+                return template
+            self.misses += 1
+        with connect(self.db_path) as conn:
+            row = conn.execute("SELECT id, subject, language, content FROM templates WHERE id = ?", (template_id,)).fetchone()
+        if row is None:
+            return None
+        template = CompiledTemplate(dict(zip(('id', 'subject', 'language', 'content'), row)))
+        with self._lock:
+            self._compiled[template_id] = template
+            while len(self._compiled) > self.maxsize:
+                self._compiled.popitem(last=False)
+        return template
+
+    def pick(self, language=None):
+        """A random template id for `language`, falling back to DEFAULT_LANGUAGE and then to any template."""
+        self._check()
+        with self._lock:
+            if self._languages is None:
+                self._load()
+            languages = self._languages
+        ids = (languages.get(language or DEFAULT_LANGUAGE) or languages.get(DEFAULT_LANGUAGE)
+               or [id for ids in languages.values() for id in ids])
+        return random.choice(ids) if ids else None
+
+    def invalidate(self, template_id=None):
+        """Forget one compiled template, or all of them; the language index is always rebuilt."""
+        with self._lock:
+            if template_id is None:
+                self._compiled.clear()
+            else:
+                self._compiled.pop(template_id, None)
+            self._languages = None
+
+    def message(self, template_id, sender_email, receiver_email, headers=None, variables=None):
+        """(Message-ID, bytes, subject) of `template_id` rendered for this recipient, or None if it does not exist."""
+        template = self.get(template_id)
+        if template is None:
+            return None
+        return template.message(sender_email, receiver_email, headers, variables)
@@ -0,0 +1,235 @@
+import logging
+import random
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from db import connect, insert_records, query_all
+from rendering import compile_source
+
+log = logging.getLogger(__name__)
+
+# Chance that an account replies to a warmup message, by its warmup_style
+# (1 linear, 2 exponential, 3 flat); halved for each level deeper in a thread
+REPLY_RATES = {1: 0.3, 2: 0.4, 3: 0.2}
+REPLY_DECAY = 0.5
+MAX_THREAD_DEPTH = 4
+DEFAULT_SUBJECT = 'Welcome Email'
+REPLY_BODIES = (
+    "Thanks for reaching out, got it!",
+    "Thank you, this is helpful.",
+    "Received, thanks. Talk soon.",
+    "Appreciate it, I'll take a look.",
+    "Great, thanks for the update!",
+)
+
+# Warmup messages the receiving account could reply to, skipping those already replied to
+REPLY_CANDIDATES_QUERY = """
+    SELECT r.id, r.template, r.message_id, r.subject,
+           a.id AS account_id, a.email, a.password, a.warmup_style, p.smtp_server, p.smtp_port,
+           s.id AS receiver_id, s.email AS receiver_email
+    FROM records r
+    JOIN accounts a ON a.id = r.receiver
+    JOIN accounts s ON s.id = r.sender
+    LEFT JOIN providers p ON p.id = a.provider
+    WHERE r.id IN ({ids}) AND r.message_id IS NOT NULL AND a.status = 1
+      AND NOT EXISTS (SELECT 1 FROM records reply WHERE reply.reply_to = r.id)
+"""
+
+# Each record's ancestors through reply_to, root first
+THREAD_QUERY = """
+    WITH RECURSIVE thread(start, id, reply_to, message_id, template, subject, depth) AS (
+        SELECT id, id, reply_to, message_id, template, subject, 0 FROM records WHERE id IN ({ids})
+        UNION ALL
+        SELECT thread.start, r.id, r.reply_to, r.message_id, r.template, r.subject, thread.depth + 1
+        FROM records r
+        JOIN thread ON r.id = thread.reply_to
+        WHERE thread.depth < {max_depth}
+    )
+    SELECT start, message_id, template, subject, depth FROM thread ORDER BY start, depth DESC
+"""
+
+def reply_probability(warmup_style, depth, rates=REPLY_RATES):
+    """Chance that an account with this warmup_style answers a message `depth` replies into a thread."""
+    if depth >= MAX_THREAD_DEPTH:
+        return 0.0
+    return rates.get(warmup_style or 1, rates[1]) * REPLY_DECAY ** depth
+
+def load_threads(conn, record_ids):
+    """{record id: (root template, root subject, [Message-IDs from the thread root down to the record])}."""
+    threads = {}
+    for start in range(0, len(record_ids), 500):
+        chunk = record_ids[start:start + 500]
+        query = THREAD_QUERY.format(ids=', '.join('?' * len(chunk)), max_depth=MAX_THREAD_DEPTH + 1)
+        for row in conn.execute(query, chunk):
+            template, subject, references = threads.setdefault(row[0], (row[2], row[3], []))
+            if row[1]:
+                references.append(row[1])
+    return threads
+
+class ReplyEngine:
+    """Answers warmup messages seen over IMAP, threading replies through records.reply_to.
+
+    The placement monitor hands over the records it found in a mailbox; each
+    receiving account replies to a share of them (see reply_probability)
+    after a random delay of min_delay..max_delay seconds. Replies carry
+    In-Reply-To/References for the whole thread and are recorded with
+    isreply = 1, so the monitor sees them in turn and the thread can go on.
+
+    Replies are sent per account: once any reply of an account is due, all of
+    its replies due within `batch_window` seconds go out together through
+    send_func(account, replies), one SMTP session per batch. send_func
+    returns a Message-ID (or None on failure) per reply.
+    """
+
+    def __init__(self, db_path, send_func, min_delay=60, max_delay=900, batch_window=300,
+                 max_workers=32, tick=1.0, max_attempts=3, reply_rates=None, seed=None):
+        self.db_path = db_path
+        self.send_func = send_func
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.batch_window = batch_window
+        self.max_workers = max_workers
+        self.tick = tick
+        self.max_attempts = max_attempts
+        self.reply_rates = reply_rates or REPLY_RATES
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._pending = {}   # account id -> [(due, reply)]
+        self._accounts = {}  # account id -> SMTP credentials
+        self._queued = set()
+        self._thread = None
+        self.considered = 0
+        self.scheduled = 0
+        self.sent = 0
+        self.failed = 0
+        self.batches = 0
+
+    def status(self):
+        with self._lock:
+            queued = len(self._queued)
+        return {
+            'running': self._thread is not None and self._thread.is_alive(),
+            'queued': queued,
+            'considered': self.considered,
+            'scheduled': self.scheduled,
+            'sent': self.sent,
+            'failed': self.failed,
+            'batches': self.batches,
+        }
+
+    def add(self, record_ids):
+        """Decide which of these received records get a reply and schedule those replies."""
+        with self._lock:
+            record_ids = [record_id for record_id in dict.fromkeys(record_ids) if record_id not in self._queued]
+        if not record_ids:
+            return 0
+        candidates = []
+        with connect(self.db_path) as conn:
+            for start in range(0, len(record_ids), 500):
+                chunk = record_ids[start:start + 500]
+                candidates += query_all(conn, REPLY_CANDIDATES_QUERY.format(ids=', '.join('?' * len(chunk))), chunk)
+            threads = load_threads(conn, [row['id'] for row in candidates])
+            # Sends recorded without their subject can still quote a template subject without variables
+            subjects = {}
+            for template_id, source in conn.execute("SELECT id, subject FROM templates"):
+                compiled, static = compile_source(source or '')
+                if compiled is None:
+                    subjects[template_id] = static
+
+        now = time.time()
+        scheduled = 0
+        with self._lock:
+            for row in candidates:
+                template, subject, references = threads.get(row['id'], (row['template'], row['subject'], [row['message_id']]))
+                if self._random.random() >= reply_probability(row['warmup_style'], len(references) - 1, self.reply_rates):
+                    continue
+                subject = subject or subjects.get(template) or DEFAULT_SUBJECT
+                reply = {
+                    'reply_to': row['id'],
+                    'template': row['template'],
+                    'receiver': row['receiver_id'],
+                    'receiver_email': row['receiver_email'],
+                    'subject': subject if subject.startswith('Re: ') else 'Re: ' + subject,
+                    'in_reply_to': row['message_id'],
+                    'references': references[-10:],
+                    'body': self._random.choice(REPLY_BODIES),
+                    'attempts': 0,
+                }
+                self._accounts[row['account_id']] = {key: row[key] for key in ('email', 'password', 'smtp_server', 'smtp_port')}
+                due = now + self._random.uniform(self.min_delay, self.max_delay)
+                self._pending.setdefault(row['account_id'], []).append((due, reply))
+                self._queued.add(row['id'])
+                scheduled += 1
+            self.considered += len(record_ids)
+            self.scheduled += scheduled
+            if scheduled and self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="reply-engine", daemon=True)
+                self._thread.start()
+        return scheduled
+
+    def _run(self):
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="reply-send") as executor:
+            while True:
+                time.sleep(self.tick)
+                try:
+                    self.send_due(executor)
+                except sqlite3.Error as e:
+                    log.error("Reply engine could not write records: %s", e)
+
+    def _take_due(self, now):
+        """Pop the batches of accounts with a reply due now."""
+        batches = []
+        with self._lock:
+            for account_id, pending in list(self._pending.items()):
+                if min(due for due, _ in pending) > now:
+                    continue
+                batch = [reply for due, reply in pending if due <= now + self.batch_window]
+                rest = [(due, reply) for due, reply in pending if due > now + self.batch_window]
+                if rest:
+                    self._pending[account_id] = rest
+                else:
+                    del self._pending[account_id]
+                batches.append((account_id, self._accounts[account_id], batch))
+        return batches
+
+    def _send_batch(self, account, replies):
+        try:
+            return self.send_func(account, replies)
+        except Exception as e:
+            log.warning("Reply batch failed: %s", e, extra={'sender': account['email'], 'replies': len(replies)})
+            return [None] * len(replies)
+
+    def send_due(self, executor, now=None):
+        """Send every due batch, one per account, and record the replies; returns replies sent."""
+        now = time.time() if now is None else now
+        batches = self._take_due(now)
+        if not batches:
+            return 0
+        sent_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        records, retry, done = [], [], []
+        results = executor.map(lambda batch: self._send_batch(batch[1], batch[2]), batches)
+        for (account_id, account, replies), message_ids in zip(batches, results):
+            for reply, message_id in zip(replies, message_ids):
+                if message_id:
+                    records.append((reply['template'], account_id, reply['receiver'], reply['reply_to'], message_id, sent_time,
+                                    reply['subject']))
+                    done.append(reply['reply_to'])
+                elif reply['attempts'] + 1 < self.max_attempts:
+                    reply['attempts'] += 1
+                    retry.append((account_id, reply))
+                else:
+                    done.append(reply['reply_to'])
+        with connect(self.db_path) as conn:
+            insert_records(conn, records)
+        with self._lock:
+            self._queued.difference_update(done)
+            for account_id, reply in retry:
+                due = now + self.min_delay * 2 ** reply['attempts']
+                self._pending.setdefault(account_id, []).append((due, reply))
+            self.batches += len(batches)
+            self.sent += len(records)
+            self.failed += len(done) - len(records)
+        return len(records)
@@ -0,0 +1,167 @@
+import argparse
+import logging
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from db import connect
+
+log = logging.getLogger(__name__)
+
+HALF_LIFE_DAYS = 7      # weight of a send halves every week
+SETTLE_HOURS = 24       # the placement monitor has seen a send by then
+CHUNK_SIZE = 100000
+TARGET_REPLY_RATE = 0.3
+WATERMARK = 'reputations'
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+UPSERT_REPUTATION = """
+    INSERT INTO reputations (domain, rep_value, spam_rate, reply_rate, sent_weight, observed_weight,
+                             spam_weight, reply_weight, created_at, updated_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (domain) DO UPDATE SET
+        rep_value = excluded.rep_value,
+        spam_rate = excluded.spam_rate,
+        reply_rate = excluded.reply_rate,
+        sent_weight = excluded.sent_weight,
+        observed_weight = excluded.observed_weight,
+        spam_weight = excluded.spam_weight,
+        reply_weight = excluded.reply_weight,
+        updated_at = excluded.updated_at
+"""
+
+def reputation_score(spam_rate, reply_rate):
+    """0-100: the share of mail kept out of spam, with up to a quarter docked for missing replies."""
+    spam_rate = np.nan_to_num(spam_rate, nan=0.0)
+    engagement = np.minimum(reply_rate / TARGET_REPLY_RATE, 1.0)
+    return np.round(100 * (1 - spam_rate) * (0.75 + 0.25 * engagement), 1)
+
+def load_domains(conn):
+    """(domain names, array mapping account id -> domain index, -1 for unknown ids)."""
+    rows = conn.execute("SELECT id, email FROM accounts WHERE email IS NOT NULL").fetchall()
+    names = sorted({email.rpartition('@')[2].lower() for _, email in rows})
+    index = {name: i for i, name in enumerate(names)}
+    by_account = np.full(max((id for id, _ in rows), default=0) + 1, -1, dtype=np.int64)
+    for id, email in rows:
+        by_account[id] = index[email.rpartition('@')[2].lower()]
+    return names, by_account
+
+def domain_codes(by_account, ids):
+    """Domain index per account id, -1 for NULL or unknown accounts."""
+    ids = np.array([-1 if id is None else id for id in ids], dtype=np.int64)
+    known = (ids >= 0) & (ids < len(by_account))
+    return np.where(known, by_account[np.where(known, ids, 0)], -1)
+
+def count_chunk(rows, by_account, domains):
+    """Per-domain (sent, observed, spam, replies received) counts for a chunk of records rows."""
+    _, sender, receiver, isspam, isreply, _ = zip(*rows)
+    sender_domain = domain_codes(by_account, sender)
+    receiver_domain = domain_codes(by_account, receiver)
+    isspam = np.array([-1 if value is None else value for value in isspam], dtype=np.int64)
+    isreply = np.array([bool(value) for value in isreply])
+
+    def per_domain(codes, mask):
+        codes = codes[mask & (codes >= 0)]
+        return np.bincount(codes, minlength=domains).astype(np.float64)
+
+    everything = np.ones(len(rows), dtype=bool)
+    # A reply goes to the original sender, so it counts for the receiver's domain
+    return (per_domain(sender_domain, everything), per_domain(sender_domain, isspam >= 0),
+            per_domain(sender_domain, isspam == 1), per_domain(receiver_domain, isreply))
+
+def apply_counts(conn, names, counts, now):
+    """Decay the stored weights of the domains touched, add the new counts and upsert the scores."""
+    touched = np.flatnonzero(sum(counts))
+    if not len(touched):
+        return 0
+    domains = [names[i] for i in touched]
+    stored = {}
+    for start in range(0, len(domains), 500):
+        chunk = domains[start:start + 500]
+        for row in conn.execute(f'''
+            SELECT domain, sent_weight, observed_weight, spam_weight, reply_weight, updated_at, created_at
+            FROM reputations
+            WHERE domain IN ({', '.join('?' * len(chunk))})
+        ''', chunk):
+            stored[row[0]] = row[1:]
+    previous = np.array([stored.get(domain, (0, 0, 0, 0, None, None))[:4] for domain in domains], dtype=np.float64)
+    age_days = np.array([
+        (now - datetime.strptime(stored[domain][4], TIME_FORMAT)).total_seconds() / 86400
+        if domain in stored and stored[domain][4] else 0
+        for domain in domains
+    ])
+    decay = 0.5 ** (np.maximum(age_days, 0) / HALF_LIFE_DAYS)
+    sent, observed, spam, replies = (previous * decay[:, None] + np.column_stack([c[touched] for c in counts])).T
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        spam_rate = np.where(observed > 0, spam / observed, np.nan)
+        reply_rate = np.where(sent > 0, replies / sent, 0.0)
+    score = reputation_score(spam_rate, reply_rate)
+    timestamp = now.strftime(TIME_FORMAT)
+    conn.executemany(UPSERT_REPUTATION, [
+        (domain, float(score[i]), None if np.isnan(spam_rate[i]) else float(spam_rate[i]), float(reply_rate[i]),
+         float(sent[i]), float(observed[i]), float(spam[i]), float(replies[i]),
+         stored.get(domain, (None,) * 6)[5] or timestamp, timestamp)
+        for i, domain in enumerate(domains)
+    ])
+    return len(domains)
+
+def update_reputations(conn, now=None, chunk_size=CHUNK_SIZE):
+    """Fold the records added since the last run into `reputations`.
+
+    Only rows past the watermark (records.id) are read, in chunks, and only
+    once they are SETTLE_HOURS old so their placement is known; rows without
+    a sent_time can never settle and are skipped. Each chunk is counted per
+    sender domain with NumPy and committed together with the new watermark.
+    Returns {"processed", "skipped", "domains", "watermark"}.
+    """
+    now = now or datetime.now()
+    cutoff = (now - timedelta(hours=SETTLE_HOURS)).strftime(TIME_FORMAT)
+    names, by_account = load_domains(conn)
+    row = conn.execute("SELECT last_id FROM watermarks WHERE name = ?", (WATERMARK,)).fetchone()
+    watermark = row[0] if row else 0
+    report = {'processed': 0, 'skipped': 0, 'domains': 0, 'watermark': watermark}
+    while True:
+        rows = conn.execute('''
+            SELECT id, sender, receiver, isspam, isreply, sent_time
+            FROM records
+            WHERE id > ?
+            ORDER BY id
+            LIMIT ?
+        ''', (watermark, chunk_size)).fetchall()
+        # Stop at the first send that has not settled yet
+        settled = np.array([sent_time is None or sent_time[:19] <= cutoff for *_, sent_time in rows], dtype=bool)
+        if len(rows) and not settled.all():
+            rows = rows[:int(np.argmin(settled))]
+        if not rows:
+            return report
+        timed = [row for row in rows if row[5] is not None]
+        with conn:
+            if timed:
+                report['domains'] += apply_counts(conn, names, count_chunk(timed, by_account, len(names)), now)
+            watermark = rows[-1][0]
+            conn.execute('''
+                INSERT INTO watermarks (name, last_id) VALUES (?, ?)
+                ON CONFLICT (name) DO UPDATE SET last_id = excluded.last_id
+            ''', (WATERMARK, watermark))
+        report['processed'] += len(timed)
+        report['skipped'] += len(rows) - len(timed)
+        report['watermark'] = watermark
+        if len(rows) < chunk_size:
+            return report
+
+if __name__ == '__main__':
+    from instrumentation import configure_logging
+    from state import DB_PATH
+    configure_logging()
+    parser = argparse.ArgumentParser(description="Fold new records into domain reputations.")
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--interval', type=float, default=0, help="repeat every N seconds (0: run once)")
+    args = parser.parse_args()
+    while True:
+        with connect(args.db) as conn:
+            log.info("Reputations updated", extra=update_reputations(conn))
+        if not args.interval:
+            break
+        time.sleep(args.interval)
@@ -0,0 +1,14 @@
+import hashlib
+
+from flask import current_app, jsonify, request
+
+def json_body(value):
+    """(serialized JSON, ETag) for a value about to be cached."""
+    body = jsonify(value).get_data()
+    return body, hashlib.md5(body).hexdigest()
+
+def conditional_json(body, etag, status=200):
+    """A JSON response answered with 304 and no body when If-None-Match matches."""
+    response = current_app.response_class(body, status=status, mimetype='application/json')
+    response.set_etag(etag)
+    return response.make_conditional(request)
@@ -0,0 +1,113 @@
+import logging
+import smtplib
+import time
+
+import state
+from smtp import EmailManager
+from smtp_pool import smtp_pool
+from rendering import encode_message
+
+log = logging.getLogger(__name__)
+
+def send_message(sender_email, receiver_email, message_id, message, app_password, smtp_server='smtp.gmail.com', smtp_port=587):
+    domain = receiver_email.rpartition('@')[2]
+    try:
+        # Wait for the provider's and the recipient domain's shared send budget
+        if not state.limiter.wait(smtp_server, domain):
+            log.info("Deferred: %s or %s is backing off", smtp_server, domain, extra={'sender': sender_email, 'recipient': receiver_email})
+            return False
+
+        # Send the email over a pooled, already authenticated SMTP session
+        manager = EmailManager(smtp_server, smtp_port, None, None, sender_email, app_password)
+        smtp_pool.sendmail(manager, sender_email, receiver_email, message)
+
+        # Counted in memory and written to metrics in batches
+        state.counters.incr(sender_email, sent=1)
+        state.counters.incr(receiver_email, received=1)
+
+    except Exception as e:
+        state.limiter.record_failure(smtp_server, domain, e)
+        log.warning("Send failed: %s", e, extra={'sender': sender_email, 'recipient': receiver_email})
+        return False
+
+    log.info("Email sent", extra={'sender': sender_email, 'recipient': receiver_email, 'message_id': message_id})
+    return message_id
+
+def send_email_gmail(sender_email, receiver_email, subject, body, app_password, smtp_server='smtp.gmail.com', smtp_port=587):
+    message_id, message = encode_message(sender_email, receiver_email, subject, body)
+    return send_message(sender_email, receiver_email, message_id, message, app_password, smtp_server, smtp_port)
+
+def render_warmup(account, receiver_email, template_id=None):
+    """(Message-ID, bytes, template id, subject) of a warmup email from the template, or a random one in the account's language."""
+    template_id = template_id or state.templates.pick(account.get('language'))
+    rendered = state.templates.message(template_id, account['email'], receiver_email) if template_id else None
+    if rendered is None:
+        # No templates to pick from
+        text = """TEMPLATE"""
+        return (*encode_message(account['email'], receiver_email, 'Welcome Email', text), None, 'Welcome Email')
+    message_id, message, subject = rendered
+    return message_id, message, template_id, subject
+
+def send_warmup_email(account, receiver_email, template_id=None):
+    """(Message-ID, template id, subject) of the warmup email sent, or None if it was not."""
+    smtp_server, smtp_port = account['smtp_server'] or 'smtp.gmail.com', account['smtp_port'] or 587
+    message_id, message, template_id, subject = render_warmup(account, receiver_email, template_id)
+    if not send_message(account['email'], receiver_email, message_id, message, account['password'], smtp_server, smtp_port):
+        return None
+    return message_id, template_id, subject
+
+def send_batch(account, messages):
+    """Send one account's (receiver_email, Message-ID, bytes) messages over a single pooled SMTP session.
+
+    Messages the rate limiter lets out together are pipelined in one
+    EmailManager.send_batch call; a message that has to wait for budget
+    flushes the ones before it first. Returns a Message-ID (or None) per message.
+    """
+    smtp_server = account['smtp_server'] or 'smtp.gmail.com'
+    manager = EmailManager(smtp_server, account['smtp_port'] or 587, None, None, account['email'], account['password'])
+    message_ids = [None] * len(messages)
+
+    def deliver(session, indexes):
+        results = session.manager.send_batch([(messages[i][0], messages[i][2]) for i in indexes], account['email'])
+        for index, (receiver_email, error) in zip(indexes, results):
+            if error is not None:
+                state.limiter.record_failure(smtp_server, receiver_email.rpartition('@')[2], error)
+                log.warning("Send refused: %s", error, extra={'sender': account['email'], 'recipient': receiver_email})
+                continue
+            session.messages += 1
+            state.counters.incr(account['email'], sent=1)
+            state.counters.incr(receiver_email, received=1)
+            message_ids[index] = messages[index][1]
+
+    try:
+        with smtp_pool.session(manager) as session:
+            ready = []
+            for index, (receiver_email, _, _) in enumerate(messages):
+                domain = receiver_email.rpartition('@')[2]
+                wait = state.limiter.reserve(smtp_server, domain)
+                if wait > state.limiter.max_wait:
+                    state.limiter.refund(smtp_server, domain)
+                    continue
+                if wait > 0:
+                    deadline = time.monotonic() + wait
+                    if ready:
+                        deliver(session, ready)
+                        ready = []
+                    time.sleep(max(0, deadline - time.monotonic()))
+                ready.append(index)
+            if ready:
+                deliver(session, ready)
+    except (smtplib.SMTPServerDisconnected, OSError) as e:
+        log.warning("Send session dropped: %s", e, extra={'sender': account['email']})
+    return message_ids
+
+def send_replies(account, replies):
+    """Send one account's replies over a single pooled SMTP session; returns a Message-ID (or None) per reply."""
+    messages = []
+    for reply in replies:
+        message_id, message = encode_message(account['email'], reply['receiver_email'], reply['subject'], reply['body'], {
+            'In-Reply-To': reply['in_reply_to'],
+            'References': ' '.join(reply['references']),
+        })
+        messages.append((reply['receiver_email'], message_id, message))
+    return send_batch(account, messages)
@@ -1,67 +1,251 @@
 import smtplib
 import imaplib
 import email
+import logging
+import io
+import re
+from email.generator import BytesGenerator
+from email.parser import BytesHeaderParser
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 import time
 
+from instrumentation import timer
+
+log = logging.getLogger(__name__)
+
+LIST_RESPONSE = re.compile(r'\((?P<flags>[^)]*)\) (?P<delimiter>"[^"]*"|NIL) (?P<name>.+)')
+UID_RESPONSE = re.compile(rb'UID (\d+)')
+LINE_END = re.compile(rb'\r\n|\r(?!\n)|(?<!\r)\n')
+LEADING_DOT = re.compile(rb'^\.', re.MULTILINE)
+
+def _quote_address(address):
+    """`address` as a MAIL/RCPT argument, ASCII-encoded; SMTPNotSupportedError if it cannot go on the wire."""
+    try:
+        return smtplib.quoteaddr(address).encode('ascii')
+    except (UnicodeError, TypeError, AttributeError):
+        raise smtplib.SMTPNotSupportedError(f"Cannot send to {address!r}: not an ASCII address") from None
+
+def _quote_folder(folder):
+    return '"' + folder.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
 class EmailManager:
-    def __init__(self, smtp_server, smtp_port, imap_server, imap_port, username, password):
+    def __init__(self, smtp_server, smtp_port, imap_server, imap_port, username, password, use_tls=True):
         self.smtp_server = smtp_server
-        self.smtp_port = smtp_port
+        self.smtp_port = int(smtp_port)
         self.imap_server = imap_server
-        self.imap_port = imap_port
+        self.imap_port = int(imap_port) if imap_port else None
         self.username = username
         self.password = password
+        self.use_tls = use_tls
         self.smtp_conn = None
         self.imap_conn = None
+        # Reused by send_batch for every message flattened and command group written
+        self._message_buffer = io.BytesIO()
+        self._command_buffer = bytearray()
 
     def connect_smtp(self):
-        """Connect to the SMTP server."""
+        """Connect to the SMTP server and return the authenticated session."""
         try:
             if self.smtp_port == 465:
-                self.smtp_conn = smtplib.SMTP_SSL(self.smtp_server, self.smtp_port)
-                self.smtp_conn.login(self.username, self.password)
+                # Implicit TLS: the handshake is part of connect
+                with timer('smtp_connect'):
+                    self.smtp_conn = smtplib.SMTP_SSL(self.smtp_server, self.smtp_port)
             else:
-                self.smtp_conn = smtplib.SMTP(self.smtp_server, 587)
-                self.smtp_conn.starttls()  
-                self.smtp_conn.login(self.username, self.password)
-            print("Connected to SMTP server.")
+                with timer('smtp_connect'):
+                    self.smtp_conn = smtplib.SMTP(self.smtp_server, self.smtp_port)
+                if self.use_tls:
+                    with timer('smtp_tls'):
+                        self.smtp_conn.starttls()
+            if self.password:
+                with timer('smtp_login'):
+                    self.smtp_conn.login(self.username, self.password)
+            log.debug("Connected to SMTP server", extra={'smtp_server': self.smtp_server, 'account': self.username})
+            return self.smtp_conn
         except Exception as e:
-            print(f"Failed to connect to SMTP server: {e}")
-            print("SMTP_CONN", self.smtp_conn.select)
+            log.warning("Failed to connect to SMTP server: %s", e, extra={'smtp_server': self.smtp_server, 'account': self.username})
+            self.smtp_conn = None
+            raise
 
     def connect_imap(self):
-        """Connect to the IMAP server."""
+        """Connect to the IMAP server and return the logged-in session."""
         try:
-            self.imap_conn = imaplib.IMAP4_SSL(self.imap_server, self.imap_port)
+            if self.imap_port == 993:
+                self.imap_conn = imaplib.IMAP4_SSL(self.imap_server, self.imap_port)
+            else:
+                self.imap_conn = imaplib.IMAP4(self.imap_server, self.imap_port)
+                if self.use_tls:
+                    self.imap_conn.starttls()
             self.imap_conn.login(self.username, self.password)
-            print("Connected to IMAP server.")
+            log.debug("Connected to IMAP server", extra={'imap_server': self.imap_server, 'account': self.username})
+            return self.imap_conn
         except Exception as e:
-            print(f"Failed to connect to IMAP server: {e}")
-            print("IMAP_CONN", self.imap_conn.select)
+            log.warning("Failed to connect to IMAP server: %s", e, extra={'imap_server': self.imap_server, 'account': self.username})
+            self.imap_conn = None
+            raise
 
     def disconnect(self):
         """Disconnect from SMTP and IMAP servers."""
         if self.smtp_conn:
             self.smtp_conn.quit()
-            print("Disconnected from SMTP server.")
+            log.debug("Disconnected from SMTP server")
         if self.imap_conn:
             self.imap_conn.logout()
-            print("Disconnected from IMAP server.")
+            log.debug("Disconnected from IMAP server")
 
     def send_email(self, recipient, subject, body):
         """Send an email."""
+        message = MIMEMultipart()
+        message['From'] = self.username  # Ensure this matches the sender account
+        message['To'] = recipient
+        message['Subject'] = subject
+        message.attach(MIMEText(body, 'plain'))
         try:
-            message = MIMEMultipart()
-            message['From'] = self.username  # Ensure this matches the sender account
-            message['To'] = recipient
-            message['Subject'] = subject
-            message.attach(MIMEText(body, 'plain'))
-            self.smtp_conn.sendmail(self.username, recipient, message.as_string())
-            print(f"Email sent successfully to {recipient}.")
+            (_, error), = self.send_batch([(recipient, message)])
         except Exception as e:
-            print(f"Failed to send email: {e}")
+            error = e
+        if error is None:
+            log.info("Email sent", extra={'sender': self.username, 'recipient': recipient})
+        else:
+            log.warning("Failed to send email: %s", error, extra={'sender': self.username, 'recipient': recipient})
+
+    def send_batch(self, messages, sender=None):
+        """Send each (recipient, message) pair as its own envelope over the open SMTP session.
+
+        A message is bytes ready for sendmail (see rendering.encode_message) or
+        an email.message.Message, flattened with BytesGenerator into a buffer
+        reused across the batch. If the server advertises PIPELINING, each
+        message costs one round trip: its MAIL, RCPT and DATA go out in one
+        write together with the previous message's content. Returns
+        (recipient, error) per pair, error being None once the message was
+        accepted, else the smtplib exception it failed with (SMTPNotSupportedError
+        for an address that is not ASCII) or the one raised flattening it. If
+        the connection drops, the session is closed and the rest fail with
+        that error.
+        """
+        sender = sender or self.username
+        conn = self.smtp_conn
+        results = []
+        with timer('smtp_send'):
+            try:
+                conn.ehlo_or_helo_if_needed()
+                if conn.has_extn('pipelining'):
+                    self._send_pipelined(conn, sender, messages, results)
+                else:
+                    for recipient, message in messages:
+                        try:
+                            data = self._flatten(message)
+                        except Exception as e:
+                            results.append((recipient, e))
+                            continue
+                        results.append((recipient, self._send_one(conn, sender, recipient, data)))
+            except (smtplib.SMTPServerDisconnected, OSError) as e:
+                log.warning("SMTP session dropped: %s", e, extra={'smtp_server': self.smtp_server, 'account': self.username})
+                conn.close()
+                if not isinstance(e, smtplib.SMTPServerDisconnected):
+                    e = smtplib.SMTPServerDisconnected(str(e))
+                results += [(recipient, e) for recipient, _ in messages[len(results):]]
+        return results
+
+    def _flatten(self, message):
+        if isinstance(message, (bytes, bytearray)):
+            return message
+        buffer = self._message_buffer
+        buffer.seek(0)
+        buffer.truncate()
+        # The message's own policy, with CRLF line ends: nothing to fix up afterwards
+        BytesGenerator(buffer, policy=message.policy.clone(linesep='\r\n')).flatten(message)
+        return buffer.getvalue()
+
+    @staticmethod
+    def _send_one(conn, sender, recipient, data):
+        # Checked before MAIL, so a bad address cannot leave the transaction open
+        try:
+            _quote_address(sender)
+            _quote_address(recipient)
+        except smtplib.SMTPNotSupportedError as e:
+            return e
+        code, reply = conn.mail(sender)
+        if code != 250:
+            conn.rset()
+            return smtplib.SMTPSenderRefused(code, reply, sender)
+        code, reply = conn.rcpt(recipient)
+        if code not in (250, 251):
+            conn.rset()
+            return smtplib.SMTPRecipientsRefused({recipient: (code, reply)})
+        try:
+            conn.data(data)
+        except smtplib.SMTPDataError as e:
+            conn.rset()
+            return e
+        return None
+
+    def _send_pipelined(self, conn, sender, messages, results):
+        # Each group written is: the previous message's content (if its
+        # envelope was accepted), RSET (if it was not), then this message's
+        # MAIL, RCPT and DATA. Replies come back in the same order. A message
+        # is encoded in full before its group is written, so one that cannot
+        # be fails alone and the session never waits in DATA for it.
+        try:
+            mail = b'MAIL FROM:' + _quote_address(sender) + b'\r\n'
+        except smtplib.SMTPNotSupportedError as e:
+            results += [(recipient, e) for recipient, _ in messages]
+            return
+        group = self._command_buffer
+        previous = None
+        reset = False
+        end = object()
+        for recipient, message in [*messages, (end, None)]:
+            envelope = error = None
+            if recipient is not end:
+                try:
+                    envelope = b'RCPT TO:' + _quote_address(recipient) + b'\r\nDATA\r\n'
+                    data = self._content(message)
+                except Exception as e:
+                    envelope, error = None, e
+            if previous is not None or reset:
+                del group[:]
+                if previous is not None:
+                    group += content
+                if reset:
+                    group += b'RSET\r\n'
+                if envelope is not None:
+                    group += mail + envelope
+                conn.send(bytes(group))
+                if previous is not None:
+                    code, reply = conn.getreply()
+                    results.append((previous, None if code == 250 else smtplib.SMTPDataError(code, reply)))
+                if reset:
+                    conn.getreply()
+                previous, reset = None, False
+            elif envelope is not None:
+                conn.send(mail + envelope)
+            if recipient is end:
+                break
+            if envelope is None:
+                results.append((recipient, error))
+                continue
+            (mail_code, mail_reply), (rcpt_code, rcpt_reply), (data_code, data_reply) = [conn.getreply() for _ in range(3)]
+            if mail_code != 250:
+                error = smtplib.SMTPSenderRefused(mail_code, mail_reply, sender)
+            elif rcpt_code not in (250, 251):
+                error = smtplib.SMTPRecipientsRefused({recipient: (rcpt_code, rcpt_reply)})
+            elif data_code != 354:
+                error = smtplib.SMTPDataError(data_code, data_reply)
+            else:
+                previous, content = recipient, data
+                continue
+            if data_code == 354:
+                # The server wants content for an envelope it refused: end it empty
+                conn.send(b'.\r\n')
+                conn.getreply()
+            results.append((recipient, error))
+            reset = True
+
+    def _content(self, message):
+        """The message as DATA content: CRLF line ends, dot-stuffed and terminated."""
+        data = LEADING_DOT.sub(b'..', LINE_END.sub(b'\r\n', self._flatten(message)))
+        return data + (b'.\r\n' if data.endswith(b'\r\n') else b'\r\n.\r\n')
 
     def delete_email(self, email_id):
         """Delete an email by its ID."""
@@ -69,9 +253,9 @@ class EmailManager:
             self.imap_conn.select("INBOX")
             self.imap_conn.store(email_id, '+FLAGS', '\\Deleted')
             self.imap_conn.expunge()
-            print(f"Email with ID {email_id} deleted.")
+            log.info("Email %s deleted", email_id)
         except Exception as e:
-            print(f"Failed to delete email: {e}")
+            log.warning("Failed to delete email: %s", e)
 
     def mark_as_not_spam(self, email_id):
         """Move an email from the spam folder to the inbox."""
@@ -81,11 +265,79 @@ class EmailManager:
             if result[0] == 'OK':
                 self.imap_conn.store(email_id, '+FLAGS', '\\Deleted')
                 self.imap_conn.expunge()
-                print(f"Email with ID {email_id} marked as not spam and moved to Inbox.")
+                log.info("Email %s marked as not spam and moved to Inbox", email_id)
             else:
-                print("Failed to mark email as not spam.")
+                log.warning("Failed to mark email %s as not spam", email_id)
         except Exception as e:
-            print(f"Failed to mark email as not spam: {e}")
+            log.warning("Failed to mark email as not spam: %s", e)
+
+    def find_spam_folder(self):
+        """Name of the spam folder: the one flagged \\Junk, else a common name."""
+        status, folders = self.imap_conn.list()
+        names = []
+        for line in folders if status == 'OK' else []:
+            match = LIST_RESPONSE.match(line.decode(errors='replace'))
+            if match:
+                name = match.group('name').strip('"')
+                if '\\Junk' in match.group('flags'):
+                    return name
+                names.append(name)
+        for candidate in ('[Gmail]/Spam', 'Spam', 'Junk', 'Junk Email', 'Bulk Mail'):
+            if candidate in names:
+                return candidate
+        return 'Spam'
+
+    def select_folder(self, folder):
+        """Select a folder and return its (UIDVALIDITY, UIDNEXT)."""
+        status, _ = self.imap_conn.select(_quote_folder(folder))
+        if status != 'OK':
+            raise imaplib.IMAP4.error(f"Cannot select {folder}")
+        responses = self.imap_conn.untagged_responses
+        uidvalidity = int(responses.get('UIDVALIDITY', [b'0'])[-1])
+        uidnext = int(responses.get('UIDNEXT', [b'0'])[-1])
+        return uidvalidity, uidnext
+
+    def fetch_message_ids(self, after_uid):
+        """Message-ID header of every message in the selected folder with UID > after_uid.
+
+        Only the one header is downloaded (BODY.PEEK, so nothing is marked read).
+        """
+        status, data = self.imap_conn.uid('FETCH', f'{after_uid + 1}:*', '(UID BODY.PEEK[HEADER.FIELDS (MESSAGE-ID)])')
+        if status != 'OK':
+            return {}
+        parser = BytesHeaderParser()
+        message_ids = {}
+        for item in data:
+            if not isinstance(item, tuple):
+                continue
+            match = UID_RESPONSE.search(item[0])
+            # "n:*" always returns the last message, even when its UID is lower
+            if match and int(match.group(1)) > after_uid:
+                message_id = parser.parsebytes(item[1]).get('Message-ID')
+                if message_id:
+                    message_ids[int(match.group(1))] = message_id.strip()
+        return message_ids
+
+    def move_to_inbox(self, uids):
+        """Move messages of the selected folder to INBOX in one round trip.
+
+        Uses UID MOVE when the server supports it, otherwise one UID COPY and
+        UID STORE for the whole set followed by a single EXPUNGE.
+        """
+        if not uids:
+            return
+        uid_set = ','.join(str(uid) for uid in sorted(uids))
+        if 'MOVE' in self.imap_conn.capabilities:
+            self.imap_conn.uid('MOVE', uid_set, 'INBOX')
+            return
+        status, _ = self.imap_conn.uid('COPY', uid_set, 'INBOX')
+        if status != 'OK':
+            raise imaplib.IMAP4.error("Failed to copy messages to INBOX")
+        self.imap_conn.uid('STORE', uid_set, '+FLAGS.SILENT', '(\\Deleted)')
+        if 'UIDPLUS' in self.imap_conn.capabilities:
+            self.imap_conn.uid('EXPUNGE', uid_set)
+        else:
+            self.imap_conn.expunge()
 
     def list_emails(self, folder="INBOX"):
         """List emails in a specific folder."""
@@ -94,44 +346,45 @@ class EmailManager:
             status, data = self.imap_conn.search(None, "ALL")
             if status == 'OK':
                 email_ids = data[0].split()
-                print(f"Emails in {folder}: {email_ids}")
+                log.debug("Emails in %s: %s", folder, email_ids)
                 return email_ids
             else:
-                print(f"Failed to fetch emails from {folder}.")
+                log.warning("Failed to fetch emails from %s", folder)
                 return []
         except Exception as e:
-            print(f"Failed to list emails: {e}")
+            log.warning("Failed to list emails: %s", e)
             return []
 if __name__ == "__main__":
-    # Email account configuration
-    smtp_server = "mail.cloudstacknetwork.net"
-    smtp_port = 465
-    imap_server = "mail.cloudstacknetwork.net"
-    imap_port = 993
-    username = "bill.test1@cloudstacknetwork.net"
-    password = "!jVy*jC49XZ!*25@"
+    # Smoke test against one account: python smtp.py --smtp host:port --imap host:port --user addr --to addr
+    # The password comes from EMAIL_WARMUP_PASSWORD, or is asked for
+    import argparse
+    import getpass
+    import os
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--smtp", required=True, help="host:port")
+    parser.add_argument("--imap", required=True, help="host:port")
+    parser.add_argument("--user", required=True)
+    parser.add_argument("--to", required=True, help="recipient of the test email")
+    parser.add_argument("--no-tls", action="store_true", help="skip STARTTLS, e.g. for the local stand-ins in benchmarks/")
+    args = parser.parse_args()
+    smtp_server, smtp_port = args.smtp.rsplit(":", 1)
+    imap_server, imap_port = args.imap.rsplit(":", 1)
+    password = os.environ.get("EMAIL_WARMUP_PASSWORD") or getpass.getpass()
 
     # Initialize EmailManager
-    email_manager = EmailManager(smtp_server, smtp_port, imap_server, imap_port, username, password)
+    email_manager = EmailManager(smtp_server, smtp_port, imap_server, imap_port, args.user, password, use_tls=not args.no_tls)
 
     # Connect to SMTP and IMAP servers
     email_manager.connect_smtp()
     email_manager.connect_imap()
-    print (email_manager.imap_conn.list())
+    print(email_manager.imap_conn.list())
     # Send an email
-    email_manager.send_email("digitaldream0719@gmail.com", "Test Subject", "This is a test email.")
-
-    # List emails in the inbox
-    inbox_emails = email_manager.list_emails("INBOX")
-
-    # # Delete the first email (if any)
-    if inbox_emails:
-        email_manager.delete_email(inbox_emails[0])
+    email_manager.send_email(args.to, "Test Subject", "This is a test email.")
 
-    # List emails in the spam folder and mark the first one as not spam
-    spam_emails = email_manager.list_emails("Spam")
-    if spam_emails:
-        email_manager.mark_as_not_spam(spam_emails[0])
+    # List emails in the inbox and the spam folder
+    print("INBOX:", email_manager.list_emails("INBOX"))
+    print("Spam:", email_manager.list_emails(email_manager.find_spam_folder()))
 
     # Disconnect from servers
-    email_manager.disconnect()
\ No newline at end of file
+    email_manager.disconnect()
@@ -0,0 +1,152 @@
+import smtplib
+import threading
+import time
+from contextlib import contextmanager
+
+from instrumentation import timer
+
+class PooledSession:
+    def __init__(self, manager):
+        self.manager = manager
+        self.key = (manager.smtp_server, manager.smtp_port, manager.username)
+        self.conn = manager.connect_smtp()
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        self.messages = 0
+
+    def is_stale(self, idle_timeout, max_messages):
+        """A session is retired after sitting idle too long or sending too many messages."""
+        return (time.monotonic() - self.last_used > idle_timeout
+                or self.messages >= max_messages)
+
+    def is_alive(self):
+        """Check the session with NOOP."""
+        try:
+            return self.conn.noop()[0] == 250
+        except (smtplib.SMTPException, OSError):
+            return False
+
+    def close(self):
+        try:
+            self.conn.quit()
+        except (smtplib.SMTPException, OSError):
+            self.conn.close()
+        self.manager.smtp_conn = None
+
+class SMTPPool:
+    """Authenticated SMTP sessions keyed by (smtp_server, port, username).
+
+    Sessions are reused across sendmail calls, probed with NOOP when they have
+    been idle for more than noop_after seconds, and reconnected once they pass
+    idle_timeout or max_messages. At most max_per_provider sessions (idle and
+    in use) are open per (smtp_server, port).
+    """
+
+    def __init__(self, max_per_provider=4, idle_timeout=60, max_messages=100, noop_after=5, acquire_timeout=30):
+        self.max_per_provider = max_per_provider
+        self.idle_timeout = idle_timeout
+        self.max_messages = max_messages
+        self.noop_after = noop_after
+        self.acquire_timeout = acquire_timeout
+        self._cond = threading.Condition()
+        self._idle = {}
+        self._open = {}
+
+    def _evict_idle(self, provider):
+        """Take one idle session of another account on the same provider to make room."""
+        for sessions in self._idle.values():
+            if sessions and sessions[0].key[:2] == provider:
+                return sessions.pop(0)
+        return None
+
+    def acquire(self, manager):
+        """Return a live session for the manager's account, connecting if needed."""
+        key = (manager.smtp_server, manager.smtp_port, manager.username)
+        provider = key[:2]
+        deadline = time.monotonic() + self.acquire_timeout
+        while True:
+            evicted = None
+            with self._cond:
+                idle = self._idle.get(key)
+                session = idle.pop() if idle else None
+                if session is None:
+                    while self._open.get(provider, 0) >= self.max_per_provider:
+                        evicted = self._evict_idle(provider)
+                        if evicted:
+                            break
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            raise TimeoutError(f"No SMTP session available for {provider[0]}:{provider[1]}")
+                        self._cond.wait(remaining)
+                    else:
+                        self._open[provider] = self._open.get(provider, 0) + 1
+            if evicted is not None:
+                self._discard(evicted)
+                continue
+            if session is None:
+                try:
+                    return PooledSession(manager)
+                except Exception:
+                    self._release_slot(provider)
+                    raise
+            if session.is_stale(self.idle_timeout, self.max_messages):
+                self._discard(session)
+                continue
+            if time.monotonic() - session.last_used <= self.noop_after or session.is_alive():
+                return session
+            self._discard(session)
+
+    def release(self, session, broken=False):
+        """Return a session to the pool, or close it if it failed mid-send."""
+        session.last_used = time.monotonic()
+        # send_batch closes the connection itself when it drops
+        broken = broken or session.conn.sock is None
+        if broken or session.is_stale(self.idle_timeout, self.max_messages):
+            self._discard(session)
+            return
+        with self._cond:
+            self._idle.setdefault(session.key, []).append(session)
+            self._cond.notify()
+
+    def _discard(self, session):
+        session.close()
+        self._release_slot(session.key[:2])
+
+    def _release_slot(self, provider):
+        with self._cond:
+            self._open[provider] -= 1
+            self._cond.notify()
+
+    @contextmanager
+    def session(self, manager):
+        session = self.acquire(manager)
+        try:
+            yield session
+        except BaseException:
+            # Whatever failed may have left the conversation mid-transaction
+            self.release(session, broken=True)
+            raise
+        else:
+            self.release(session)
+
+    def sendmail(self, manager, sender, recipients, message):
+        """Send one message over a pooled session, retrying once on a dropped connection."""
+        for attempt in range(2):
+            try:
+                with self.session(manager) as session:
+                    with timer('smtp_send'):
+                        result = session.conn.sendmail(sender, recipients, message)
+                    session.messages += 1
+                    return result
+            except smtplib.SMTPServerDisconnected:
+                if attempt:
+                    raise
+
+    def close_all(self):
+        with self._cond:
+            sessions = [s for idle in self._idle.values() for s in idle]
+            self._idle.clear()
+        for session in sessions:
+            self._discard(session)
+
+smtp_pool = SMTPPool(max_per_provider=100)
@@ -0,0 +1,74 @@
+"""Process-wide state shared by the route blueprints, built on first use.
+
+It lives at module level, so on serverless platforms it survives between
+invocations served by the same warm instance: SQLite connections (cached per
+thread by db.connect), the read cache and the compiled templates are reused.
+Nothing heavier than the schema check runs at import; the limiter, counters
+and background workers are created when a route first asks for them, e.g.
+`state.dispatcher`.
+"""
+import os
+import threading
+
+from db import migrate
+
+# Get the absolute path to the database
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DB_PATH = os.environ.get("EMAIL_WARMUP_DB", os.path.join(BASE_DIR, "../email_warmup.db"))
+migrate(DB_PATH)
+
+_lock = threading.RLock()
+
+def _read_cache():
+    from cache import ReadCache
+    return ReadCache(DB_PATH)
+
+def _counters():
+    from counters import CounterAggregator
+    return CounterAggregator(DB_PATH)
+
+def _templates():
+    from rendering import TemplateCache
+    return TemplateCache(DB_PATH)
+
+def _limiter():
+    from ratelimit import RateLimiter
+    return RateLimiter(DB_PATH)
+
+def _dispatcher():
+    from dispatcher import WarmupDispatcher
+    from sending import send_warmup_email
+    return WarmupDispatcher(DB_PATH, send_warmup_email)
+
+def _replies():
+    from replies import ReplyEngine
+    from sending import send_replies
+    return ReplyEngine(DB_PATH, send_replies)
+
+def _monitor():
+    from placement import PlacementMonitor
+    return PlacementMonitor(DB_PATH, counters=__getattr__('counters'), replies=__getattr__('replies'))
+
+FACTORIES = {
+    'read_cache': _read_cache,
+    'counters': _counters,
+    'templates': _templates,
+    'limiter': _limiter,
+    'dispatcher': _dispatcher,
+    'replies': _replies,
+    'monitor': _monitor,
+}
+
+def __getattr__(name):
+    factory = FACTORIES.get(name)
+    if factory is None:
+        raise AttributeError(f"module 'state' has no attribute '{name}'")
+    with _lock:
+        if name not in globals():
+            # Later lookups find the global and skip __getattr__
+            globals()[name] = factory()
+    return globals()[name]
+
+def peek(name):
+    """The instance if it has been created already, else None."""
+    return globals().get(name)
@@ -0,0 +1,124 @@
+import logging
+import sqlite3
+
+from flask import Blueprint, jsonify, request
+
+import state
+from db import connect, query_all
+from responses import conditional_json, json_body
+from state import DB_PATH
+
+templates_bp = Blueprint('templates', __name__)
+log = logging.getLogger(__name__)
+
+def invalidate_templates(template_id=None):
+    state.read_cache.invalidate('templates')
+    # The compiled templates only exist once something has been sent
+    compiled = state.peek('templates')
+    if compiled is not None:
+        compiled.invalidate(template_id)
+
+def templates_snapshot():
+    """(rows, serialized JSON, ETag) of the whole templates table."""
+    def load(conn):
+        rows = query_all(conn, """
+            SELECT * 
+            FROM templates
+        """)
+        return (rows, *json_body(rows))
+    return state.read_cache.get('templates', 'all', load)
+
+@templates_bp.route('/api/templates', methods=['GET'])
+def get_all_templates():
+    _, body, etag = templates_snapshot()
+    return conditional_json(body, etag)
+
+@templates_bp.route('/api/template/edit/<int:id>', methods=['POST'])
+def edit_template(id):
+    template_data = request.get_json()
+    if not template_data:
+        return jsonify({"error": "No data provided"}), 400
+    try:
+        with connect(DB_PATH) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE templates 
+                SET subject = ?, 
+                    content = ?, 
+                    language = ? 
+                WHERE id = ?
+            ''', (
+                template_data.get('subject'),
+                template_data.get('content'),
+                template_data.get('language'),
+                id
+            ))
+            conn.commit()
+        invalidate_templates(id)
+        _, body, etag = templates_snapshot()
+        return conditional_json(body, etag)
+    except sqlite3.Error as e:
+        log.error("Database error: %s", e)
+        return jsonify({"error": "Database error occurred. Please try again later."}), 500
+    except Exception:
+        log.exception("Unexpected error")
+        return jsonify({"error": "Internal server error. Please try again later."}), 500
+    
+@templates_bp.route('/api/template/create', methods=['POST'])
+def create_template():
+    template_data = request.get_json()
+    if not template_data or not all(key in template_data for key in ['subject', 'content', 'language']):
+        return jsonify({"error": "Missing fields: subject, content, and language are required."}), 400
+    try:
+        with connect(DB_PATH) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''SELECT subject FROM templates WHERE subject = ?''', (template_data['subject'],))
+            existing_template = cursor.fetchone()
+            if existing_template:
+                return jsonify({"error": "Template with this subject already exists."}), 400
+            cursor.execute(''' 
+                INSERT INTO templates (subject, content, language) 
+                VALUES (?, ?, ?)
+            ''', (
+                template_data['subject'], 
+                template_data['content'], 
+                template_data['language']
+            ))
+            conn.commit()
+        invalidate_templates()
+        _, body, etag = templates_snapshot()
+        return conditional_json(body, etag, 201)
+    except sqlite3.Error as e:
+        log.error("Database error: %s", e)
+        return jsonify({"error": "Database error occurred. Please try again later."}), 500
+
+    except Exception:
+        log.exception("Unexpected error")
+        return jsonify({"error": "Internal server error. Please try again later."}), 500
+    
+@templates_bp.route('/api/template/delete/<int:id>', methods=['POST'])
+def delete_template(id):
+    log.info("Deleting template", extra={'template_id': id})
+    try:
+        # Delete the template from the database
+        with connect(DB_PATH) as conn:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM templates WHERE id = ?", (id,))
+            conn.commit()
+
+            # Check if the deletion was successful
+            if cursor.rowcount == 0:
+                return jsonify({"error": "Template not found."}), 404
+        invalidate_templates(id)
+
+        # Fetch remaining templates to return
+        _, body, etag = templates_snapshot()
+        return conditional_json(body, etag)
+
+    except sqlite3.Error as e:
+        log.error("Database error: %s", e)
+        return jsonify({"error": "Database error occurred. Please try again later."}), 500
+
+    except Exception:
+        log.exception("Unexpected error")
+        return jsonify({"error": "Internal server error. Please try again later."}), 500
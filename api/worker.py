@@ -0,0 +1,306 @@
+"""Sharded warmup workers, one process per core.
+
+Accounts are spread over a fixed number of shards by consistent hashing of
+accounts.id (HashRing). A worker owns some shards and, for their accounts
+only, schedules the day's sends, sends the queued jobs and flushes the
+metric counters. Ownership lives in SQLite: workers heartbeat in
+`worker_leases`, and `shard_leases` names the owner of each shard. A
+supervisor moves shards to a worker that joins and away from one whose
+lease runs out, moving as few as it can.
+
+    python api/worker.py --processes 4 --shards 64    # supervisor + 4 workers
+    python api/worker.py --shards 64                  # one more worker, any host
+    python api/worker.py --shard 3/8                  # shard 3 of 8, no supervisor
+
+Use either fixed --shard workers or a supervisor on a given database, not both.
+Run it as a script as above, not with `python -m api.worker`: like the rest
+of api/, it imports its sibling modules as top-level ones. Days scheduled
+here and through POST /api/jobs/schedule share JobQueue.enqueue_day's
+per-sender markers, so either may run first and nothing is queued twice.
+"""
+import argparse
+import hashlib
+import logging
+import os
+import signal
+import socket
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+from bisect import bisect
+from contextlib import closing
+from datetime import date
+from multiprocessing import Process
+
+if __name__ == '__main__' and __package__:
+    sys.exit("Run the worker as a script: python api/worker.py")
+
+from db import configure
+
+log = logging.getLogger(__name__)
+
+SHARDS = 64
+VNODES = 128            # points per shard on the ring
+LEASE_SECONDS = 15      # a worker that has not heartbeat for this long is gone
+HEARTBEAT_SECONDS = 5
+
+def _hash(key):
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'big')
+
+class HashRing:
+    """Consistent hashing of account ids onto `shards` shards.
+
+    Each shard has `vnodes` points on the ring; an account belongs to the
+    shard of the first point at or after its own hash. Changing the shard
+    count moves only about 1/shards of the accounts.
+    """
+
+    def __init__(self, shards, vnodes=VNODES):
+        points = sorted((_hash(f"shard-{shard}-{vnode}"), shard) for shard in range(shards) for vnode in range(vnodes))
+        self.shards = shards
+        self._points = [point for point, _ in points]
+        self._owners = [shard for _, shard in points]
+        self._cache = {}
+
+    def shard_of(self, account_id):
+        shard = self._cache.get(account_id)
+        if shard is None:
+            index = bisect(self._points, _hash(str(account_id))) % len(self._points)
+            shard = self._cache[account_id] = self._owners[index]
+        return shard
+
+class ShardLeases:
+    """Worker heartbeats and shard ownership in `worker_leases` and `shard_leases` (created by db.migrate)."""
+
+    def __init__(self, db_path, shards=SHARDS, lease_seconds=LEASE_SECONDS):
+        self.db_path = db_path
+        self.shards = shards
+        self.lease_seconds = lease_seconds
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        return configure(conn)
+
+    def heartbeat(self, worker_id):
+        """Renew the worker's lease and those of its shards; returns the shards it owns."""
+        now = time.time()
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute('''
+                INSERT INTO worker_leases (worker_id, started, lease_until) VALUES (?1, ?2, ?3)
+                ON CONFLICT (worker_id) DO UPDATE SET lease_until = ?3
+            ''', (worker_id, now, now + self.lease_seconds))
+            conn.execute("UPDATE shard_leases SET lease_until = ? WHERE owner = ?", (now + self.lease_seconds, worker_id))
+            shards = [row[0] for row in conn.execute("SELECT shard FROM shard_leases WHERE owner = ? ORDER BY shard", (worker_id,))]
+            conn.execute("COMMIT")
+        return shards
+
+    def take(self, worker_id, shard):
+        """Own `shard` outright, for workers started with a fixed --shard."""
+        with closing(self._connect()) as conn:
+            conn.execute('''
+                INSERT INTO shard_leases (shard, owner, lease_until) VALUES (?1, ?2, ?3)
+                ON CONFLICT (shard) DO UPDATE SET owner = ?2, lease_until = ?3
+            ''', (shard, worker_id, time.time() + self.lease_seconds))
+
+    def alive(self):
+        """True while any worker holds a live lease; the workers then send for every active account."""
+        with closing(self._connect()) as conn:
+            return conn.execute("SELECT 1 FROM worker_leases WHERE lease_until >= ? LIMIT 1", (time.time(),)).fetchone() is not None
+
+    def leave(self, worker_id):
+        """Drop the worker's lease and free its shards for the supervisor to hand out."""
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DELETE FROM worker_leases WHERE worker_id = ?", (worker_id,))
+            conn.execute("UPDATE shard_leases SET owner = NULL, lease_until = NULL WHERE owner = ?", (worker_id,))
+            conn.execute("COMMIT")
+
+    def rebalance(self):
+        """Spread the shards evenly over the live workers; returns {worker_id: [shard, ...]}.
+
+        Shards stay with a live owner unless it holds more than its share;
+        those of expired workers and the surplus go to the least loaded.
+        """
+        now = time.time()
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute("DELETE FROM worker_leases WHERE lease_until < ?", (now,))
+                live = [row[0] for row in conn.execute("SELECT worker_id FROM worker_leases ORDER BY started, worker_id")]
+                conn.execute("DELETE FROM shard_leases WHERE shard >= ?", (self.shards,))
+                conn.executemany("INSERT OR IGNORE INTO shard_leases (shard) VALUES (?)", [(shard,) for shard in range(self.shards)])
+                owners = dict(conn.execute("SELECT shard, owner FROM shard_leases"))
+                assignment = {worker_id: [] for worker_id in live}
+                free = []
+                for shard, owner in sorted(owners.items()):
+                    (assignment[owner] if owner in assignment else free).append(shard)
+                if live:
+                    # The most loaded workers keep the extra shard when they don't divide evenly
+                    ranked = sorted(live, key=lambda worker_id: -len(assignment[worker_id]))
+                    share, extra = divmod(self.shards, len(live))
+                    quota = {worker_id: share + (rank < extra) for rank, worker_id in enumerate(ranked)}
+                    for worker_id in live:
+                        free += assignment[worker_id][quota[worker_id]:]
+                        del assignment[worker_id][quota[worker_id]:]
+                    free.sort()
+                    for worker_id in live:
+                        need = quota[worker_id] - len(assignment[worker_id])
+                        assignment[worker_id] += free[:need]
+                        del free[:need]
+                moves = [(worker_id, now + self.lease_seconds, shard)
+                         for worker_id, shards in assignment.items() for shard in shards if owners[shard] != worker_id]
+                conn.executemany("UPDATE shard_leases SET owner = ?, lease_until = ? WHERE shard = ?", moves)
+                conn.executemany("UPDATE shard_leases SET owner = NULL, lease_until = NULL WHERE shard = ?", [(shard,) for shard in free])
+                conn.execute("COMMIT")
+            except sqlite3.Error:
+                conn.execute("ROLLBACK")
+                raise
+        if moves:
+            log.info("Rebalanced %d shards over %d workers", len(moves), len(live))
+        return assignment
+
+    def status(self):
+        """Live workers with their shards, and the number of shards nobody owns."""
+        now = time.time()
+        with closing(self._connect()) as conn:
+            workers = conn.execute('''
+                SELECT w.worker_id, w.started, w.lease_until, GROUP_CONCAT(s.shard)
+                FROM worker_leases w
+                LEFT JOIN shard_leases s ON s.owner = w.worker_id
+                GROUP BY w.worker_id
+                ORDER BY w.started
+            ''').fetchall()
+            unowned = conn.execute('''
+                SELECT COUNT(*) FROM shard_leases WHERE owner IS NULL OR lease_until < ?
+            ''', (now,)).fetchone()[0]
+        return {
+            'workers': [{
+                'worker_id': worker_id,
+                'started': started,
+                'alive': lease_until >= now,
+                'shards': sorted(int(shard) for shard in shards.split(',')) if shards else [],
+            } for worker_id, started, lease_until, shards in workers],
+            'unowned_shards': unowned,
+        }
+
+def run(db_path, shards=SHARDS, shard=None, batch_size=50, heartbeat=HEARTBEAT_SECONDS, stop_when_empty=False,
+        send_many=None):
+    """One worker: keep its shard leases, schedule its shards' days and send their jobs until stopped.
+
+    With stop_when_empty it returns once its shards have no due jobs left.
+    """
+    # sending.py and the counters take the database path from state, which reads it from the environment
+    os.environ['EMAIL_WARMUP_DB'] = db_path
+    from jobs import JobQueue, run_worker, schedule_day, send_job, send_jobs
+    import state
+
+    worker_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+    ring = HashRing(shards)
+    leases = ShardLeases(db_path, shards)
+    queue = JobQueue(db_path)
+    owned = [frozenset()]
+    scheduled = [None]
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+
+    def accounts_version():
+        with closing(queue._connect()) as conn:
+            return conn.execute("SELECT version FROM table_versions WHERE name = 'accounts'").fetchone()[0]
+
+    def keep_leases():
+        if shard is not None:
+            leases.take(worker_id, shard)
+        mine = owned[0] = frozenset(leases.heartbeat(worker_id))
+        # Scheduled again whenever the day, the shards or the accounts change;
+        # schedule_day skips senders whose day is already queued, so only
+        # accounts activated since the last pass get jobs
+        key = (date.today(), mine, accounts_version())
+        if mine and key != scheduled[0]:
+            queued = schedule_day(queue, key[0], senders=lambda sender: ring.shard_of(sender) in mine)
+            scheduled[0] = key
+            if queued:
+                log.info("Scheduled %d sends for today", queued, extra={'worker_id': worker_id, 'shards': sorted(mine)})
+
+    def lease_loop():
+        while not stop.wait(heartbeat):
+            try:
+                keep_leases()
+            except sqlite3.Error as e:
+                log.error("Could not renew shard leases: %s", e, extra={'worker_id': worker_id})
+
+    keep_leases()
+    threading.Thread(target=lease_loop, name="shard-leases", daemon=True).start()
+    log.info("Worker started", extra={'worker_id': worker_id, 'shards': sorted(owned[0])})
+    try:
+        run_worker(db_path, send_job, batch_size, stop_when_empty=stop_when_empty, send_many=send_many or send_jobs,
+                   partition=lambda sender: ring.shard_of(sender) in owned[0], stop=stop)
+    finally:
+        stop.set()
+        # Child processes skip atexit, so flush here
+        counters = state.peek('counters')
+        if counters is not None:
+            counters.flush()
+        leases.leave(worker_id)
+        log.info("Worker stopped", extra={'worker_id': worker_id})
+
+def supervise(db_path, processes, shards=SHARDS, batch_size=50, interval=HEARTBEAT_SECONDS):
+    """Run `processes` workers, restart any that exit, and rebalance shards as workers come and go."""
+    leases = ShardLeases(db_path, shards)
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+
+    def start():
+        process = Process(target=run, args=(db_path, shards), kwargs={'batch_size': batch_size})
+        process.start()
+        return process
+
+    children = [start() for _ in range(processes)]
+    try:
+        while not stop.is_set():
+            for index, process in enumerate(children):
+                if not process.is_alive():
+                    log.warning("Worker %d exited with %s, restarting", process.pid, process.exitcode)
+                    children[index] = start()
+            try:
+                leases.rebalance()
+            except sqlite3.Error as e:
+                log.error("Could not rebalance shards: %s", e)
+            stop.wait(interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in children:
+            process.terminate()
+        for process in children:
+            process.join()
+
+def parse_shard(value):
+    """'3/8' -> (3, 8)."""
+    index, _, total = value.partition('/')
+    index, total = int(index), int(total)
+    if not 0 <= index < total:
+        raise argparse.ArgumentTypeError(f"shard {value} is not of the form i/N with 0 <= i < N")
+    return index, total
+
+if __name__ == '__main__':
+    from instrumentation import configure_logging
+    configure_logging()
+    parser = argparse.ArgumentParser(description="Run sharded warmup workers.")
+    parser.add_argument('--shard', type=parse_shard, help="own this shard only, as i/N")
+    parser.add_argument('--shards', type=int, default=SHARDS, help="shards to spread the accounts over")
+    parser.add_argument('--processes', type=int, help=f"supervise this many workers (e.g. {os.cpu_count()})")
+    parser.add_argument('--batch-size', type=int, default=50)
+    parser.add_argument('--db', help="database file (default: EMAIL_WARMUP_DB or email_warmup.db)")
+    args = parser.parse_args()
+    if args.db:
+        os.environ['EMAIL_WARMUP_DB'] = args.db
+    from state import DB_PATH
+    if args.shard:
+        run(DB_PATH, args.shard[1], args.shard[0], args.batch_size)
+    elif args.processes is not None:
+        supervise(DB_PATH, args.processes, args.shards, args.batch_size)
+    else:
+        run(DB_PATH, args.shards, batch_size=args.batch_size)
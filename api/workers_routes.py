@@ -0,0 +1,105 @@
+import logging
+import math
+import sqlite3
+
+from flask import Blueprint, jsonify, request
+
+import state
+from state import DB_PATH
+
+workers_bp = Blueprint('workers', __name__)
+log = logging.getLogger(__name__)
+
+@workers_bp.route('/api/dispatcher/start', methods=['POST'])
+def start_dispatcher():
+    try:
+        if not state.dispatcher.start() and not state.dispatcher.running:
+            return jsonify({"error": "Sharded workers are sending; the dispatcher stays off while they run."}), 409
+        return jsonify(state.dispatcher.status())
+    except sqlite3.Error as e:
+        log.error("Database error: %s", e)
+        return jsonify({"error": "Database error occurred. Please try again later."}), 500
+
+@workers_bp.route('/api/dispatcher/stop', methods=['POST'])
+def stop_dispatcher():
+    state.dispatcher.stop()
+    return jsonify(state.dispatcher.status())
+
+@workers_bp.route('/api/dispatcher/status', methods=['GET'])
+def dispatcher_status():
+    return jsonify(state.dispatcher.status())
+
+@workers_bp.route('/api/monitor/start', methods=['POST'])
+def start_monitor():
+    state.monitor.start()
+    return jsonify(state.monitor.status())
+
+@workers_bp.route('/api/monitor/stop', methods=['POST'])
+def stop_monitor():
+    state.monitor.stop()
+    return jsonify(state.monitor.status())
+
+@workers_bp.route('/api/monitor/status', methods=['GET'])
+def monitor_status():
+    return jsonify(state.monitor.status())
+
+@workers_bp.route('/api/replies/status', methods=['GET'])
+def replies_status():
+    return jsonify(state.replies.status())
+
+@workers_bp.route('/api/ratelimits', methods=['GET'])
+def rate_limits():
+    try:
+        return jsonify(state.limiter.budgets())
+    except sqlite3.Error as e:
+        log.error("Database error: %s", e)
+        return jsonify({"error": "Database error occurred. Please try again later."}), 500
+
+@workers_bp.route('/api/ratelimits', methods=['POST'])
+def set_rate_limit():
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not all(key in data for key in ('key', 'per_minute', 'burst')):
+        return jsonify({"error": "Missing fields: key, per_minute and burst are required."}), 400
+    if not isinstance(data['key'], str) or not data['key']:
+        return jsonify({"error": "key must be a bucket name, e.g. provider:smtp.example.com."}), 400
+    try:
+        per_minute, burst = float(data['per_minute']), float(data['burst'])
+    except (TypeError, ValueError):
+        return jsonify({"error": "per_minute and burst must be numbers."}), 400
+    # Also refuses NaN
+    if not (0 < per_minute < math.inf and 0 < burst < math.inf):
+        return jsonify({"error": "per_minute and burst must be positive."}), 400
+    try:
+        state.limiter.configure(data['key'], per_minute, burst)
+        return jsonify(state.limiter.budgets())
+    except sqlite3.Error as e:
+        log.error("Database error: %s", e)
+        return jsonify({"error": "Database error occurred. Please try again later."}), 500
+
+@workers_bp.route('/api/jobs/schedule', methods=['POST'])
+def schedule_jobs():
+    try:
+        from jobs import JobQueue, schedule_day
+        queued = schedule_day(JobQueue(DB_PATH))
+        return jsonify({'queued': queued}), 201
+    except sqlite3.Error as e:
+        log.error("Database error: %s", e)
+        return jsonify({"error": "Database error occurred. Please try again later."}), 500
+
+@workers_bp.route('/api/jobs/status', methods=['GET'])
+def jobs_status():
+    try:
+        from jobs import JobQueue
+        return jsonify(JobQueue(DB_PATH).counts())
+    except sqlite3.Error as e:
+        log.error("Database error: %s", e)
+        return jsonify({"error": "Database error occurred. Please try again later."}), 500
+
+@workers_bp.route('/api/workers/status', methods=['GET'])
+def workers_status():
+    try:
+        from worker import ShardLeases
+        return jsonify(ShardLeases(DB_PATH).status())
+    except sqlite3.Error as e:
+        log.error("Database error: %s", e)
+        return jsonify({"error": "Database error occurred. Please try again later."}), 500
@@ -0,0 +1,82 @@
+"""Messages/sec and client CPU per message: one sendmail per message vs. EmailManager.send_batch.
+
+One authenticated session sends the same run of messages three ways against
+the local SMTP stand-in, with --latency-ms added to every round trip:
+
+- sendmail:  MIMEMultipart.as_string() and one smtplib sendmail per message
+             (MAIL, RCPT, DATA and the content each wait for a reply)
+- batch:     send_batch with PIPELINING turned off on the server
+- pipelined: send_batch with PIPELINING, one round trip per message
+
+CPU is the client thread's own time (the server runs in the same process).
+
+    python benchmarks/batch_send_bench.py --messages 500 --latency-ms 1
+"""
+import argparse
+import os
+import sys
+import time
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api"))
+
+from fake_smtp import FakeSMTPServer
+from smtp import EmailManager
+
+SENDER = "sender@example.com"
+BODY = "Hi there,\n\nJust checking in about next week.\n.\nBest regards,\nSender\n" * 8
+
+def build(recipients):
+    messages = []
+    for recipient in recipients:
+        message = MIMEMultipart()
+        message['From'] = SENDER
+        message['To'] = recipient
+        message['Subject'] = "Quick question"
+        message.attach(MIMEText(BODY, 'plain'))
+        messages.append((recipient, message))
+    return messages
+
+def send_each(manager, messages):
+    for recipient, message in messages:
+        manager.smtp_conn.sendmail(SENDER, recipient, message.as_string())
+    return [(recipient, None) for recipient, _ in messages]
+
+def run(label, server, send, messages):
+    manager = EmailManager("127.0.0.1", server.port, None, None, SENDER, "secret", use_tls=False)
+    manager.connect_smtp()
+    before = server.messages
+    try:
+        wall, cpu = time.perf_counter(), time.thread_time()
+        results = send(manager, messages)
+        cpu, wall = time.thread_time() - cpu, time.perf_counter() - wall
+    finally:
+        manager.disconnect()
+    failed = sum(error is not None for _, error in results)
+    print(f"  {label:<10} {len(messages) / wall:8.0f} msg/s  {cpu / len(messages) * 1e6:6.0f} us CPU/msg  "
+          f"({server.messages - before} delivered, {failed} failed)")
+    return len(messages) / wall
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=500)
+    parser.add_argument("--latency-ms", type=float, default=1.0, help="simulated network round trip")
+    args = parser.parse_args()
+
+    messages = build([f"receiver{i}@example.com" for i in range(args.messages)])
+    latency = args.latency_ms / 1000
+    plain = FakeSMTPServer(latency=latency, pipelining=False).start()
+    pipelining = FakeSMTPServer(latency=latency).start()
+    print(f"{args.messages} messages, {args.latency_ms} ms round trip")
+    try:
+        before = run("sendmail", pipelining, send_each, messages)
+        run("batch", plain, lambda manager, messages: manager.send_batch(messages), messages)
+        after = run("pipelined", pipelining, lambda manager, messages: manager.send_batch(messages), messages)
+        print(f"  speedup    {after / before:.1f}x")
+    finally:
+        plain.stop()
+        pipelining.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""Dashboard read latency while send threads write to the database.
+
+N writer threads simulate sends (insert into records, bump metrics) while M
+reader threads GET /api/accounts. Run once per journal mode to compare:
+
+    python benchmarks/db_concurrency_bench.py --writers 8 --readers 8
+    python benchmarks/db_concurrency_bench.py --journal DELETE
+"""
+import argparse
+import contextlib
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "api"))
+
+import db
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))] if values else float("nan")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--writers", type=int, default=8)
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--accounts", type=int, default=5000)
+    parser.add_argument("--journal", default="WAL")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    db_path = os.path.join(workdir, "bench.db")
+    shutil.copy(os.path.join(ROOT, "email_warmup.db"), db_path)
+    db.JOURNAL_MODE = args.journal
+    with db.connect(db_path) as conn:
+        conn.executemany('''
+            INSERT INTO accounts (email, password, provider, daily_limit, warmup_style, created_at, updated_at, status)
+            VALUES (?, 'secret', '1', 100, 1, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP, 1)
+        ''', [(f"bench{i}@example.com",) for i in range(args.accounts)])
+    db.migrate(db_path)
+
+    os.environ["EMAIL_WARMUP_DB"] = db_path
+    import index
+    client = index.app.test_client()
+    stop = threading.Event()
+    read_latency, write_latency, errors = [], [], []
+
+    def writer(n):
+        email = f"bench{n}@example.com"
+        while not stop.is_set():
+            start = time.perf_counter()
+            try:
+                with db.connect(db_path) as conn:
+                    conn.execute('''
+                        INSERT INTO records (template, sender, receiver, isspam, isreply, sent_time)
+                        VALUES (1, ?, ?, 0, 0, CURRENT_TIMESTAMP)
+                    ''', (n, n + 1))
+                    conn.execute('''
+                        INSERT INTO metrics (email, date, sent_count, received_count, spam_count)
+                        VALUES (?, date('now'), 1, 0, 0)
+                        ON CONFLICT (email, date) DO UPDATE SET sent_count = sent_count + 1
+                    ''', (email,))
+                write_latency.append(time.perf_counter() - start)
+            except sqlite3.OperationalError as e:
+                errors.append(str(e))
+
+    def reader():
+        while not stop.is_set():
+            start = time.perf_counter()
+            response = client.get("/api/accounts?limit=100")
+            if response.status_code != 200:
+                errors.append(response.status_code)
+            read_latency.append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=writer, args=(n,)) for n in range(args.writers)]
+    threads += [threading.Thread(target=reader) for _ in range(args.readers)]
+    try:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            for thread in threads:
+                thread.start()
+            time.sleep(args.seconds)
+            stop.set()
+            for thread in threads:
+                thread.join()
+        print(f"journal={args.journal} writers={args.writers} readers={args.readers}")
+        for label, values in (("reads ", read_latency), ("writes", write_latency)):
+            print(f"{label} {len(values) / args.seconds:8.1f}/s  p50 {percentile(values, 50) * 1000:7.2f} ms"
+                  f"  p99 {percentile(values, 99) * 1000:7.2f} ms")
+        print(f"errors {len(errors)}", sorted(set(map(str, errors)))[:3])
+    finally:
+        shutil.rmtree(workdir)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""Streaming export of records (api/export.py) over 5M synthetic rows.
+
+Fills a temporary database with --records sends spread over 90 days
+between --accounts accounts, then exports it in each format, every run in
+a fresh process so its peak RSS is its own: all columns, a projection of
+three columns, and one day through the sent_time index. The previous way,
+pandas read_sql + to_dict + JSON, runs on --baseline-rows rows for scale.
+
+    python benchmarks/export_bench.py --records 5000000
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import resource
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+API = os.path.join(ROOT, "api")
+sys.path.insert(0, API)
+
+def populate(db_path, records, accounts):
+    from db import migrate
+    migrate(db_path)
+    rng = random.Random(3)
+    start = datetime(2026, 1, 1)
+    with sqlite3.connect(db_path) as conn:
+        conn.executemany("INSERT INTO accounts (email, provider, status) VALUES (?, '1', 1)",
+                         ((f"user{i}@domain{i % 500}.example",) for i in range(accounts)))
+        ids = [row[0] for row in conn.execute("SELECT id FROM accounts")]
+        templates = [row[0] for row in conn.execute("SELECT id FROM templates")] or [None]
+        seconds = 90 * 86400 / records
+        conn.executemany('''
+            INSERT INTO records (template, sender, receiver, isspam, isreply, reply_to, message_id, sent_time)
+            VALUES (?, ?, ?, ?, 0, NULL, ?, ?)
+        ''', ((rng.choice(templates), rng.choice(ids), rng.choice(ids), rng.random() < 0.05, f"<{i}@bench>",
+               (start + timedelta(seconds=i * seconds)).strftime('%Y-%m-%d %H:%M:%S')) for i in range(records)))
+
+def run_export(db_path, fmt, columns, start, end, results):
+    sys.path.insert(0, API)
+    from export import export
+    began = time.perf_counter()
+    size = 0
+    for data in export(db_path, fmt, columns, start, end):
+        size += len(data)
+    results.put((time.perf_counter() - began, size, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024))
+
+def run_baseline(db_path, rows, results):
+    import pandas as pd
+    began = time.perf_counter()
+    with sqlite3.connect(db_path) as conn:
+        frame = pd.read_sql_query(f"SELECT * FROM records LIMIT {rows}", conn)
+    size = len(json.dumps(frame.to_dict(orient='records'), default=str))
+    results.put((time.perf_counter() - began, size, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024))
+
+def measure(target, *args):
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    process = context.Process(target=target, args=(*args, results))
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--records", type=int, default=5000000)
+    parser.add_argument("--accounts", type=int, default=10000)
+    parser.add_argument("--baseline-rows", type=int, default=1000000)
+    args = parser.parse_args()
+
+    from export import has_pyarrow
+    workdir = tempfile.mkdtemp()
+    db_path = os.path.join(workdir, "bench.db")
+    shutil.copy(os.path.join(ROOT, "email_warmup.db"), db_path)
+    try:
+        began = time.perf_counter()
+        populate(db_path, args.records, args.accounts)
+        print(f"{args.records} records written in {time.perf_counter() - began:.0f}s"
+              f"{'' if has_pyarrow() else ' (pyarrow not installed: CSV only)'}")
+        day = (datetime(2026, 2, 1), datetime(2026, 2, 2))
+        cases = [
+            ("all columns", None, None, None),
+            ("sent_time,sender,isspam", ("sent_time", "sender", "isspam"), None, None),
+            ("one day", None, *day),
+        ]
+        formats = ["arrow", "parquet", "csv"] if has_pyarrow() else ["csv"]
+        for label, columns, start, end in cases:
+            for fmt in formats:
+                elapsed, size, rss = measure(run_export, db_path, fmt, columns, start, end)
+                print(f"  {label:<24} {fmt:<8} {elapsed:7.2f}s  {size / 2 ** 20:8.1f} MiB  peak RSS {rss:6.0f} MiB")
+        elapsed, size, rss = measure(run_baseline, db_path, args.baseline_rows)
+        print(f"  {'pandas to_dict + JSON':<24} {'json':<8} {elapsed:7.2f}s  {size / 2 ** 20:8.1f} MiB  peak RSS {rss:6.0f} MiB"
+              f"  ({args.baseline_rows} rows only)")
+    finally:
+        shutil.rmtree(workdir)
+
+if __name__ == "__main__":
+    main()
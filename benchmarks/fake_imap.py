@@ -0,0 +1,228 @@
+"""Local IMAP stand-in for benchmarks.
+
+Implements the IMAP4rev1 subset the monitor uses (LOGIN, LIST, SELECT,
+UID FETCH of header fields, UID MOVE/COPY/STORE, EXPUNGE, NOOP, LOGOUT),
+plus SEARCH ALL for EmailManager.list_emails, over in-memory per-user
+mailboxes with an INBOX and a \\Junk "Spam" folder.
+
+deliver() files a message in INBOX, or in Spam for a `spam_rate` share of
+messages, spread evenly in delivery order (with 0.1, every tenth), so a run
+with the same number of messages always puts the same number in spam. Given
+an ssl.SSLContext as `tls_context`, STARTTLS is offered, so clients that
+insist on it (EmailManager) can connect.
+"""
+import re
+import socket
+import socketserver
+import threading
+import time
+from email.parser import BytesHeaderParser
+
+TOKEN = re.compile(r'"((?:[^"\\]|\\.)*)"|(\S+)')
+HEADER_FIELDS = re.compile(r'BODY(?:\.PEEK)?\[HEADER\.FIELDS \(([^)]*)\)\]', re.I)
+
+class Folder:
+    def __init__(self, uidvalidity):
+        self.uidvalidity = uidvalidity
+        self.uidnext = 1
+        self.messages = {}  # uid -> [flags, raw bytes], in UID order
+
+    def add(self, raw, flags=()):
+        uid = self.uidnext
+        self.uidnext += 1
+        self.messages[uid] = [set(flags), raw]
+        return uid
+
+def parse_uid_set(spec, uids):
+    """UIDs from `uids` matching an IMAP sequence set such as "1,4:7,9:*"."""
+    highest = max(uids, default=0)
+    wanted = set()
+    for part in spec.split(','):
+        if ':' in part:
+            low, high = part.split(':')
+            low = highest if low == '*' else int(low)
+            high = highest if high == '*' else int(high)
+            low, high = min(low, high), max(low, high)
+            wanted.update(uid for uid in uids if low <= uid <= high)
+        else:
+            uid = highest if part == '*' else int(part)
+            if uid in uids:
+                wanted.add(uid)
+    return sorted(wanted)
+
+class _Handler(socketserver.StreamRequestHandler):
+    def send(self, data):
+        self.wfile.write(data if isinstance(data, bytes) else data.encode() + b"\r\n")
+
+    def capabilities(self):
+        return "IMAP4rev1 MOVE UIDPLUS" + (" STARTTLS" if self.server.tls_context and not self.tls else "")
+
+    def handle(self):
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.user = None
+        self.folder = None
+        self.tls = False
+        self.send(f"* OK [CAPABILITY {self.capabilities()}] fake-imap ready")
+        try:
+            self.converse()
+        except OSError:
+            return
+
+    def converse(self):
+        server = self.server
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            if server.latency:
+                time.sleep(server.latency)
+            tokens = [m.group(1) if m.group(1) is not None else m.group(2) for m in TOKEN.finditer(line.decode().rstrip("\r\n"))]
+            if len(tokens) < 2:
+                continue
+            tag, command, args = tokens[0], tokens[1].upper(), tokens[2:]
+            raw_args = line.decode().rstrip("\r\n").split(" ", 2)[2] if len(tokens) > 2 else ""
+            if command == "STARTTLS" and server.tls_context and not self.tls:
+                self.send(f"{tag} OK Begin TLS negotiation now")
+                self.connection = server.tls_context.wrap_socket(self.connection, server_side=True)
+                self.rfile = self.connection.makefile("rb")
+                self.wfile = socketserver._SocketWriter(self.connection)
+                self.tls = True
+                continue
+            with server.lock:
+                if not self.dispatch(tag, command, args, raw_args):
+                    return
+
+    def dispatch(self, tag, command, args, raw_args):
+        server = self.server
+        if command == "CAPABILITY":
+            self.send(f"* CAPABILITY {self.capabilities()}")
+        elif command == "LOGIN":
+            self.user = args[0]
+            server.mailbox(self.user)
+        elif command == "LOGOUT":
+            self.send("* BYE fake-imap logging out")
+            self.send(f"{tag} OK LOGOUT completed")
+            return False
+        elif command == "LIST":
+            for name in server.mailbox(self.user):
+                flags = "\\HasNoChildren \\Junk" if name == "Spam" else "\\HasNoChildren"
+                self.send(f'* LIST ({flags}) "/" "{name}"')
+        elif command in ("SELECT", "EXAMINE"):
+            folder = server.mailbox(self.user).get(args[0])
+            if folder is None:
+                self.send(f"{tag} NO Mailbox does not exist")
+                return True
+            self.folder = folder
+            self.send(f"* {len(folder.messages)} EXISTS")
+            self.send(f"* OK [UIDVALIDITY {folder.uidvalidity}] UIDs valid")
+            self.send(f"* OK [UIDNEXT {folder.uidnext}] Predicted next UID")
+        elif command == "UID":
+            return self.uid_command(tag, args[0].upper(), args[1:], raw_args.split(" ", 2)[2:])
+        elif command == "EXPUNGE":
+            self.expunge(None)
+        elif command == "SEARCH":
+            self.send(" ".join(["* SEARCH", *(str(n) for n in range(1, len(self.folder.messages) + 1))]))
+        elif command in ("NOOP", "CHECK", "CLOSE"):
+            pass
+        else:
+            self.send(f"{tag} BAD Unknown command")
+            return True
+        self.send(f"{tag} OK {command} completed")
+        return True
+
+    def sequence_number(self, uid):
+        return list(self.folder.messages).index(uid) + 1
+
+    def expunge(self, uids):
+        for uid in [uid for uid, (flags, _) in self.folder.messages.items() if "\\Deleted" in flags]:
+            if uids is None or uid in uids:
+                self.send(f"* {self.sequence_number(uid)} EXPUNGE")
+                del self.folder.messages[uid]
+
+    def uid_command(self, tag, command, args, rest):
+        mailbox = self.server.mailbox(self.user)
+        uids = parse_uid_set(args[0], list(self.folder.messages))
+        if command == "FETCH":
+            fields = HEADER_FIELDS.search(rest[0] if rest else "")
+            names = fields.group(1).split() if fields else []
+            parser = BytesHeaderParser()
+            for uid in uids:
+                raw = self.folder.messages[uid][1]
+                headers = parser.parsebytes(raw)
+                block = "".join(f"{name}: {headers[name]}\r\n" for name in names if headers[name] is not None) + "\r\n"
+                literal = block.encode()
+                item = f"BODY[HEADER.FIELDS ({' '.join(names)})]" if fields else "FLAGS ()"
+                if fields:
+                    self.send(f"* {self.sequence_number(uid)} FETCH (UID {uid} {item} {{{len(literal)}}}")
+                    self.send(literal + b")\r\n")
+                else:
+                    self.send(f"* {self.sequence_number(uid)} FETCH (UID {uid} {item})")
+        elif command in ("MOVE", "COPY"):
+            target = mailbox.get(args[1])
+            if target is None:
+                self.send(f"{tag} NO [TRYCREATE] No such mailbox")
+                return True
+            for uid in uids:
+                flags, raw = self.folder.messages[uid]
+                target.add(raw, flags - {"\\Deleted"})
+                if command == "MOVE":
+                    self.send(f"* {self.sequence_number(uid)} EXPUNGE")
+                    del self.folder.messages[uid]
+            self.server.moved += len(uids) if command == "MOVE" else 0
+        elif command == "STORE":
+            for uid in uids:
+                flags = self.folder.messages[uid][0]
+                if args[1].upper().startswith("+"):
+                    flags.update(re.findall(r"\\\w+", " ".join(args[2:])))
+                elif args[1].upper().startswith("-"):
+                    flags.difference_update(re.findall(r"\\\w+", " ".join(args[2:])))
+        elif command == "EXPUNGE":
+            self.expunge(set(uids))
+        else:
+            self.send(f"{tag} BAD Unknown UID command")
+            return True
+        self.send(f"{tag} OK UID {command} completed")
+        return True
+
+class FakeIMAPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 1024
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, spam_rate=0.0, tls_context=None):
+        super().__init__((host, port), _Handler)
+        self.latency = latency
+        self.spam_rate = spam_rate
+        self.tls_context = tls_context
+        self.lock = threading.RLock()
+        self.mailboxes = {}
+        self.moved = 0
+        self.placed = {"INBOX": 0, "Spam": 0}
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def mailbox(self, user):
+        with self.lock:
+            if user not in self.mailboxes:
+                uidvalidity = len(self.mailboxes) + 1
+                self.mailboxes[user] = {"INBOX": Folder(uidvalidity), "Spam": Folder(uidvalidity)}
+            return self.mailboxes[user]
+
+    def deliver(self, user, raw, folder=None):
+        with self.lock:
+            if folder is None:
+                # Message n goes to Spam when n * spam_rate crosses a whole number
+                n = self.placed["INBOX"] + self.placed["Spam"]
+                folder = "Spam" if int((n + 1) * self.spam_rate) > int(n * self.spam_rate) else "INBOX"
+            self.placed[folder] += 1
+            return self.mailbox(user)[folder].add(raw)
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
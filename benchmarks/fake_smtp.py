@@ -0,0 +1,212 @@
+"""Local SMTP stand-in for benchmarks.
+
+Speaks enough ESMTP (EHLO, AUTH PLAIN/LOGIN, MAIL, RCPT, DATA, NOOP, RSET,
+QUIT) for smtplib, with an optional per-connection handshake delay to model
+the TCP/TLS/LOGIN cost of a real provider, and an optional `latency`
+added to every round trip (each time the client waits for replies). If `deliver` is given, it is
+called with (recipients, message bytes) for every accepted message. With
+`throttle_rate`, MAIL FROM beyond that many messages per second (across
+all connections) is answered with a temporary 451, like a provider's
+rate limit; with `throttle_every`, every Nth MAIL FROM is, which repeats
+exactly from run to run. RCPT TO for an address in `reject_recipients` is
+answered 550, and with `refuse_data_every`, every Nth DATA gets 554
+instead of 354. Given an ssl.SSLContext as `tls_context`, STARTTLS
+is offered, so clients that insist on it (EmailManager) can connect.
+"""
+import select
+import socket
+import socketserver
+import threading
+import time
+
+class _Handler(socketserver.BaseRequestHandler):
+    # Replies are buffered and written when the client has nothing more in
+    # flight, i.e. when it is waiting for them, so a pipelined command group
+    # gets its replies in one write (after one `latency` round trip).
+    def reply(self, line):
+        self.pending += line.encode() + b"\r\n"
+
+    def flush(self):
+        if self.pending:
+            if self.server.latency:
+                time.sleep(self.server.latency)
+            self.request.sendall(self.pending)
+            self.pending = bytearray()
+
+    def readline(self):
+        while True:
+            end = self.buffer.find(b"\n")
+            if end >= 0:
+                line = bytes(self.buffer[:end + 1])
+                del self.buffer[:end + 1]
+                return line
+            # After STARTTLS, decrypted bytes can wait in the TLS layer where select cannot see them
+            if self.pending and not (self.tls and self.request.pending()) and not select.select([self.request], [], [], 0)[0]:
+                self.flush()
+            chunk = self.request.recv(65536)
+            if not chunk:
+                return b""
+            self.buffer += chunk
+
+    def handle(self):
+        server = self.server
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.buffer = bytearray()
+        self.pending = bytearray()
+        self.tls = False
+        if server.connect_delay:
+            time.sleep(server.connect_delay)
+        with server.lock:
+            server.connections += 1
+        self.reply("220 fake-smtp ESMTP ready")
+        try:
+            self.converse()
+        except OSError:
+            return
+
+    def converse(self):
+        server = self.server
+        sender = None
+        recipients = []
+        while True:
+            line = self.readline()
+            if not line:
+                return
+            verb = line.decode(errors="replace").strip().split(" ", 1)[0].upper()
+            if verb in ("EHLO", "HELO"):
+                extensions = ["fake-smtp", "AUTH PLAIN LOGIN", "8BITMIME", "SIZE 35882577"]
+                if server.pipelining:
+                    extensions.append("PIPELINING")
+                if server.tls_context and not self.tls:
+                    extensions.append("STARTTLS")
+                lines = ["250-" + ext for ext in extensions[:-1]] + ["250 " + extensions[-1]]
+                self.reply("\r\n".join(lines))
+            elif verb == "STARTTLS" and server.tls_context and not self.tls:
+                self.reply("220 2.0.0 Ready to start TLS")
+                self.flush()
+                self.request = server.tls_context.wrap_socket(self.request, server_side=True)
+                self.tls = True
+                self.buffer = bytearray()
+                sender, recipients = None, []
+            elif verb == "AUTH":
+                if line.split()[1].upper() == b"LOGIN":
+                    self.reply("334 VXNlcm5hbWU6")
+                    self.readline()
+                    self.reply("334 UGFzc3dvcmQ6")
+                    self.readline()
+                if server.auth_delay:
+                    time.sleep(server.auth_delay)
+                self.reply("235 2.7.0 Authentication successful")
+            elif verb == "DATA" and not recipients:
+                self.reply("503 5.5.1 Error: no valid recipients")
+            elif verb == "DATA" and server.refuses_data():
+                sender, recipients = None, []
+                self.reply("554 5.7.1 Message refused")
+            elif verb == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                size = 0
+                lines = []
+                while True:
+                    chunk = self.readline()
+                    if not chunk or chunk == b".\r\n":
+                        break
+                    size += len(chunk)
+                    if server.deliver:
+                        lines.append(chunk[1:] if chunk.startswith(b"..") else chunk)
+                with server.lock:
+                    server.messages += 1
+                    server.bytes += size
+                if server.deliver:
+                    server.deliver(recipients, b"".join(lines))
+                sender, recipients = None, []
+                self.reply("250 2.0.0 Ok: queued")
+            elif verb == "QUIT":
+                self.reply("221 2.0.0 Bye")
+                self.flush()
+                return
+            elif verb == "RCPT" and sender is None:
+                self.reply("503 5.5.1 Error: need MAIL command")
+            elif verb == "RCPT":
+                recipient = line.decode().split(":", 1)[1].strip().strip("<>")
+                if recipient in server.reject_recipients:
+                    self.reply("550 5.1.1 Recipient address rejected: User unknown")
+                    continue
+                recipients.append(recipient)
+                self.reply("250 2.0.0 Ok")
+            elif verb == "MAIL" and server.throttled():
+                self.reply("451 4.7.1 Rate limited, try again later")
+            elif verb == "MAIL":
+                sender = line.decode().split(":", 1)[1].strip()
+                self.reply("250 2.0.0 Ok")
+            elif verb == "RSET":
+                sender, recipients = None, []
+                self.reply("250 2.0.0 Ok")
+            elif verb == "NOOP":
+                self.reply("250 2.0.0 Ok")
+            else:
+                self.reply("502 5.5.2 Command not recognized")
+
+class FakeSMTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 1024
+
+    def __init__(self, host="127.0.0.1", port=0, connect_delay=0.0, auth_delay=0.0, pipelining=True, deliver=None,
+                 throttle_rate=None, latency=0.0, throttle_every=None, tls_context=None, reject_recipients=(),
+                 refuse_data_every=None):
+        super().__init__((host, port), _Handler)
+        self.connect_delay = connect_delay
+        self.auth_delay = auth_delay
+        self.pipelining = pipelining
+        self.deliver = deliver
+        self.throttle_rate = throttle_rate
+        self.latency = latency
+        self.throttle_every = throttle_every
+        self.tls_context = tls_context
+        self.reject_recipients = set(reject_recipients)
+        self.refuse_data_every = refuse_data_every
+        self.mail_commands = 0
+        self.data_commands = 0
+        self.window = (0, 0)  # (second, messages accepted in it)
+        self.rejected = 0
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.messages = 0
+        self.bytes = 0
+
+    def throttled(self):
+        if self.throttle_every:
+            with self.lock:
+                self.mail_commands += 1
+                if self.mail_commands % self.throttle_every == 0:
+                    self.rejected += 1
+                    return True
+        if not self.throttle_rate:
+            return False
+        second = int(time.monotonic())
+        with self.lock:
+            start, count = self.window if self.window[0] == second else (second, 0)
+            if count >= self.throttle_rate:
+                self.rejected += 1
+                return True
+            self.window = (start, count + 1)
+            return False
+
+    def refuses_data(self):
+        if not self.refuse_data_every:
+            return False
+        with self.lock:
+            self.data_commands += 1
+            return self.data_commands % self.refuse_data_every == 0
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
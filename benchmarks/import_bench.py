@@ -0,0 +1,55 @@
+"""Bulk account import through POST /api/account/import.
+
+    python benchmarks/import_bench.py --accounts 100000
+"""
+import argparse
+import contextlib
+import io
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "api"))
+
+def csv_upload(count, providers=8):
+    lines = ["email,password,provider_name,imap_server,smtp_server,imap_port,smtp_port,warmup_style,daily_limit"]
+    for i in range(count):
+        p = i % providers
+        lines.append(f"user{i}@domain{p}.example.com,secret,Provider {p},imap.domain{p}.example.com,"
+                     f"smtp.domain{p}.example.com,993,587,{1 + i % 3},100")
+    # A few bad rows to exercise the error report
+    lines += ["not-an-email,secret,P,imap.x.com,smtp.x.com,993,587,1,100", "user0@domain0.example.com,secret,P,i,s,993,587,1,100"]
+    return ("\n".join(lines) + "\n").encode()
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--accounts", type=int, default=100000)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    db_path = os.path.join(workdir, "bench.db")
+    shutil.copy(os.path.join(ROOT, "email_warmup.db"), db_path)
+    os.environ["EMAIL_WARMUP_DB"] = db_path
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            import index
+        client = index.app.test_client()
+        body = csv_upload(args.accounts)
+        start = time.perf_counter()
+        response = client.post("/api/account/import", data={"file": (io.BytesIO(body), "accounts.csv")},
+                               content_type="multipart/form-data")
+        elapsed = time.perf_counter() - start
+        report = response.get_json()
+        print(f"{report['imported']} imported, {report['failed']} failed in {elapsed:.2f}s "
+              f"({report['imported'] / elapsed:.0f} rows/s), upload {len(body) / 1e6:.1f} MB")
+        print("errors:", report["errors"][:2])
+        print(f"peak RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB")
+    finally:
+        shutil.rmtree(workdir)
+
+if __name__ == "__main__":
+    main()
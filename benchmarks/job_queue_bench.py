@@ -0,0 +1,62 @@
+"""Claim/complete throughput of the send_jobs queue with N worker processes.
+
+    python benchmarks/job_queue_bench.py --jobs 100000 --workers 4
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+from contextlib import closing
+from multiprocessing import Process
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "api"))
+
+from db import migrate
+from jobs import JobQueue, run_worker
+
+def noop_send(job):
+    return True
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--jobs", type=int, default=100000)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--batch-size", type=int, default=200)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    db_path = os.path.join(workdir, "bench.db")
+    shutil.copy(os.path.join(ROOT, "email_warmup.db"), db_path)
+    migrate(db_path)
+    try:
+        queue = JobQueue(db_path)
+        with closing(queue._connect()) as conn:
+            sender, receiver = [row[0] for row in conn.execute("SELECT id FROM accounts LIMIT 2")]
+
+        start = time.perf_counter()
+        queue.enqueue_many([(sender, receiver, None, 0) for _ in range(args.jobs)])
+        elapsed = time.perf_counter() - start
+        print(f"enqueue   {args.jobs} jobs in {elapsed:.2f}s  {args.jobs / elapsed:10.0f} jobs/s")
+
+        start = time.perf_counter()
+        workers = [Process(target=run_worker, args=(db_path, noop_send, args.batch_size),
+                           kwargs={"stop_when_empty": True}) for _ in range(args.workers)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - start
+        counts = queue.counts()
+        done = counts.get("done", 0)
+        print(f"claim+complete {done} jobs with {args.workers} workers in {elapsed:.2f}s  {done / elapsed:10.0f} jobs/s")
+        with closing(queue._connect()) as conn:
+            print("records written:", conn.execute("SELECT COUNT(*) FROM records").fetchone()[0])
+        print("queue:", counts)
+    finally:
+        shutil.rmtree(workdir)
+
+if __name__ == "__main__":
+    main()
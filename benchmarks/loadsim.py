@@ -0,0 +1,330 @@
+"""End-to-end load simulation of the API against local SMTP and IMAP stand-ins.
+
+A scenario seeds providers and templates (benchmarks/seed.py) that point at
+fake SMTP servers, one per provider on 127.0.0.N, and at one fake IMAP
+server, then drives the Flask app through its test client:
+
+- create:  the synthetic accounts through POST /api/account/import, 1000 per request
+- warm:    POST /api/account/warm for every account, which starts the dispatcher
+           with a sending window that has already closed, so nothing is sent yet
+- send:    the dispatcher restarted with today's sends planned for the next
+           second, until every account has made its planned send attempts
+           (--sends-per-account is also the daily limit, which caps the ramp),
+           over the real SMTP path
+- monitor: POST /api/monitor/start, one poll of every mailbox, then stop
+
+The stand-ins offer STARTTLS with a throwaway certificate made with the
+openssl command, so nothing under api/ is patched. Only the rate limits are
+raised, through POST /api/ratelimits, so the run measures the pipeline and
+not the default per-provider budget. Workloads repeat exactly: the seeder
+draws from --seed, every 1/--spam-rate-th message delivered lands in Spam,
+and --throttle-every N answers every Nth MAIL FROM with a 451. The app runs
+in a fresh process per scenario, so its peak RSS is its own. The 50k
+scenario takes about 20 minutes on one core.
+
+Reports are JSON: throughput, latency percentiles (ms) and peak RSS per
+scenario and phase. --compare checks a report against a baseline and exits
+with 1 if any of them got worse by more than --tolerance.
+
+    python benchmarks/loadsim.py --scenario 10 --scenario 1k --report loadsim.json
+    python benchmarks/loadsim.py --compare baseline.json loadsim.json --tolerance 0.2
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import resource
+import shutil
+import sqlite3
+import ssl
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, datetime
+
+import numpy as np
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "api"))
+
+from fake_imap import FakeIMAPServer
+from fake_smtp import FakeSMTPServer
+from seed import account_rows, reset, seed_providers, seed_templates
+
+SCENARIOS = {
+    '10': {'accounts': 10, 'providers': 2, 'domains': 2},
+    '1k': {'accounts': 1000, 'providers': 3, 'domains': 4},
+    '50k': {'accounts': 50000, 'providers': 5, 'domains': 20},
+}
+IMPORT_CHUNK = 1000
+REPORT_VERSION = 1
+# Latency changes smaller than this are noise, whatever the ratio
+LATENCY_FLOOR_MS = 1.0
+
+def tls_context(workdir):
+    """A server context with a self-signed P-256 certificate (EmailManager does not verify it)."""
+    cert, key = os.path.join(workdir, "cert.pem"), os.path.join(workdir, "key.pem")
+    subprocess.run(["openssl", "req", "-x509", "-newkey", "ec", "-pkeyopt", "ec_paramgen_curve:prime256v1", "-nodes",
+                    "-days", "1", "-subj", "/CN=localhost", "-keyout", key, "-out", cert], check=True, capture_output=True)
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert, key)
+    return context
+
+def raise_open_files():
+    # Every sender holds an SMTP session and every mailbox an IMAP session
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+def percentiles(seconds):
+    """p50/p95/p99/max in milliseconds (nearest rank); None without samples."""
+    if not seconds:
+        return None
+    ordered = sorted(seconds)
+
+    def rank(q):
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 3)
+
+    return {'p50': rank(0.50), 'p95': rank(0.95), 'p99': rank(0.99), 'max': round(ordered[-1] * 1000, 3)}
+
+def phase(items, seconds, latencies=None, **extra):
+    return {'items': items, 'seconds': round(seconds, 3), 'throughput': round(items / seconds, 1) if seconds else None,
+            'latency_ms': percentiles(latencies), **extra}
+
+class Client:
+    """The app's test client, timing each request and counting the ones not answered as expected."""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+        self.errors = {}
+
+    def post(self, url, expected=(200,), **kwargs):
+        began = time.perf_counter()
+        response = self.client.post(url, **kwargs)
+        seconds = time.perf_counter() - began
+        if response.status_code not in expected:
+            self.errors[response.status_code] = self.errors.get(response.status_code, 0) + 1
+        return seconds
+
+    def get_json(self, url):
+        return self.client.get(url).get_json()
+
+    def take_errors(self):
+        """{status: count} of the requests not answered as expected since the last call."""
+        errors, self.errors = self.errors, {}
+        return {str(status): count for status, count in sorted(errors.items())}
+
+def simulate(db_path, providers, config, results):
+    """Run the four phases against the app in this process and put the report on `results`."""
+    raise_open_files()
+    os.environ["EMAIL_WARMUP_DB"] = db_path
+    os.environ.setdefault("EMAIL_WARMUP_LOG_LEVEL", "ERROR")
+    from index import app
+    from planner import daily_volume
+    import state
+
+    client = Client(app)
+    # The daily limit ends each account's sends (and receives) after its share
+    rows = account_rows(config['accounts'], providers, config['domains'], config['seed'], config['sends_per_account'])
+    phases = {}
+
+    keys = {f"provider:{provider['smtp_server']}" for provider in providers}
+    keys.update(f"domain:{row['email'].rpartition('@')[2]}" for row in rows)
+    for key in sorted(keys):
+        client.post('/api/ratelimits', json={'key': key, 'per_minute': config['rate_limit'], 'burst': config['rate_limit']})
+    if client.errors:
+        raise RuntimeError(f"Could not set the rate limits: {client.take_errors()}")
+
+    began = time.perf_counter()
+    latencies = []
+    for start in range(0, len(rows), IMPORT_CHUNK):
+        body = "\n".join(json.dumps(row) for row in rows[start:start + IMPORT_CHUNK])
+        latencies.append(client.post('/api/account/import?format=jsonl', (201,), data=body, content_type='application/x-ndjson'))
+    phases['create'] = phase(len(rows), time.perf_counter() - began, latencies, requests=len(latencies),
+                             errors=client.take_errors())
+
+    # Time every send the dispatcher makes, limiter wait and SMTP session included
+    dispatcher = state.dispatcher
+    send = dispatcher.send_func
+    send_seconds = []
+
+    def timed_send(account, receiver_email):
+        began = time.perf_counter()
+        try:
+            return send(account, receiver_email)
+        finally:
+            send_seconds.append(time.perf_counter() - began)
+
+    dispatcher.send_func = timed_send
+    dispatcher.window = (0, 0)
+    began = time.perf_counter()
+    latencies = [client.post('/api/account/warm', json={'email': row['email']}) for row in rows]
+    phases['warm'] = phase(len(rows), time.perf_counter() - began, latencies, errors=client.take_errors())
+
+    # Brand-new accounts send their first ramp day's volume
+    target = int(daily_volume(np.array([row['daily_limit'] for row in rows]), np.array([row['warmup_style'] for row in rows]),
+                              np.zeros(len(rows), dtype=np.int64)).sum())
+    client.post('/api/dispatcher/stop')
+    now = time.time() - time.mktime(date.today().timetuple())
+    dispatcher.window = (now, now + 1)
+    began = time.perf_counter()
+    client.post('/api/dispatcher/start')
+    deadline = time.monotonic() + config['timeout']
+    while dispatcher.sent + dispatcher.failed < target and time.monotonic() < deadline:
+        time.sleep(0.01)
+    seconds = time.perf_counter() - began
+    timed_out = dispatcher.sent + dispatcher.failed < target
+    client.post('/api/dispatcher/stop')
+    phases['send'] = phase(dispatcher.sent, seconds, send_seconds, failed=dispatcher.failed, timed_out=timed_out)
+
+    monitor = state.monitor
+    began = time.perf_counter()
+    client.post('/api/monitor/start')
+    deadline = time.monotonic() + config['timeout']
+    while monitor.polls < 1 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    seconds = time.perf_counter() - began
+    status = client.get_json('/api/monitor/status')
+    client.post('/api/monitor/stop')
+    phases['monitor'] = phase(status['mailboxes'], seconds, inbox=status['seen_in_inbox'], spam=status['rescued_from_spam'],
+                              mailbox_errors=status['errors'], errors=client.take_errors(), timed_out=status['polls'] < 1)
+
+    results.put({'phases': phases, 'peak_rss_mib': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)})
+
+def run_scenario(name, config, workdir):
+    """Start the stand-ins, seed a fresh database and run simulate() in its own process."""
+    context = tls_context(workdir)
+    imap = FakeIMAPServer(latency=config['latency'], spam_rate=config['spam_rate'], tls_context=context).start()
+
+    def deliver(recipients, data):
+        for recipient in recipients:
+            imap.deliver(recipient, data)
+
+    servers = [FakeSMTPServer(host=f"127.0.0.{n + 1}", connect_delay=config['handshake'], latency=config['latency'],
+                              throttle_every=config['throttle_every'], deliver=deliver, tls_context=context).start()
+               for n in range(config['providers'])]
+    db_path = os.path.join(workdir, f"{name}.db")
+    shutil.copy(os.path.join(ROOT, "email_warmup.db"), db_path)
+    try:
+        import db
+        db.migrate(db_path)
+        with db.connect(db_path) as conn:
+            reset(conn)
+            providers = seed_providers(conn, [(f"127.0.0.{n + 1}", server.port, "127.0.0.1", imap.port)
+                                              for n, server in enumerate(servers)])
+            seed_templates(conn, config['templates'], config['seed'])
+        spawn = multiprocessing.get_context('spawn')
+        results = spawn.Queue()
+        process = spawn.Process(target=simulate, args=(db_path, providers, config, results))
+        process.start()
+        while True:
+            try:
+                result = results.get(timeout=1)
+                break
+            except queue.Empty:
+                if not process.is_alive():
+                    raise RuntimeError(f"Scenario {name} failed (exit code {process.exitcode})")
+        process.join()
+        result['phases']['send'].update(delivered=sum(server.messages for server in servers),
+                                        throttled=sum(server.rejected for server in servers),
+                                        smtp_connections=sum(server.connections for server in servers))
+        result['phases']['monitor'].update(placed_inbox=imap.placed['INBOX'], placed_spam=imap.placed['Spam'])
+        return {'config': config, **result}
+    finally:
+        for server in servers:
+            server.stop()
+        imap.stop()
+
+def commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def print_scenario(name, result):
+    print(f"{name} accounts (peak RSS {result['peak_rss_mib']:.0f} MiB)")
+    for label, stats in result['phases'].items():
+        latency = stats['latency_ms']
+        extra = {key: value for key, value in stats.items() if key not in ('items', 'seconds', 'throughput', 'latency_ms')}
+        print(f"  {label:<8} {stats['items']:7d} in {stats['seconds']:8.2f}s {stats['throughput'] or 0:9.1f}/s"
+              + (f"  p50 {latency['p50']:8.2f} ms  p95 {latency['p95']:8.2f} ms  p99 {latency['p99']:8.2f} ms" if latency else "")
+              + (f"  {json.dumps(extra)}" if extra else ""))
+
+def compare(baseline, current, tolerance):
+    """Print each metric of `current` against `baseline`; returns the number of regressions."""
+    regressions = 0
+    for name, result in current['scenarios'].items():
+        base = baseline['scenarios'].get(name)
+        if base is None:
+            print(f"{name}: not in the baseline")
+            continue
+        checks = [('peak_rss_mib', base['peak_rss_mib'], result['peak_rss_mib'], False)]
+        for label, stats in result['phases'].items():
+            old = base['phases'].get(label)
+            if old is None:
+                continue
+            checks.append((f"{label}.throughput", old['throughput'], stats['throughput'], True))
+            for rank in ('p95', 'p99'):
+                if old['latency_ms'] and stats['latency_ms']:
+                    checks.append((f"{label}.{rank}_ms", old['latency_ms'][rank], stats['latency_ms'][rank], False))
+        for metric, old, new, higher_is_better in checks:
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            worse = -change if higher_is_better else change
+            regressed = worse > tolerance and not (metric.endswith('_ms') and new - old < LATENCY_FLOOR_MS)
+            regressions += regressed
+            print(f"  {name:>4} {metric:<20} {old:12.2f} -> {new:12.2f}  {change:+7.1%}{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scenario", action="append", choices=list(SCENARIOS), help="default: 10 and 1k")
+    parser.add_argument("--report", help="write the JSON report here")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CURRENT"), help="compare two reports and exit")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative change before a regression")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--templates", type=int, default=20)
+    parser.add_argument("--sends-per-account", type=int, default=1)
+    parser.add_argument("--latency-ms", type=float, default=1, help="added to every SMTP and IMAP round trip")
+    parser.add_argument("--handshake-ms", type=float, default=0, help="added to every SMTP connect")
+    parser.add_argument("--spam-rate", type=float, default=0.1, help="share of messages filed in Spam")
+    parser.add_argument("--throttle-every", type=int, default=0, help="answer every Nth MAIL FROM with 451 (0: never)")
+    parser.add_argument("--rate-limit", type=float, default=1e6, help="per-minute budget set for every provider and domain")
+    parser.add_argument("--timeout", type=float, default=600, help="seconds the send and monitor phases may take")
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0]) as baseline, open(args.compare[1]) as current:
+            regressions = compare(json.load(baseline), json.load(current), args.tolerance)
+        print(f"{regressions} regression(s) beyond {args.tolerance:.0%}")
+        sys.exit(1 if regressions else 0)
+
+    raise_open_files()
+    report = {
+        'version': REPORT_VERSION,
+        'commit': commit(),
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'cpus': os.cpu_count(),
+        'scenarios': {},
+    }
+    workdir = tempfile.mkdtemp()
+    try:
+        for name in args.scenario or ['10', '1k']:
+            config = dict(SCENARIOS[name], seed=args.seed, templates=args.templates, sends_per_account=args.sends_per_account,
+                          latency=args.latency_ms / 1000, handshake=args.handshake_ms / 1000, spam_rate=args.spam_rate,
+                          throttle_every=args.throttle_every, rate_limit=args.rate_limit, timeout=args.timeout)
+            report['scenarios'][name] = run_scenario(name, config, workdir)
+            print_scenario(name, report['scenarios'][name])
+    finally:
+        shutil.rmtree(workdir)
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
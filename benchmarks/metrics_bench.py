@@ -0,0 +1,101 @@
+"""Query latency of the /api/metrics endpoints over synthetic rollups.
+
+Generates --days of traffic for --accounts accounts spread over --providers
+providers (each account active in --hours random hours a day), written
+through the same rollup path as CounterAggregator, then times the
+dashboard queries through the Flask test client.
+
+    python benchmarks/metrics_bench.py --accounts 10000 --days 90
+"""
+import argparse
+import contextlib
+import io
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "api"))
+
+def generate(conn, accounts, providers, days, hours, end, rng):
+    """Seed accounts and `days` of per-hour sent/received/spam increments up to `end`."""
+    from metrics import write_rollups
+    with conn:
+        conn.executemany("INSERT INTO accounts (email, provider, status) VALUES (?, ?, 1)",
+                         ((f"user{i}@domain{i % 50}.example.com", str(1 + i % providers)) for i in range(accounts)))
+    emails = [f"user{i}@domain{i % 50}.example.com" for i in range(accounts)]
+    start = (end - timedelta(days=days)).replace(minute=0, second=0, microsecond=0)
+    for day in range(days):
+        pending = {}
+        for email in emails:
+            for hour in rng.sample(range(24), hours):
+                sent = rng.randint(1, 10)
+                moment = start + timedelta(days=day, hours=hour)
+                pending[email, moment.strftime('%Y-%m-%d %H:00')] = [sent, rng.randint(1, 10), int(sent * rng.random() * 0.2)]
+        with conn:
+            write_rollups(conn, pending)
+
+def timed(client, url, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        response = client.get(url)
+        samples.append((time.perf_counter() - start) * 1000)
+        assert response.status_code == 200, response.json
+    return response, samples
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--accounts", type=int, default=10000)
+    parser.add_argument("--providers", type=int, default=4)
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--hours", type=int, default=3)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    db_path = os.path.join(workdir, "bench.db")
+    shutil.copy(os.path.join(ROOT, "email_warmup.db"), db_path)
+    os.environ["EMAIL_WARMUP_DB"] = db_path
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            import index
+        import db
+        end = datetime.now()
+        conn = db.connect(db_path)
+        start = time.perf_counter()
+        generate(conn, args.accounts, args.providers, args.days, args.hours, end, random.Random(1))
+        rows = {table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                for table in ("metrics_hourly", "metrics_daily", "metrics_weekly")}
+        print(f"generated {args.days} days for {args.accounts} accounts in {time.perf_counter() - start:.1f}s: "
+              + ", ".join(f"{table} {count}" for table, count in rows.items()))
+
+        account_id = conn.execute("SELECT id FROM accounts ORDER BY id DESC LIMIT 1").fetchone()[0]
+        since = (end - timedelta(days=args.days)).date().isoformat()
+        recent = (end - timedelta(days=3)).date().isoformat()
+        client = index.app.test_client()
+        for label, url in (
+            (f"total, {args.days}d daily", f"/api/metrics?start={since}&granularity=day"),
+            (f"total, {args.days}d hourly", f"/api/metrics?start={since}&granularity=hour"),
+            (f"total, {args.days}d weekly", f"/api/metrics?start={since}&granularity=week"),
+            (f"all providers, {args.days}d daily", f"/api/metrics/providers?start={since}&granularity=day"),
+            (f"one provider, {args.days}d daily", f"/api/metrics/provider/1?start={since}&granularity=day"),
+            (f"one account, {args.days}d daily", f"/api/metrics/account/{account_id}?start={since}&granularity=day"),
+            ("one account, 3d hourly", f"/api/metrics/account/{account_id}?start={recent}"),
+        ):
+            response, samples = timed(client, url, args.repeat)
+            points = response.json['series']
+            count = sum(len(p) for p in points.values()) if isinstance(points, dict) else len(points)
+            samples.sort()
+            print(f"  {label:<28} {count:5d} points  p50 {statistics.median(samples):6.2f} ms  "
+                  f"p99 {samples[int(len(samples) * 0.99) - 1]:6.2f} ms")
+    finally:
+        shutil.rmtree(workdir)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""Receiver picks per second of the PairingEngine at 1k, 10k and 100k active accounts.
+
+Compares with the dispatcher's previous receiver choice (a list of every
+other active account built per send), times status toggles (remove + add),
+and checks the spread: each provider's share of picks against its share of
+accounts, and the most picks any one receiver got.
+
+    python benchmarks/pairing_bench.py --picks 200000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api"))
+
+from pairing import PairingEngine
+
+PROVIDERS = {1: 0.45, 2: 0.30, 3: 0.15, 4: 0.07, 5: 0.03}
+
+def make_accounts(count, rng):
+    providers = rng.choices(list(PROVIDERS), weights=list(PROVIDERS.values()), k=count)
+    return {
+        i: {'id': i, 'email': f"user{i}@domain{rng.randrange(max(count // 50, 1))}.example",
+            'provider': provider, 'daily_limit': 10 ** 6}
+        for i, provider in enumerate(providers, start=1)
+    }
+
+def old_pick(receivers, sender_email, offset):
+    others = [email for email in receivers if email != sender_email]
+    return others[offset % len(others)]
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--picks", type=int, default=200000)
+    args = parser.parse_args()
+    rng = random.Random(7)
+
+    for count in (1000, 10000, 100000):
+        accounts = make_accounts(count, rng)
+        engine = PairingEngine(repeat_window=3600)
+        start = time.perf_counter()
+        engine.sync(accounts)
+        build = time.perf_counter() - start
+
+        senders = [rng.randrange(1, count + 1) for _ in range(args.picks)]
+        picked = Counter()
+        start = time.perf_counter()
+        for i, sender in enumerate(senders):
+            receiver = engine.pick(sender, now=i)
+            if receiver is not None:
+                picked[receiver['id']] += 1
+        pick = (time.perf_counter() - start) / args.picks
+
+        receivers = [account['email'] for account in accounts.values()]
+        runs = max(20000 // count, 3)
+        start = time.perf_counter()
+        for i in range(runs):
+            old_pick(receivers, accounts[senders[i]]['email'], i)
+        old = (time.perf_counter() - start) / runs
+
+        toggled = rng.sample(list(accounts), min(10000, count // 2))
+        start = time.perf_counter()
+        for account_id in toggled:
+            engine.remove(account_id)
+        for account_id in toggled:
+            engine.add(accounts[account_id])
+        toggle = (time.perf_counter() - start) / (2 * len(toggled))
+
+        share = Counter()
+        for account_id, times in picked.items():
+            share[accounts[account_id]['provider']] += times
+        total = sum(picked.values())
+        spread = "  ".join(f"p{p} {share[p] / total:.1%}/{PROVIDERS[p]:.0%}" for p in PROVIDERS)
+        print(f"{count:>7} accounts: pick {pick * 1e6:5.2f} us (before: {old * 1e6:9.1f} us)  toggle {toggle * 1e6:5.2f} us  "
+              f"index built in {build * 1000:6.1f} ms")
+        print(f"{'':>18}{total} picks, max {max(picked.values())} per receiver "
+              f"(mean {total / count:.1f}); provider share/accounts: {spread}")
+
+if __name__ == "__main__":
+    main()
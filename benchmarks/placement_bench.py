@@ -0,0 +1,87 @@
+"""Placement monitor against the local IMAP stand-in.
+
+Seeds N mailboxes with warmup messages (a share of them in Spam), runs one
+monitor poll, checks records.isspam and the spam rescues, then times an
+incremental poll with nothing new.
+
+    python benchmarks/placement_bench.py --mailboxes 500 --messages 20 --workers 32
+"""
+import argparse
+import contextlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "api"))
+
+from fake_imap import FakeIMAPServer
+import db
+from placement import PlacementMonitor
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mailboxes", type=int, default=200)
+    parser.add_argument("--messages", type=int, default=20, help="warmup messages per mailbox")
+    parser.add_argument("--spam-rate", type=float, default=0.2)
+    parser.add_argument("--workers", type=int, default=32)
+    parser.add_argument("--latency-ms", type=float, default=2, help="per-command IMAP latency")
+    args = parser.parse_args()
+
+    server = FakeIMAPServer(latency=args.latency_ms / 1000).start()
+    workdir = tempfile.mkdtemp()
+    db_path = os.path.join(workdir, "bench.db")
+    shutil.copy(os.path.join(ROOT, "email_warmup.db"), db_path)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            db.migrate(db_path)
+        with db.connect(db_path) as conn:
+            provider = conn.execute('''
+                INSERT INTO providers (provider_name, smtp_server, imap_server, smtp_port, imap_port)
+                VALUES ('Local', '127.0.0.1', '127.0.0.1', '25', ?)
+            ''', (str(server.port),)).lastrowid
+            conn.execute("UPDATE accounts SET status = 0")
+            ids = []
+            for i in range(args.mailboxes):
+                ids.append(conn.execute('''
+                    INSERT INTO accounts (email, password, provider, daily_limit, warmup_style, status)
+                    VALUES (?, 'secret', ?, 100, 1, 1)
+                ''', (f"box{i}@example.com", provider)).lastrowid)
+            records, expected_spam = [], 0
+            for n, receiver in enumerate(ids):
+                for m in range(args.messages):
+                    message_id = f"<{n}.{m}@example.com>"
+                    in_spam = (n * args.messages + m) % round(1 / args.spam_rate) == 0
+                    expected_spam += in_spam
+                    server.deliver(f"box{n}@example.com", f"Message-ID: {message_id}\r\nSubject: hi\r\n\r\nbody\r\n".encode(),
+                                   "Spam" if in_spam else "INBOX")
+                    records.append((None, ids[(n + 1) % len(ids)], receiver, None, message_id, "2025-01-01 00:00:00", "hi"))
+            db.insert_records(conn, records)
+
+        monitor = PlacementMonitor(db_path, max_workers=args.workers, use_tls=False)
+        with ThreadPoolExecutor(max_workers=args.workers) as executor, contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            monitor.poll_once(executor)
+            first = time.perf_counter() - start
+            start = time.perf_counter()
+            monitor.poll_once(executor)
+            second = time.perf_counter() - start
+
+        with db.connect(db_path) as conn:
+            spam, inbox = conn.execute("SELECT SUM(isspam = 1), SUM(isspam = 0) FROM records").fetchone()
+        total = args.mailboxes * args.messages
+        print(f"{args.mailboxes} mailboxes, {total} warmup messages, {args.workers} workers")
+        print(f"first poll        {first:6.2f}s  {total / first:8.0f} msg/s  {args.mailboxes / first:6.0f} mailboxes/s")
+        print(f"incremental poll  {second:6.2f}s  {args.mailboxes / second:6.0f} mailboxes/s")
+        print(f"records isspam=1 {spam} (expected {expected_spam}), isspam=0 {inbox}; "
+              f"moved by server {server.moved}; monitor errors {monitor.errors}")
+    finally:
+        server.stop()
+        shutil.rmtree(workdir)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+"""Time planner.plan_day over synthetic accounts.
+
+    python benchmarks/planner_bench.py --accounts 50000
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import date
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api"))
+
+from planner import plan_day
+
+def synthetic_accounts(count, providers, seed=0):
+    rng = np.random.default_rng(seed)
+    today = np.datetime64(date.today(), 'D')
+    return {
+        'id': np.arange(1, count + 1, dtype=np.int64),
+        'provider': rng.integers(1, providers + 1, count),
+        'daily_limit': rng.choice([50, 100, 200], count),
+        'warmup_style': rng.integers(1, 4, count),
+        'started_at': today - rng.integers(0, 60, count).astype('timedelta64[D]'),
+    }
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--accounts", type=int, default=50000)
+    parser.add_argument("--providers", type=int, default=8)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    accounts = synthetic_accounts(args.accounts, args.providers)
+    timings = []
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        plan = plan_day(accounts, seed=1)
+        timings.append(time.perf_counter() - start)
+    print(f"{args.accounts} accounts -> {len(plan)} sends, best {min(timings) * 1000:.0f} ms, "
+          f"median {sorted(timings)[len(timings) // 2] * 1000:.0f} ms")
+    assert not np.any(plan.sender == plan.receiver)
+    assert np.all(np.diff(plan.send_at) >= 0)
+
+if __name__ == "__main__":
+    main()
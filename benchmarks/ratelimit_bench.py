@@ -0,0 +1,146 @@
+"""Shared rate limiter across worker processes.
+
+1. reservations/s the SQLite buckets sustain with several processes;
+2. how closely processes sharing one bucket stay within its budget;
+3. sends against a stand-in that answers 451 above --server-rate msg/s,
+   without the limiter and with it (configured above the server's limit, so
+   the adaptive backoff has to find the real one).
+
+    python benchmarks/ratelimit_bench.py --processes 4 --threads 4 --seconds 10
+"""
+import argparse
+import os
+import shutil
+import smtplib
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from multiprocessing import Process, Queue
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "api"))
+
+from db import migrate
+from fake_smtp import FakeSMTPServer
+import ratelimit
+from ratelimit import RateLimiter
+
+SERVER = "127.0.0.1"
+DOMAIN = "example.org"
+
+def in_threads(threads, func):
+    results = []
+    workers = [threading.Thread(target=lambda: results.append(func())) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return [sum(column) for column in zip(*results)]
+
+def reserve_loop(db_path, seconds, threads, results):
+    limiter = RateLimiter(db_path)
+
+    def run():
+        count, end = 0, time.time() + seconds
+        while time.time() < end:
+            limiter.reserve(SERVER, DOMAIN)
+            count += 1
+        return (count,)
+    results.put(in_threads(threads, run))
+
+def wait_loop(db_path, seconds, threads, results):
+    limiter = RateLimiter(db_path, max_wait=seconds)
+
+    def run():
+        count, end = 0, time.time() + seconds
+        while True:
+            if limiter.wait(SERVER, DOMAIN):
+                if time.time() > end:
+                    return (count,)
+                count += 1
+    results.put(in_threads(threads, run))
+
+def send_loop(db_path, port, seconds, threads, use_limiter, results):
+    # Shorter backoff and recovery than production, to fit a few cycles in the run
+    ratelimit.BASE_BACKOFF = 0.25
+    ratelimit.RECOVERY_SECONDS = 20
+    limiter = RateLimiter(db_path, max_wait=1) if use_limiter else None
+    message = f"From: a@{SERVER}\r\nTo: b@{DOMAIN}\r\nSubject: hi\r\n\r\nhello\r\n"
+
+    def run():
+        sent = rejected = 0
+        end = time.time() + seconds
+        with smtplib.SMTP(SERVER, port) as conn:
+            conn.login("a", "secret")
+            while time.time() < end:
+                if limiter and not limiter.wait(SERVER, DOMAIN):
+                    continue
+                try:
+                    conn.sendmail(f"a@{SERVER}", f"b@{DOMAIN}", message)
+                    sent += 1
+                except smtplib.SMTPSenderRefused as e:
+                    rejected += 1
+                    if limiter:
+                        limiter.record_failure(SERVER, DOMAIN, e)
+        return sent, rejected
+    results.put(in_threads(threads, run))
+
+def run_processes(processes, target, *args):
+    results = Queue()
+    workers = [Process(target=target, args=(*args, results)) for _ in range(processes)]
+    for worker in workers:
+        worker.start()
+    totals = [sum(column) for column in zip(*[results.get() for _ in workers])]
+    for worker in workers:
+        worker.join()
+    return totals
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--budget", type=float, default=20, help="msg/s of the shared bucket in part 2")
+    parser.add_argument("--server-rate", type=int, default=200, help="msg/s the stand-in accepts in part 3")
+    args = parser.parse_args()
+    workers = args.processes * args.threads
+
+    workdir = tempfile.mkdtemp()
+    db_path = os.path.join(workdir, "bench.db")
+    shutil.copy(os.path.join(ROOT, "email_warmup.db"), db_path)
+    migrate(db_path)
+    server = FakeSMTPServer(throttle_rate=args.server_rate).start()
+    try:
+        limiter = RateLimiter(db_path)
+        limiter.configure(f"provider:{SERVER}", 1e9, 1e9)
+        limiter.configure(f"domain:{DOMAIN}", 1e9, 1e9)
+        (reservations,) = run_processes(args.processes, reserve_loop, db_path, 2, args.threads)
+        print(f"1. {reservations / 2:.0f} reservations/s ({args.processes} processes x {args.threads} threads)")
+
+        limiter.configure(f"provider:{SERVER}", args.budget * 60, args.budget)
+        (granted,) = run_processes(args.processes, wait_loop, db_path, args.seconds, args.threads)
+        expected = args.budget + args.budget * args.seconds
+        print(f"2. shared budget {args.budget:.0f}/s, burst {args.budget:.0f}: {granted} sends granted in "
+              f"{args.seconds:.0f}s, budget allows {expected:.0f}")
+
+        print(f"3. stand-in accepts {args.server_rate} msg/s, {workers} senders for {args.seconds:.0f}s")
+        for label, use_limiter in (("no limiter", False), ("limiter", True)):
+            with sqlite3.connect(db_path) as conn:
+                conn.execute("DELETE FROM rate_buckets")
+            limiter.configure(f"provider:{SERVER}", args.server_rate * 3 * 60, args.server_rate)
+            limiter.configure(f"domain:{DOMAIN}", 1e9, 1e9)
+            sent, rejected = run_processes(args.processes, send_loop, db_path, server.port, args.seconds,
+                                           args.threads, use_limiter)
+            print(f"   {label:<10} {sent / args.seconds:7.0f} msg/s accepted, {rejected:7d} temporary failures "
+                  f"({rejected / max(sent + rejected, 1):.0%} of attempts)")
+        budget = [b for b in limiter.budgets() if b['key'] == f"provider:{SERVER}"][0]
+        print(f"   provider bucket after the run: {budget['current_per_minute'] / 60:.0f} msg/s, "
+              f"{budget['throttles']} throttles")
+    finally:
+        server.stop()
+        shutil.rmtree(workdir)
+
+if __name__ == "__main__":
+    main()
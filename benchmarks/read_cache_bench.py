@@ -0,0 +1,61 @@
+"""Dashboard polling with the read cache.
+
+Times GET /api/templates, /api/accounts and /api/account/getone/<id> through
+the Flask test client: reading SQLite on every request (cache invalidated
+before each one), served from the cache, and revalidated with If-None-Match.
+
+    python benchmarks/read_cache_bench.py --accounts 10000 --requests 2000
+"""
+import argparse
+import contextlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "api"))
+
+def run(client, url, count, before=None, headers=None):
+    start = time.perf_counter()
+    for _ in range(count):
+        if before:
+            before()
+        response = client.get(url, headers=headers)
+    return count / (time.perf_counter() - start), response
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--accounts", type=int, default=10000)
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    db_path = os.path.join(workdir, "bench.db")
+    shutil.copy(os.path.join(ROOT, "email_warmup.db"), db_path)
+    os.environ["EMAIL_WARMUP_DB"] = db_path
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            import index
+            import state
+            import db
+        with db.connect(db_path) as conn:
+            conn.executemany("INSERT INTO accounts (email, provider, status) VALUES (?, '1', 1)",
+                             ((f"user{i}@example.com",) for i in range(args.accounts)))
+        client = index.app.test_client()
+        print(f"{args.accounts} accounts, {args.requests} requests per case")
+        for table, url in (("templates", "/api/templates"), ("accounts", "/api/accounts?limit=100"),
+                           ("accounts", "/api/account/getone/34")):
+            uncached, _ = run(client, url, args.requests, lambda: state.read_cache.invalidate(table))
+            cached, response = run(client, url, args.requests)
+            revalidated, last = run(client, url, args.requests, headers={"If-None-Match": response.headers["ETag"]})
+            print(f"  {url:<26} uncached {uncached:7.0f} req/s  cached {cached:7.0f} req/s  "
+                  f"304 {revalidated:7.0f} req/s (status {last.status_code}, {len(last.data)} bytes)")
+        print(f"  {state.read_cache.status()}")
+    finally:
+        shutil.rmtree(workdir)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""Messages rendered per second across the seeded templates.
+
+Compares building every message from scratch (compile the template, build a
+MIMEMultipart, as_string) with the TemplateCache, for the templates as
+seeded and with the greeting personalized ("Hi {{ receiver_name }},").
+
+    python benchmarks/rendering_bench.py --messages 20000
+"""
+import argparse
+import contextlib
+import io
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from email.utils import make_msgid
+
+from jinja2 import Template
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "api"))
+
+import db
+from rendering import TemplateCache, recipient_variables
+
+def recipients(count):
+    return [(f"sender{i % 97}@example.com", f"first{i}.last@example.org") for i in range(count)]
+
+def from_scratch(rows, pairs):
+    for i, (sender, receiver) in enumerate(pairs):
+        row = rows[i % len(rows)]
+        variables = recipient_variables(sender, receiver)
+        message = MIMEMultipart()
+        message['From'] = sender
+        message['To'] = receiver
+        message['Subject'] = Template(row['subject']).render(variables)
+        message['Message-ID'] = make_msgid(domain=sender.rpartition('@')[2])
+        message.attach(MIMEText(Template(row['content']).render(variables), 'html'))
+        message.as_string()
+
+def cached(cache, ids, pairs):
+    for i, (sender, receiver) in enumerate(pairs):
+        cache.message(ids[i % len(ids)], sender, receiver)
+
+def run(label, func, count):
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    print(f"  {label:<14} {count / elapsed:10.0f} msg/s")
+    return count / elapsed
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=20000)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    db_path = os.path.join(workdir, "bench.db")
+    shutil.copy(os.path.join(ROOT, "email_warmup.db"), db_path)
+    pairs = recipients(args.messages)
+    try:
+        for variant in ("seeded", "personalized"):
+            with db.connect(db_path) as conn:
+                if variant == "personalized":
+                    for id, content in conn.execute("SELECT id, content FROM templates").fetchall():
+                        conn.execute("UPDATE templates SET content = ? WHERE id = ?",
+                                     (re.sub(r"^(Hi|Hello again) \w+,", r"\1 {{ receiver_name }},", content), id))
+                rows = db.query_all(conn, "SELECT * FROM templates")
+            cache = TemplateCache(db_path)
+            ids = [row['id'] for row in rows]
+            print(f"{variant}: {len(rows)} templates, {args.messages} messages")
+            with contextlib.redirect_stdout(io.StringIO()):
+                cache.get(ids[0])  # load and compile once, as the first send would
+            before = run("from scratch", lambda: from_scratch(rows, pairs), args.messages)
+            after = run("cached", lambda: cached(cache, ids, pairs), args.messages)
+            print(f"  speedup {after / before:.1f}x, cache hits {cache.hits}, misses {cache.misses}")
+    finally:
+        shutil.rmtree(workdir)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""Reply engine throughput against the local SMTP and IMAP stand-ins.
+
+Seeds N mailboxes with warmup messages, then runs rounds of: monitor poll ->
+reply engine -> replies delivered by the fake SMTP server into the fake IMAP
+mailboxes, where the next poll finds them and the threads continue. Compares
+batched replies (one SMTP session per account and batch) against one fresh
+SMTP connection per reply.
+
+    python benchmarks/replies_bench.py --mailboxes 200 --messages 20 --handshake-ms 20
+"""
+import argparse
+import contextlib
+import functools
+import io
+import os
+import shutil
+import smtplib
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.parser import BytesHeaderParser
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "api"))
+
+from fake_imap import FakeIMAPServer
+from fake_smtp import FakeSMTPServer
+
+def seed(db_path, imap, smtp_port, mailboxes, messages):
+    import db
+    with db.connect(db_path) as conn:
+        provider = conn.execute('''
+            INSERT INTO providers (provider_name, smtp_server, imap_server, smtp_port, imap_port)
+            VALUES ('Local', '127.0.0.1', '127.0.0.1', ?, ?)
+        ''', (str(smtp_port), str(imap.port))).lastrowid
+        conn.execute("UPDATE accounts SET status = 0")
+        ids = [conn.execute('''
+                   INSERT INTO accounts (email, password, provider, daily_limit, warmup_style, status)
+                   VALUES (?, 'secret', ?, 100, 1, 1)
+               ''', (f"box{n}@example.com", provider)).lastrowid for n in range(mailboxes)]
+        records = []
+        for n, receiver in enumerate(ids):
+            for m in range(messages):
+                message_id = f"<{n}.{m}@example.com>"
+                imap.deliver(f"box{n}@example.com", f"Message-ID: {message_id}\r\nSubject: Welcome Email\r\n\r\nhi\r\n".encode())
+                records.append((None, ids[(n + 1 + m) % len(ids)], receiver, None, message_id, "2025-01-01 00:00:00", "Welcome Email"))
+        db.insert_records(conn, records)
+
+def run_rounds(engine, monitor, rounds):
+    """Poll, reply and wait for the replies to land; returns (replies, seconds, per-round lines)."""
+    total = 0
+    elapsed = 0
+    lines = []
+    with ThreadPoolExecutor(max_workers=monitor.max_workers) as executor:
+        for number in range(1, rounds + 1):
+            start = time.perf_counter()
+            placements = monitor.poll_once(executor)
+            target = engine.scheduled
+            while engine.sent + engine.failed < target:
+                time.sleep(0.005)
+            seconds = time.perf_counter() - start
+            sent = engine.sent - total
+            total, elapsed = engine.sent, elapsed + seconds
+            lines.append(f"  round {number}: {len(placements):6d} found, {sent:6d} replies in {seconds:6.2f}s "
+                  f"({sent / seconds:7.0f} replies/s)")
+    return total, elapsed, lines
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mailboxes", type=int, default=200)
+    parser.add_argument("--messages", type=int, default=20, help="warmup messages per mailbox")
+    parser.add_argument("--reply-rate", type=float, default=1.0, help="reply rate at thread depth 0")
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--workers", type=int, default=32)
+    parser.add_argument("--handshake-ms", type=float, default=20, help="SMTP connect+login cost")
+    args = parser.parse_args()
+
+    imap = FakeIMAPServer().start()
+    delivered = []
+
+    def deliver(recipients, data):
+        delivered.append(data)
+        for recipient in recipients:
+            imap.deliver(recipient, data)
+
+    smtp = FakeSMTPServer(connect_delay=args.handshake_ms / 1000, deliver=deliver).start()
+    workdir = tempfile.mkdtemp()
+    db_path = os.path.join(workdir, "bench.db")
+    shutil.copy(os.path.join(ROOT, "email_warmup.db"), db_path)
+    os.environ["EMAIL_WARMUP_DB"] = db_path
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            import sending
+            from placement import PlacementMonitor
+            from replies import ReplyEngine
+            seed(db_path, imap, smtp.port, args.mailboxes, args.messages)
+        # Replies all go through one stand-in to one domain; keep the rate limiter out of the comparison
+        import state
+        state.limiter.configure("provider:127.0.0.1", 1e9, 1e9)
+        state.limiter.configure("domain:example.com", 1e9, 1e9)
+        # The stand-ins speak plain SMTP/IMAP, without STARTTLS
+        sending.EmailManager = functools.partial(sending.EmailManager, use_tls=False)
+        rates = {style: args.reply_rate for style in (1, 2, 3)}
+        print(f"{args.mailboxes} mailboxes x {args.messages} messages, reply rate {args.reply_rate}, "
+              f"{args.handshake_ms:.0f} ms SMTP handshake")
+
+        def send_unbatched(account, replies):
+            # One connect+login per reply, as send_email_gmail did before the pool
+            message_ids = []
+            for reply in replies:
+                message_id, message = sending.encode_message(account['email'], reply['receiver_email'], reply['subject'], reply['body'],
+                                                             {'In-Reply-To': reply['in_reply_to'], 'References': ' '.join(reply['references'])})
+                with smtplib.SMTP(account['smtp_server'], int(account['smtp_port'])) as server:
+                    server.login(account['email'], account['password'])
+                    server.sendmail(account['email'], reply['receiver_email'], message)
+                message_ids.append(message_id)
+            return message_ids
+
+        results = {}
+        for label, send_func in (("unbatched", send_unbatched), ("batched", sending.send_replies)):
+            with contextlib.redirect_stdout(io.StringIO()):
+                import db
+                with db.connect(db_path) as conn:
+                    conn.execute("DELETE FROM records WHERE isreply = 1")
+                    conn.execute("UPDATE records SET isspam = NULL")
+                for mailbox in imap.mailboxes.values():
+                    for folder in mailbox.values():
+                        for uid in [uid for uid, (_, raw) in folder.messages.items() if b"In-Reply-To" in raw]:
+                            del folder.messages[uid]
+            connections = smtp.connections
+            delivered.clear()
+            print(label)
+            engine = ReplyEngine(db_path, send_func, min_delay=0, max_delay=0, batch_window=0, tick=0.005,
+                                 max_workers=args.workers, reply_rates=rates, seed=1)
+            monitor = PlacementMonitor(db_path, max_workers=args.workers, replies=engine, use_tls=False)
+            with contextlib.redirect_stdout(io.StringIO()):
+                sent, seconds, lines = run_rounds(engine, monitor, args.rounds)
+            print("\n".join(lines))
+            results[label] = sent / seconds
+            print(f"  {sent} replies in {seconds:.2f}s ({sent / seconds:.0f} replies/s), {engine.batches} batches, "
+                  f"{smtp.connections - connections} SMTP connections, {engine.failed} failed")
+
+        parser = BytesHeaderParser()
+        depths = {}
+        for data in delivered:
+            headers = parser.parsebytes(data)
+            assert headers["In-Reply-To"] == headers["References"].split()[-1]
+            depth = len(headers["References"].split())
+            depths[depth] = depths.get(depth, 0) + 1
+        print("replies by thread depth (References length):", dict(sorted(depths.items())))
+        print(f"batched / unbatched: {results['batched'] / results['unbatched']:.1f}x")
+    finally:
+        smtp.stop()
+        imap.stop()
+        shutil.rmtree(workdir)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""Incremental reputation updates over a large records table.
+
+Seeds --records settled sends from --accounts accounts across --domains
+domains, folds them all in once, then appends --increment more and folds in
+only those: the incremental run should cost about --increment/--records of
+the full one, however much history there is.
+
+    python benchmarks/reputation_bench.py --records 2000000 --increment 100000
+"""
+import argparse
+import contextlib
+import io
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "api"))
+
+import db
+from reputation import update_reputations
+
+def seed_accounts(conn, count, domains):
+    conn.executemany("INSERT INTO accounts (email, status) VALUES (?, 1)",
+                     ((f"user{i}@domain{i % domains}.example.com",) for i in range(count)))
+    return [id for (id,) in conn.execute("SELECT id FROM accounts")]
+
+def seed_records(conn, ids, count, start, rng):
+    def rows():
+        for i in range(count):
+            sender, receiver = rng.choice(ids), rng.choice(ids)
+            reply_to = i - 1 if i and rng.random() < 0.2 else None
+            isspam = None if rng.random() < 0.1 else int(rng.random() < 0.05 + (sender % 7) * 0.02)
+            yield (1, sender, receiver, isspam, reply_to is not None, reply_to, (start + timedelta(seconds=i)).strftime("%Y-%m-%d %H:%M:%S"))
+    conn.executemany('''
+        INSERT INTO records (template, sender, receiver, isspam, isreply, reply_to, sent_time)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', rows())
+
+def timed(conn, now):
+    start = time.perf_counter()
+    report = update_reputations(conn, now=now)
+    return report, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--records", type=int, default=2000000)
+    parser.add_argument("--increment", type=int, default=100000)
+    parser.add_argument("--accounts", type=int, default=20000)
+    parser.add_argument("--domains", type=int, default=500)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    db_path = os.path.join(workdir, "bench.db")
+    shutil.copy(os.path.join(ROOT, "email_warmup.db"), db_path)
+    rng = random.Random(1)
+    start = datetime.now() - timedelta(days=60)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            db.migrate(db_path)
+        conn = db.connect(db_path)
+        with conn:
+            ids = seed_accounts(conn, args.accounts, args.domains)
+            seed_records(conn, ids, args.records, start, rng)
+        print(f"{args.records} records, {args.accounts} accounts, {args.domains} domains")
+
+        report, full = timed(conn, datetime.now())
+        print(f"  full run     {report['processed']:9d} rows in {full:6.2f}s ({report['processed'] / full:9.0f} rows/s)")
+        report, empty = timed(conn, datetime.now())
+        print(f"  no new rows  {report['processed']:9d} rows in {empty:6.2f}s")
+
+        with conn:
+            seed_records(conn, ids, args.increment, start + timedelta(seconds=args.records), rng)
+        report, increment = timed(conn, datetime.now() + timedelta(days=1))
+        print(f"  incremental  {report['processed']:9d} rows in {increment:6.2f}s ({report['processed'] / increment:9.0f} rows/s), "
+              f"{increment / full:.1%} of the full run for {args.increment / args.records:.1%} of the rows")
+        top = db.query_all(conn, "SELECT domain, rep_value, spam_rate, reply_rate FROM reputations ORDER BY rep_value LIMIT 3")
+        print("  lowest scores:", ", ".join(f"{r['domain']} {r['rep_value']}" for r in top))
+    finally:
+        db.close_thread_connections()
+        shutil.rmtree(workdir)
+
+if __name__ == "__main__":
+    main()
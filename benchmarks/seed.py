@@ -0,0 +1,110 @@
+"""Synthetic providers, templates and accounts for benchmarks and the load simulation.
+
+Everything is drawn from random.Random(seed), so a given seed always yields
+the same rows. Providers point at the given SMTP/IMAP endpoints (the local
+stand-ins), templates use the variables every template gets (see
+rendering.recipient_variables), and accounts are dicts in the import format
+of api/importer.py, spread over `domains` recipient domains per provider.
+Accounts go in through POST /api/account/import or, without the API,
+seed_accounts().
+
+    python benchmarks/seed.py bench.db --accounts 1000 --smtp 127.0.0.1:2525 --smtp 127.0.0.2:2525 --imap 127.0.0.1:1143
+"""
+import argparse
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api"))
+
+PROVIDER_NAMES = ("Google Workspace", "Office 365", "Yahoo", "Zoho", "SMTP")
+LANGUAGES = {"English": 0.7, "Spanish": 0.2, "German": 0.1}
+FIRST_NAMES = ("james", "mary", "john", "linda", "david", "susan", "maria", "carlos", "anna", "lukas")
+SUBJECTS = ("Quick question, {{ receiver_name }}", "Following up", "Notes from {{ sender_name }}",
+            "Catching up this week", "Re: our call on {{ date }}")
+BODIES = (
+    "Hi {{ receiver_name }},\n\nThanks for getting back to me. Do you have time for a short call this week?\n\nBest,\n{{ sender_name }}",
+    "Hello {{ receiver_name }},\n\nSharing the notes from today as promised. Let me know if anything is missing.\n\n{{ sender_name }}",
+    "Hi there,\n\nJust checking in on the proposal I sent over. Happy to answer any questions.\n\nRegards,\n{{ sender_name }}",
+)
+
+def reset(conn):
+    """Empty the tables the seeder fills, plus records, so only synthetic rows remain."""
+    for table in ("records", "accounts", "providers", "templates"):
+        conn.execute(f"DELETE FROM {table}")
+
+def seed_providers(conn, endpoints):
+    """One provider per (smtp_host, smtp_port, imap_host, imap_port); returns their rows as dicts."""
+    providers = []
+    for n, (smtp_host, smtp_port, imap_host, imap_port) in enumerate(endpoints):
+        name = PROVIDER_NAMES[n % len(PROVIDER_NAMES)]
+        provider_id = conn.execute('''
+            INSERT INTO providers (provider_name, smtp_server, imap_server, smtp_port, imap_port)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (name, smtp_host, imap_host, str(smtp_port), str(imap_port))).lastrowid
+        providers.append({'id': provider_id, 'provider_name': name, 'smtp_server': smtp_host, 'imap_server': imap_host,
+                          'smtp_port': str(smtp_port), 'imap_port': str(imap_port)})
+    return providers
+
+def seed_templates(conn, count, seed=0):
+    rng = random.Random(seed)
+    rows = [(rng.choice(SUBJECTS), rng.choices(list(LANGUAGES), weights=list(LANGUAGES.values()))[0], rng.choice(BODIES))
+            for _ in range(count)]
+    conn.executemany("INSERT INTO templates (subject, language, content) VALUES (?, ?, ?)", rows)
+
+def account_rows(count, providers, domains=4, seed=0, daily_limit=100):
+    """`count` accounts in the import format; provider n's accounts use domains p<n>d<k>.example."""
+    rng = random.Random(seed)
+    rows = []
+    for i in range(count):
+        n = rng.randrange(len(providers))
+        provider = providers[n]
+        rows.append({
+            'email': f"{rng.choice(FIRST_NAMES)}.{i}@p{n}d{rng.randrange(domains)}.example",
+            'password': "secret",
+            'provider_name': provider['provider_name'],
+            'smtp_server': provider['smtp_server'],
+            'imap_server': provider['imap_server'],
+            'smtp_port': provider['smtp_port'],
+            'imap_port': provider['imap_port'],
+            'warmup_style': rng.choice((1, 1, 2, 3)),
+            'daily_limit': daily_limit,
+            'language': rng.choices(list(LANGUAGES), weights=list(LANGUAGES.values()))[0],
+        })
+    return rows
+
+def seed_accounts(conn, rows):
+    """Insert account rows the way the import endpoint does; returns its report."""
+    from importer import import_accounts
+    # account_rows() only makes valid addresses; importing accounts_routes would open the default database
+    return import_accounts(conn, rows, lambda email: True)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("db")
+    parser.add_argument("--accounts", type=int, default=1000)
+    parser.add_argument("--domains", type=int, default=4, help="recipient domains per provider")
+    parser.add_argument("--templates", type=int, default=20)
+    parser.add_argument("--smtp", action="append", help="host:port of a provider's SMTP server; repeat for more providers "
+                                                         "(each needs its own host)")
+    parser.add_argument("--imap", default="127.0.0.1:143", help="host:port of the IMAP server all mailboxes are on")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--reset", action="store_true", help="delete existing accounts, providers, templates and records")
+    args = parser.parse_args()
+
+    os.environ["EMAIL_WARMUP_DB"] = args.db
+    import db
+    db.migrate(args.db)
+    imap_host, imap_port = args.imap.rsplit(":", 1)
+    endpoints = [(*smtp.rsplit(":", 1), imap_host, imap_port) for smtp in args.smtp or ["127.0.0.1:25"]]
+    with db.connect(args.db) as conn:
+        if args.reset:
+            reset(conn)
+        providers = seed_providers(conn, endpoints)
+        seed_templates(conn, args.templates, args.seed)
+        report = seed_accounts(conn, account_rows(args.accounts, providers, args.domains, args.seed))
+    print(f"{len(providers)} providers, {args.templates} templates, {report['imported']} accounts "
+          f"({report['failed']} failed)")
+
+if __name__ == "__main__":
+    main()
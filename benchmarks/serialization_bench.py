@@ -0,0 +1,81 @@
+"""Requests/sec and cold import time: pandas read_sql_query + to_dict vs. db.query_all.
+
+    python benchmarks/serialization_bench.py --accounts 1000 --requests 300
+"""
+import argparse
+import contextlib
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+API = os.path.join(ROOT, "api")
+sys.path.insert(0, API)
+
+def cold_import(statement):
+    """Best-of-3 wall time of a fresh interpreter running `statement`."""
+    timings = []
+    for _ in range(3):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", statement], cwd=API, check=True)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+def seed(db_path, count):
+    with sqlite3.connect(db_path) as conn:
+        conn.executemany('''
+            INSERT INTO accounts (email, password, provider, daily_limit, warmup_style, created_at, updated_at, status)
+            VALUES (?, 'secret', '1', 100, 1, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP, 0)
+        ''', [(f"bench{i}@example.com",) for i in range(count)])
+
+def rate(func, requests):
+    # Route prints are not what we are measuring
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        for _ in range(requests):
+            func()
+        elapsed = time.perf_counter() - start
+    return requests / elapsed
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--accounts", type=int, default=1000)
+    parser.add_argument("--requests", type=int, default=300)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    db_path = os.path.join(workdir, "bench.db")
+    shutil.copy(os.path.join(ROOT, "email_warmup.db"), db_path)
+    os.environ["EMAIL_WARMUP_DB"] = db_path
+    try:
+        print(f"cold import  python           {cold_import('pass') * 1000:7.0f} ms")
+        print(f"cold import  pandas           {cold_import('import pandas') * 1000:7.0f} ms")
+        print(f"cold import  index (no pandas){cold_import('import index') * 1000:7.0f} ms")
+
+        seed(db_path, args.accounts)
+        import pandas as pd
+        import index
+        from flask import jsonify
+        client = index.app.test_client()
+
+        for table, route in (("accounts", "/api/accounts"), ("templates", "/api/templates")):
+            def via_pandas():
+                with index.app.app_context(), sqlite3.connect(db_path) as conn:
+                    frame = pd.read_sql_query(f"SELECT * FROM {table}", conn)
+                    jsonify(frame.to_dict(orient='records')).get_data()
+
+            def via_rows():
+                client.get(route).get_data()
+
+            before = rate(via_pandas, args.requests)
+            after = rate(via_rows, args.requests)
+            print(f"{route:<16} pandas {before:8.1f} req/s   rows {after:8.1f} req/s   {after / before:.1f}x")
+    finally:
+        shutil.rmtree(workdir)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""Messages/sec: fresh connect+login per message vs. the pooled SMTP sessions.
+
+    python benchmarks/smtp_pool_bench.py --messages 500 --handshake-ms 20
+"""
+import argparse
+import os
+import smtplib
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api"))
+
+from fake_smtp import FakeSMTPServer
+from smtp import EmailManager
+from smtp_pool import SMTPPool
+
+MESSAGE = "Subject: Welcome Email\r\n\r\nTEMPLATE\r\n"
+
+def send_unpooled(port, username):
+    # The old send_email_gmail behaviour: connect, login, send, quit
+    with smtplib.SMTP("127.0.0.1", port) as server:
+        server.login(username, "secret")
+        server.sendmail(username, "receiver@example.com", MESSAGE)
+
+def run(label, func, senders, messages):
+    # One worker per sender, each sending its share serially like the warm loop
+    per_sender = messages // len(senders)
+    messages = per_sender * len(senders)
+
+    def send_all(username):
+        for _ in range(per_sender):
+            func(username)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(senders)) as executor:
+        list(executor.map(send_all, senders))
+    elapsed = time.perf_counter() - start
+    print(f"{label:<10} {messages} messages in {elapsed:.2f}s  {messages / elapsed:8.1f} msg/s")
+    return messages / elapsed
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=500)
+    parser.add_argument("--senders", type=int, default=4)
+    parser.add_argument("--handshake-ms", type=float, default=20, help="simulated connect + login latency")
+    args = parser.parse_args()
+
+    delay = args.handshake_ms / 2000
+    server = FakeSMTPServer(connect_delay=delay, auth_delay=delay).start()
+    senders = [f"sender{i}@example.com" for i in range(args.senders)]
+    pool = SMTPPool(max_per_provider=args.senders, max_messages=10 ** 6)
+
+    def pooled(username):
+        manager = EmailManager("127.0.0.1", server.port, None, None, username, "secret", use_tls=False)
+        pool.sendmail(manager, username, "receiver@example.com", MESSAGE)
+
+    try:
+        before = run("unpooled", lambda username: send_unpooled(server.port, username), senders, args.messages)
+        after = run("pooled", pooled, senders, args.messages)
+        print(f"speedup    {after / before:.1f}x")
+    finally:
+        pool.close_all()
+        server.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""Cold-start cost per route of the Vercel entry point.
+
+Each sample is a fresh interpreter run with -X importtime that imports
+api/index.py and serves one request through the test client, like the first
+invocation of a new instance. Reports wall time to the response, time spent
+importing, and the heaviest top-level imports. --compare REV runs the same
+against the api/ directory of a git revision.
+
+    python benchmarks/startup_bench.py --runs 5 --compare HEAD~1
+"""
+import argparse
+import os
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+ROUTES = (
+    ("GET", "/api/templates"),
+    ("GET", "/api/accounts"),
+    ("GET", "/api/metrics"),
+    ("GET", "/api/dispatcher/status"),
+    ("POST", "/api/reputations/refresh"),
+)
+
+SCRIPT = """
+import sys, time
+start = time.perf_counter()
+sys.path.insert(0, {api!r})
+import index
+response = index.app.test_client().open({route!r}, method={method!r})
+print("RESULT", response.status_code, time.perf_counter() - start)
+"""
+
+IMPORT_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+def sample(api, db_path, method, route):
+    env = dict(os.environ, EMAIL_WARMUP_DB=db_path)
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", SCRIPT.format(api=api, route=route, method=method)],
+                            capture_output=True, text=True, env=env, timeout=120)
+    status, elapsed = re.search(r"RESULT (\d+) (\S+)", result.stdout).groups()
+    imports = [(int(own), int(cumulative), len(indent), name)
+               for own, cumulative, indent, name in IMPORT_LINE.findall(result.stderr)]
+    top = sorted(((cumulative, name) for _, cumulative, indent, name in imports if indent == 1), reverse=True)
+    return int(status), float(elapsed), sum(own for own, *_ in imports) / 1e6, top
+
+def report(label, api, db_path, runs):
+    print(label)
+    for method, route in ROUTES:
+        samples = [sample(api, db_path, method, route) for _ in range(runs)]
+        status, _, _, top = samples[-1]
+        wall = statistics.median(s[1] for s in samples) * 1000
+        imported = statistics.median(s[2] for s in samples) * 1000
+        heaviest = ", ".join(f"{name} {cumulative / 1000:.0f}" for cumulative, name in top[:4])
+        print(f"  {method:<4} {route:<26} {status}  {wall:6.0f} ms to response, {imported:6.0f} ms importing  ({heaviest})")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--compare", help="git revision to measure as well")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    db_path = os.path.join(workdir, "bench.db")
+    shutil.copy(os.path.join(ROOT, "email_warmup.db"), db_path)
+    try:
+        if args.compare:
+            archive = subprocess.run(["git", "-C", ROOT, "archive", args.compare, "api"], capture_output=True, check=True).stdout
+            subprocess.run(["tar", "-x", "-C", workdir], input=archive, check=True)
+            # Migrations of the older tree run on their own copy
+            shutil.copy(os.path.join(ROOT, "email_warmup.db"), os.path.join(workdir, "compare.db"))
+            report(args.compare, os.path.join(workdir, "api"), os.path.join(workdir, "compare.db"), args.runs)
+        report("working tree", os.path.join(ROOT, "api"), db_path, args.runs)
+    finally:
+        shutil.rmtree(workdir)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""Send throughput of the sharded workers (api/worker.py) with 1, 2, 4 ... processes.
+
+Each round starts from a fresh copy of the database with the same queued
+jobs, spread over --accounts senders, and runs N workers with fixed shards
+i/N until their shards are drained. A send renders the warmup message and
+builds and flattens a MIME copy of it, the CPU-bound part of a real send;
+nothing goes over the network. Scaling is judged against the core count.
+
+    python benchmarks/worker_scaling_bench.py --jobs 20000 --max-processes 8
+"""
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from email.generator import BytesGenerator
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from io import BytesIO
+from multiprocessing import Process
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "api"))
+
+from db import migrate
+from jobs import JobQueue
+from worker import run
+
+def render_send(jobs):
+    from sending import render_warmup
+    results = []
+    for job in jobs:
+        account = {'email': job['sender_email'], 'language': job['language']}
+        job['message_id'], message, job['template'], job['subject'] = render_warmup(account, job['receiver_email'], job['template'])
+        mime = MIMEMultipart()
+        mime['From'] = job['sender_email']
+        mime['To'] = job['receiver_email']
+        mime['Subject'] = "Welcome Email"
+        mime.attach(MIMEText(message.decode(errors='replace'), 'plain'))
+        BytesGenerator(BytesIO(), policy=mime.policy.clone(linesep='\r\n')).flatten(mime)
+        results.append((job, True, None))
+    return results
+
+def prepare(path, accounts, jobs):
+    shutil.copy(os.path.join(ROOT, "email_warmup.db"), path)
+    migrate(path)
+    queue = JobQueue(path)
+    with sqlite3.connect(path) as conn:
+        # Inactive, so the workers' own scheduling leaves them alone
+        conn.executemany("INSERT INTO accounts (email, provider, status) VALUES (?, '1', 0)",
+                         ((f"user{i}@example.com",) for i in range(accounts)))
+        ids = [row[0] for row in conn.execute("SELECT id FROM accounts WHERE email LIKE 'user%@example.com'")]
+    rng = random.Random(1)
+    queue.enqueue_many([(rng.choice(ids), rng.choice(ids), None, 0) for _ in range(jobs)])
+    return queue
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--jobs", type=int, default=20000)
+    parser.add_argument("--accounts", type=int, default=1000)
+    parser.add_argument("--max-processes", type=int, default=max(os.cpu_count(), 4))
+    parser.add_argument("--batch-size", type=int, default=100)
+    args = parser.parse_args()
+
+    counts = [1]
+    while counts[-1] * 2 <= args.max_processes:
+        counts.append(counts[-1] * 2)
+    workdir = tempfile.mkdtemp()
+    print(f"{args.jobs} jobs over {args.accounts} senders, {os.cpu_count()} cores")
+    try:
+        base = None
+        for processes in counts:
+            path = os.path.join(workdir, f"bench{processes}.db")
+            queue = prepare(path, args.accounts, args.jobs)
+            workers = [Process(target=run, args=(path, processes, shard),
+                               kwargs={'batch_size': args.batch_size, 'stop_when_empty': True, 'send_many': render_send})
+                       for shard in range(processes)]
+            start = time.perf_counter()
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+            elapsed = time.perf_counter() - start
+            done = queue.counts().get('done', 0)
+            rate = done / elapsed
+            base = base or rate
+            print(f"  {processes:3d} processes  {done} sent in {elapsed:6.2f}s  {rate:8.0f} sends/s  "
+                  f"{rate / base:4.1f}x  ({rate / base / min(processes, os.cpu_count()):.0%} of linear in cores)")
+    finally:
+        shutil.rmtree(workdir)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+import atexit
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "api"))
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+# state.py reads EMAIL_WARMUP_DB when first imported, so the app under test
+# gets one scratch copy of the database for the whole session
+_workdir = tempfile.mkdtemp()
+atexit.register(shutil.rmtree, _workdir, True)
+APP_DB = os.path.join(_workdir, "app.db")
+shutil.copy(os.path.join(ROOT, "email_warmup.db"), APP_DB)
+os.environ["EMAIL_WARMUP_DB"] = APP_DB
+os.environ.setdefault("EMAIL_WARMUP_LOG_LEVEL", "WARNING")
+
+@pytest.fixture
+def db_path(tmp_path):
+    """A migrated copy of the database of its own, for modules that take a path."""
+    from db import migrate
+    path = str(tmp_path / "test.db")
+    shutil.copy(os.path.join(ROOT, "email_warmup.db"), path)
+    migrate(path)
+    return path
+
+@pytest.fixture(scope="session")
+def app():
+    from index import app
+    return app
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
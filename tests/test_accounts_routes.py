@@ -0,0 +1,96 @@
+import sqlite3
+
+import pytest
+
+from conftest import APP_DB
+
+CREDENTIALS = ('password', 'app_password', 'access_token', 'refresh_token')
+
+@pytest.fixture
+def account_id(client):
+    import db
+    import state
+    with db.connect(APP_DB) as conn:
+        account_id = conn.execute('''
+            INSERT INTO accounts (email, password, provider, daily_limit, warmup_style, status, access_token, refresh_token)
+            VALUES ('secret.holder@example.com', 'hunter2', '1', 100, 1, 0, 'access', 'refresh')
+        ''').lastrowid
+    state.read_cache.invalidate('accounts')
+    yield account_id
+    with db.connect(APP_DB) as conn:
+        conn.execute("DELETE FROM accounts WHERE id = ?", (account_id,))
+    state.read_cache.invalidate('accounts')
+
+def assert_no_credentials(accounts):
+    for account in accounts:
+        assert not set(CREDENTIALS) & set(account), account
+
+def test_getone_has_no_credentials(client, account_id):
+    for _ in range(2):  # the second answer comes from the read cache
+        response = client.get(f'/api/account/getone/{account_id}')
+        assert response.status_code == 200
+        assert response.get_json()['email'] == 'secret.holder@example.com'
+        assert_no_credentials([response.get_json()])
+
+def test_listing_has_no_credentials(client, account_id):
+    accounts = client.get('/api/accounts?limit=1000').get_json()
+    assert any(account['id'] == account_id for account in accounts)
+    assert_no_credentials(accounts)
+
+def test_credentials_are_not_selectable(client, account_id):
+    for field in CREDENTIALS:
+        assert client.get(f'/api/accounts?fields=id,{field}').status_code == 400
+
+def test_created_account_has_no_credentials(client):
+    response = client.post('/api/account/create/smtp', json={
+        'email': 'created.one@example.com', 'password': 'hunter2', 'provider': None, 'provider_name': 'SMTP',
+        'imap_server': 'imap.example.com', 'smtp_server': 'smtp.example.com', 'imap_port': 993, 'smtp_port': 587,
+        'warmup_style': 1,
+    })
+    assert response.status_code == 200
+    assert_no_credentials([response.get_json()])
+    assert client.get(f"/api/account/delete/{response.get_json()['id']}").status_code == 200
+
+def test_keyset_pages_cover_every_account_once(client, account_id):
+    everything = [account['id'] for account in client.get('/api/accounts?limit=1000&fields=id').get_json()]
+    paged, after_id = [], 0
+    while after_id is not None:
+        response = client.get(f'/api/accounts?limit=3&fields=id&after_id={after_id}')
+        paged += [account['id'] for account in response.get_json()]
+        after_id = response.headers.get('X-Next-After-Id')
+    assert paged == everything == sorted(everything)
+    assert account_id in paged
+
+def test_unchanged_answers_are_304(client, account_id):
+    for url in ('/api/accounts?limit=5', f'/api/account/getone/{account_id}'):
+        etag = client.get(url).headers['ETag']
+        response = client.get(url, headers={'If-None-Match': etag})
+        assert response.status_code == 304 and response.data == b''
+
+    # A write from another connection, as the worker or importer would make
+    etag = client.get(f'/api/account/getone/{account_id}').headers['ETag']
+    with sqlite3.connect(APP_DB) as conn:
+        conn.execute("UPDATE accounts SET daily_limit = 7 WHERE id = ?", (account_id,))
+    conn.close()
+    response = client.get(f'/api/account/getone/{account_id}', headers={'If-None-Match': etag})
+    assert response.status_code == 200 and response.get_json()['daily_limit'] == 7
+
+def test_warm_toggles_known_accounts_only(client, account_id, monkeypatch):
+    import state
+    started = []
+    monkeypatch.setattr(state, 'dispatcher', type('Dispatcher', (), {'start': lambda self: started.append(1)})(), raising=False)
+    response = client.post('/api/account/warm', json={'email': 'secret.holder@example.com'})
+    assert response.status_code == 200 and response.get_json()['status'] == 1 and started
+    assert client.post('/api/account/warm', json={'email': 'secret.holder@example.com'}).get_json()['status'] == 0
+    assert client.post('/api/account/warm', json={'email': 'nobody@example.com'}).status_code == 404
+    assert client.post('/api/account/warm', json={}).status_code == 400
+
+def test_warm_answers_database_errors_with_json(client, monkeypatch):
+    import accounts_routes
+
+    def locked(db_path):
+        raise sqlite3.OperationalError("database is locked")
+
+    monkeypatch.setattr(accounts_routes, 'connect', locked)
+    response = client.post('/api/account/warm', json={'email': 'secret.holder@example.com'})
+    assert response.status_code == 500 and 'error' in response.get_json()
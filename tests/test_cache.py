@@ -0,0 +1,67 @@
+import sqlite3
+
+import pytest
+
+import db
+from cache import ReadCache
+
+@pytest.fixture
+def cache(db_path):
+    return ReadCache(db_path, max_accounts=2)
+
+def write(db_path, sql):
+    """A write through a connection of its own, like another process would make."""
+    conn = sqlite3.connect(db_path)
+    with conn:
+        conn.execute(sql)
+    conn.close()
+
+def loader(calls):
+    def load(conn):
+        calls.append(1)
+        return len(calls)
+    return load
+
+def test_hits_until_invalidated(cache):
+    calls = []
+    assert [cache.get('templates', 'all', loader(calls)) for _ in range(3)] == [1, 1, 1]
+    cache.invalidate('templates')
+    assert cache.get('templates', 'all', loader(calls)) == 2
+    assert cache.status()['templates'] == {'entries': 1, 'hits': 2, 'misses': 2}
+
+def test_other_connections_invalidate_only_the_table_they_wrote(cache, db_path):
+    templates, providers = [], []
+    cache.get('templates', 'all', loader(templates))
+    cache.get('providers', 'all', loader(providers))
+    write(db_path, "UPDATE templates SET subject = subject")
+    assert cache.get('templates', 'all', loader(templates)) == 2
+    assert cache.get('providers', 'all', loader(providers)) == 1
+
+    # Writes to tables that are not cached move data_version but drop nothing
+    write(db_path, "DELETE FROM records")
+    assert cache.get('templates', 'all', loader(templates)) == 2
+
+def test_own_writes_need_an_explicit_invalidate(cache, db_path):
+    calls = []
+    cache.get('accounts', 'page', loader(calls))
+    with db.connect(db_path) as conn:
+        conn.execute("UPDATE accounts SET daily_limit = daily_limit")
+    # data_version only moves for writes by other connections
+    assert cache.get('accounts', 'page', loader(calls)) == 1
+    cache.invalidate('accounts')
+    assert cache.get('accounts', 'page', loader(calls)) == 2
+
+def test_accounts_are_bounded_in_lru_order(cache):
+    for key in ('a', 'b', 'a', 'c'):
+        cache.get('accounts', key, lambda conn, key=key: key)
+    assert cache.status()['accounts']['entries'] == 2
+    calls = []
+    assert [cache.get('accounts', key, loader(calls)) for key in ('a', 'c')] == ['a', 'c']
+    assert cache.get('accounts', 'b', loader(calls)) == 1
+
+def test_invalidated_while_loading_is_not_stored(cache):
+    def load(conn):
+        cache.invalidate('providers')
+        return 'stale'
+    assert cache.get('providers', 'all', load) == 'stale'
+    assert cache.status()['providers']['entries'] == 0
@@ -0,0 +1,67 @@
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+import counters
+import db
+from counters import CounterAggregator
+
+NOON = datetime(2031, 5, 1, 12, 30)
+
+def metrics(db_path, email):
+    with db.connect(db_path) as conn:
+        return conn.execute("SELECT date, sent_count, received_count, spam_count FROM metrics WHERE email = ?", (email,)).fetchall()
+
+def hourly(db_path, email):
+    with db.connect(db_path) as conn:
+        return conn.execute("SELECT bucket, sent, received, spam FROM metrics_hourly WHERE scope = 'account' AND key = ?",
+                            (email,)).fetchall()
+
+def test_increments_from_many_threads_are_one_upsert_per_day(db_path):
+    aggregator = CounterAggregator(db_path, flush_interval=60, flush_events=10 ** 6)
+
+    def send():
+        for _ in range(100):
+            aggregator.incr("ann@example.com", sent=1, at=NOON)
+            aggregator.incr("bob@example.com", received=1, spam=1, at=NOON)
+
+    threads = [threading.Thread(target=send) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    aggregator.incr("ann@example.com", sent=1, at=NOON.replace(hour=13))
+    assert aggregator.flush() == 3
+    assert metrics(db_path, "ann@example.com") == [("2031-05-01", 801, 0, 0)]
+    assert metrics(db_path, "bob@example.com") == [("2031-05-01", 0, 800, 800)]
+    assert sorted(hourly(db_path, "ann@example.com")) == [("2031-05-01 12:00", 800, 0, 0), ("2031-05-01 13:00", 1, 0, 0)]
+
+    # Later flushes add to the stored counts
+    aggregator.incr("ann@example.com", sent=2, at=NOON)
+    assert aggregator.flush() == 1
+    assert aggregator.flush() == 0
+    assert metrics(db_path, "ann@example.com") == [("2031-05-01", 803, 0, 0)]
+
+def test_a_failed_flush_keeps_the_increments(db_path, monkeypatch):
+    aggregator = CounterAggregator(db_path, flush_interval=60, flush_events=10 ** 6)
+    aggregator.incr("ann@example.com", sent=1, at=NOON)
+
+    def locked(db_path):
+        raise sqlite3.OperationalError("database is locked")
+
+    monkeypatch.setattr(counters, "connect", locked)
+    assert aggregator.flush() == 0
+    aggregator.incr("ann@example.com", sent=1, at=NOON)
+    monkeypatch.undo()
+    assert aggregator.flush() == 1
+    assert metrics(db_path, "ann@example.com") == [("2031-05-01", 2, 0, 0)]
+
+def test_flush_events_wakes_the_flusher(db_path):
+    aggregator = CounterAggregator(db_path, flush_interval=60, flush_events=5)
+    for _ in range(5):
+        aggregator.incr("ann@example.com", sent=1, at=NOON)
+    deadline = time.monotonic() + 2
+    while not metrics(db_path, "ann@example.com") and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert metrics(db_path, "ann@example.com") == [("2031-05-01", 5, 0, 0)]
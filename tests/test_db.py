@@ -0,0 +1,79 @@
+import json
+import sqlite3
+import threading
+
+import pytest
+
+import db
+from conftest import APP_DB
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE t (id INTEGER PRIMARY KEY, count INTEGER, ratio REAL, name TEXT)")
+    conn.executemany("INSERT INTO t (count, ratio, name) VALUES (?, ?, ?)", [(3, 0.5, "a"), (None, None, None)])
+    yield conn
+    conn.close()
+
+def test_rows_keep_their_sqlite_types(conn):
+    assert db.query_all(conn, "SELECT * FROM t ORDER BY id") == [
+        {'id': 1, 'count': 3, 'ratio': 0.5, 'name': "a"},
+        {'id': 2, 'count': None, 'ratio': None, 'name': None},
+    ]
+    assert db.query_all(conn, "SELECT count AS n FROM t WHERE id > ?", (5,)) == []
+
+def test_query_one(conn):
+    assert db.query_one(conn, "SELECT id, count FROM t WHERE name = ?", ("a",)) == {'id': 1, 'count': 3}
+    assert db.query_one(conn, "SELECT id FROM t WHERE id = 5") is None
+
+def reject(constant):
+    raise ValueError(f"{constant} is not JSON")
+
+def test_null_columns_are_json_null(client):
+    import state
+    with db.connect(APP_DB) as conn:
+        template = conn.execute("INSERT INTO templates (subject, content) VALUES ('No language', 'hi')").lastrowid
+    state.read_cache.invalidate('templates')
+    try:
+        templates = json.loads(client.get('/api/templates').data, parse_constant=reject)
+        assert [t['language'] for t in templates if t['id'] == template] == [None]
+    finally:
+        with db.connect(APP_DB) as conn:
+            conn.execute("DELETE FROM templates WHERE id = ?", (template,))
+        state.read_cache.invalidate('templates')
+
+def test_one_configured_connection_per_thread(db_path):
+    conn = db.connect(db_path)
+    assert db.connect(db_path) is conn
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    assert conn.execute("PRAGMA busy_timeout").fetchone()[0] == 5000
+    others = []
+    thread = threading.Thread(target=lambda: others.append(db.connect(db_path)))
+    thread.start()
+    thread.join()
+    assert others[0] is not conn
+
+    # The with block commits but leaves the connection open for reuse
+    with db.connect(db_path) as conn:
+        conn.execute("INSERT INTO templates (subject, content) VALUES ('Committed', 'hi')")
+    other = sqlite3.connect(db_path)
+    assert other.execute("SELECT COUNT(*) FROM templates WHERE subject = 'Committed'").fetchone()[0] == 1
+    other.close()
+    assert conn.execute("SELECT 1").fetchone() == (1,)
+
+    db.close_thread_connections()
+    assert db.connect(db_path) is not conn
+
+def test_forked_processes_open_their_own_connection(db_path, monkeypatch):
+    conn = db.connect(db_path)
+    monkeypatch.setattr(db.os, "getpid", lambda: -1)
+    assert db.connect(db_path) is not conn
+
+def test_migrations_run_once(db_path):
+    with db.connect(db_path) as conn:
+        assert conn.execute("PRAGMA user_version").fetchone()[0] == len(db.MIGRATIONS)
+        indexes = conn.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'index'").fetchone()[0]
+    db.migrate(db_path)
+    with db.connect(db_path) as conn:
+        assert conn.execute("PRAGMA user_version").fetchone()[0] == len(db.MIGRATIONS)
+        assert conn.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'index'").fetchone()[0] == indexes
@@ -0,0 +1,100 @@
+import threading
+import time
+from datetime import date, datetime
+
+import pytest
+
+import db
+from dispatcher import WarmupDispatcher
+from planner import FLAT, LINEAR
+
+@pytest.fixture
+def accounts(db_path):
+    """Adds accounts given as (daily_limit, warmup_style) to a database where no other account is active."""
+    with db.connect(db_path) as conn:
+        conn.execute("UPDATE accounts SET status = 0")
+
+    def add(*accounts):
+        with db.connect(db_path) as conn:
+            return [conn.execute('''
+                INSERT INTO accounts (email, password, daily_limit, warmup_style, status) VALUES (?, 'secret', ?, ?, 1)
+            ''', (f"user{n}@example.com", daily_limit, style)).lastrowid for n, (daily_limit, style) in enumerate(accounts)]
+
+    return add
+
+def dispatcher_for(db_path, send, seconds=0.5, after=0.3):
+    """A dispatcher whose day's sends all fall in the `seconds` starting `after` seconds from now.
+
+    Send times already past when the day is planned are dropped, so the
+    window starts a little later than the dispatcher does.
+    """
+    start = time.time() - time.mktime(date.today().timetuple()) + after
+    return WarmupDispatcher(db_path, send, poll_interval=0.05, window=(start, start + seconds), retry_delay=0.01)
+
+def run(dispatcher, until, timeout=5):
+    dispatcher.start()
+    deadline = time.monotonic() + timeout
+    while not until() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    time.sleep(0.2)
+    dispatcher.stop()
+
+def test_refused_sends_are_retried_within_the_volume(db_path, accounts):
+    # user0 sends a flat 3 a day; the others only receive
+    sender, *_ = accounts((3, FLAT), *[(0, FLAT)] * 9)
+    attempts = []
+    lock = threading.Lock()
+
+    def send(account, receiver_email):
+        with lock:
+            attempts.append(account['email'])
+            # user0's first two sends are refused
+            if len(attempts) <= 2:
+                return None
+        return (f"<{len(attempts)}@example.com>", None, "Hello")
+
+    dispatcher = dispatcher_for(db_path, send)
+    run(dispatcher, lambda: dispatcher._sent_today.get(sender, 0) >= 3)
+    assert len(attempts) == 5
+    assert dispatcher._sent_today[sender] == 3
+    with db.connect(db_path) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM records WHERE subject = 'Hello'").fetchone()[0] == dispatcher.sent == 3
+
+def test_volume_follows_the_ramp_and_what_was_sent_today(db_path, accounts):
+    # On its first day a linear ramp sends 2, whatever its daily_limit
+    ramped, flat, *_ = accounts((50, LINEAR), (3, FLAT), *[(0, FLAT)] * 8)
+    with db.connect(db_path) as conn:
+        # Two of flat's three were sent before a restart, or by a job worker
+        db.insert_records(conn, [(None, flat, ramped, None, f"<earlier{n}@example.com>",
+                                  datetime.now().strftime('%Y-%m-%d %H:%M:%S'), "Earlier") for n in range(2)])
+    sent = []
+
+    def send(account, receiver_email):
+        sent.append(account['email'])
+        return (f"<{len(sent)}@example.com>", None, "Hello")
+
+    dispatcher = dispatcher_for(db_path, send)
+    run(dispatcher, lambda: len(sent) >= 3, timeout=2)
+    assert sorted(sent) == ["user0@example.com", "user0@example.com", "user1@example.com"]
+    assert {account_id: volume for account_id, (volume, _) in dispatcher._planned.items() if volume} == {ramped: 2, flat: 3}
+
+def live_worker(db_path):
+    with db.connect(db_path) as conn:
+        conn.execute("INSERT INTO worker_leases (worker_id, started, lease_until) VALUES ('w1', ?, ?)", (time.time(), time.time() + 60))
+
+def test_stays_off_while_sharded_workers_send(db_path, accounts):
+    accounts((3, FLAT), (3, FLAT))
+    # Its sends would only start once the test is over
+    dispatcher = dispatcher_for(db_path, None, after=5)
+    live_worker(db_path)
+    assert not dispatcher.start()
+    with db.connect(db_path) as conn:
+        conn.execute("DELETE FROM worker_leases")
+
+    assert dispatcher.start()
+    # A worker starting later stops it at the next poll
+    live_worker(db_path)
+    deadline = time.monotonic() + 2
+    while dispatcher.running and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert not dispatcher.running
@@ -0,0 +1,81 @@
+import gzip
+import io
+import time
+from datetime import datetime, timezone
+
+import pytest
+
+import db
+import export
+from conftest import APP_DB
+
+@pytest.fixture
+def without_pyarrow(monkeypatch):
+    monkeypatch.setattr(export, "has_pyarrow", lambda: False)
+
+@pytest.mark.parametrize("fmt", ["arrow", "parquet"])
+def test_explicit_format_without_pyarrow_is_refused(client, without_pyarrow, fmt):
+    response = client.get(f'/api/records/export?format={fmt}')
+    assert response.status_code == 406
+    assert "pyarrow" in response.get_json()['error']
+
+def test_default_format_without_pyarrow_is_csv(client, without_pyarrow):
+    response = client.get('/api/records/export?columns=id,sent_time')
+    assert response.status_code == 200 and response.headers['X-Export-Format'] == 'csv'
+    assert gzip.decompress(response.data).startswith(b"id,sent_time\n")
+
+def test_unknown_format_is_a_bad_request(client):
+    assert client.get('/api/records/export?format=xlsx').status_code == 400
+
+def test_arrow_with_pyarrow(client):
+    pa = pytest.importorskip("pyarrow")
+    response = client.get('/api/records/export?format=arrow&columns=id,sender')
+    assert response.status_code == 200 and response.headers['X-Export-Format'] == 'arrow'
+    assert pa.ipc.open_stream(response.data).read_all().column_names == ['id', 'sender']
+
+@pytest.fixture
+def window_records():
+    """Records sent at 09:00, 10:00 and 11:00 local time on a day no other record is from."""
+    with db.connect(APP_DB) as conn:
+        sender = conn.execute("SELECT min(id) FROM accounts").fetchone()[0]
+        db.insert_records(conn, [(None, sender, sender, None, f"<window{hour}@example.com>", f"2031-05-01 {hour:02}:00:00", "Window")
+                                 for hour in (9, 10, 11)])
+    yield
+    with db.connect(APP_DB) as conn:
+        conn.execute("DELETE FROM records WHERE subject = 'Window'")
+
+@pytest.fixture
+def utc_plus_two(monkeypatch):
+    monkeypatch.setenv("TZ", "Etc/GMT-2")
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+def exported_times(client, **args):
+    response = client.get('/api/records/export', query_string={'format': 'csv', 'columns': 'sent_time,subject', **args})
+    assert response.status_code == 200
+    return [line.split(",")[0] for line in gzip.decompress(response.data).decode().splitlines()[1:]]
+
+def test_start_and_end_filter_sent_time(client, window_records, utc_plus_two):
+    assert exported_times(client, start="2031-05-01T10:00:00", end="2031-05-01T11:00:00") == ["2031-05-01 10:00:00"]
+    assert exported_times(client, start="2031-05-01T10:00:00") == ["2031-05-01 10:00:00", "2031-05-01 11:00:00"]
+    # An offset is converted to local time, not dropped
+    assert exported_times(client, start="2031-05-01T07:00:00+00:00", end="2031-05-01T09:00:00Z") == ["2031-05-01 09:00:00",
+                                                                                                 "2031-05-01 10:00:00"]
+    sql, params = export.query(('id',), datetime(2031, 5, 1, 7, tzinfo=timezone.utc))
+    assert params == ["2031-05-01 09:00:00"]
+
+def test_start_after_the_supported_range_is_a_bad_request(client):
+    assert client.get('/api/records/export', query_string={'start': "9999-12-31T23:00:00-14:00"}).status_code == 400
+
+def test_parquet_with_pyarrow(client, window_records):
+    pytest.importorskip("pyarrow")
+    import pyarrow.parquet as pq
+    response = client.get('/api/records/export', query_string={'format': 'parquet', 'columns': 'sent_time,subject,isspam',
+                                                               'start': "2031-05-01", 'end': "2031-05-02"})
+    assert response.status_code == 200 and response.headers['X-Export-Format'] == 'parquet'
+    table = pq.read_table(io.BytesIO(response.data))
+    assert table.column_names == ['sent_time', 'subject', 'isspam']
+    assert table.column('sent_time').to_pylist() == [datetime(2031, 5, 1, hour) for hour in (9, 10, 11)]
+    assert table.column('subject').to_pylist() == ["Window"] * 3
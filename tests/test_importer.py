@@ -0,0 +1,96 @@
+import io
+import json
+
+import db
+from accounts_routes import is_valid_email
+from conftest import APP_DB
+from importer import import_accounts, read_rows
+
+def account(n, **fields):
+    row = {'email': f"user{n}@example.com", 'password': "secret", 'provider_name': "Local", 'imap_server': "imap.example.com",
+           'smtp_server': "smtp.example.com", 'imap_port': 993, 'smtp_port': 587, 'warmup_style': 1}
+    row.update(fields)
+    return row
+
+def jsonl(*rows):
+    return io.BytesIO("\n".join(row if isinstance(row, str) else json.dumps(row) for row in rows).encode())
+
+def errors(report):
+    return [(error['row'], error['error']) for error in report['errors']]
+
+def test_bad_rows_are_reported_and_the_rest_imported(db_path):
+    rows = read_rows(jsonl(
+        account(1),
+        account(2, email=123),
+        account(3, smtp_port="not a port"),
+        account(4, warmup_style=True),
+        account(5, password=None),
+        "{not json",
+        "[1, 2]",
+        account(8, email="not-an-email"),
+        account(1),
+        account(10, daily_limit="250", status="1"),
+    ), 'jsonl')
+    with db.connect(db_path) as conn:
+        report = import_accounts(conn, rows, is_valid_email)
+        imported = db.query_all(conn, "SELECT email, daily_limit, status FROM accounts WHERE email LIKE 'user%@example.com' ORDER BY id")
+    assert (report['imported'], report['failed']) == (2, 8)
+    assert [number for number, _ in errors(report)] == [2, 3, 4, 5, 6, 7, 8, 9]
+    assert errors(report)[0] == (2, "email must be a string")
+    assert errors(report)[1] == (3, "smtp_port must be a whole number")
+    assert errors(report)[3] == (5, "Missing required fields: password")
+    assert errors(report)[7] == (9, "Account with this email already exists")
+    assert imported == [{'email': "user1@example.com", 'daily_limit': 100, 'status': 0},
+                        {'email': "user10@example.com", 'daily_limit': 250, 'status': 1}]
+
+def test_invalid_utf8_ends_the_rows_with_an_error():
+    # Decoded in blocks, so rows well before the bad bytes still come through
+    csv = b"email,password\r\n" + b"user1@example.com,secret\r\n" * 5000 + b"user2@example.com,\xff\xfe\r\n"
+    rows = list(read_rows(io.BytesIO(csv), 'csv'))
+    assert rows[0] == {'email': "user1@example.com", 'password': "secret"}
+    assert rows[-1]['__error__'].startswith("Could not read the rest of the file")
+
+def test_import_route_answers_400_reports(client):
+    response = client.post('/api/account/import?format=jsonl', data=json.dumps(account(1, email=123)))
+    assert response.status_code == 400
+    assert errors(response.get_json()) == [(1, "email must be a string")]
+
+    response = client.post('/api/account/import?format=csv', data=b"email,password\r\n\xff\xfe,secret\r\n")
+    assert response.status_code == 400
+    assert response.get_json()['errors'][0]['error'].startswith("Could not read the rest of the file")
+
+def test_import_route_imports_valid_rows(client):
+    response = client.post('/api/account/import?format=jsonl', data=jsonl(account(1, email="imported.one@example.com"),
+                                                                           account(2, email=["imported.two@example.com"])).getvalue())
+    assert response.status_code == 201
+    assert (response.get_json()['imported'], response.get_json()['failed']) == (1, 1)
+    with db.connect(APP_DB) as conn:
+        assert conn.execute("DELETE FROM accounts WHERE email = 'imported.one@example.com'").rowcount == 1
+
+def test_explicit_zero_daily_limit_is_kept(db_path):
+    rows = read_rows(jsonl(account(1, daily_limit=0), account(2, daily_limit=""), account(3)), 'jsonl')
+    with db.connect(db_path) as conn:
+        assert import_accounts(conn, rows, is_valid_email)['imported'] == 3
+        limits = [limit for (limit,) in conn.execute("SELECT daily_limit FROM accounts WHERE email LIKE 'user_@example.com' ORDER BY email")]
+    assert limits == [0, 100, 100]
+
+def test_import_and_create_pick_the_same_of_duplicate_providers(client):
+    with db.connect(APP_DB) as conn:
+        oldest, newest = [conn.execute('''
+            INSERT INTO providers (provider_name, smtp_server, imap_server, smtp_port, imap_port)
+            VALUES ('Dup', 'dup.example.com', 'imap.dup.example.com', '587', '993')
+        ''').lastrowid for _ in range(2)]
+    try:
+        response = client.post('/api/account/import?format=jsonl', data=jsonl(account(1, email="dup.one@example.com",
+                                                                                        smtp_server="dup.example.com")).getvalue())
+        assert response.status_code == 201
+        response = client.post('/api/account/create/smtp', json=account(2, email="dup.two@example.com", smtp_server="dup.example.com",
+                                                                         provider=None))
+        assert response.status_code == 200
+        with db.connect(APP_DB) as conn:
+            providers = dict(conn.execute("SELECT email, CAST(provider AS INTEGER) FROM accounts WHERE email LIKE 'dup.%@example.com'"))
+        assert providers == {"dup.one@example.com": oldest, "dup.two@example.com": oldest}
+    finally:
+        with db.connect(APP_DB) as conn:
+            conn.execute("DELETE FROM accounts WHERE email LIKE 'dup.%@example.com'")
+            conn.execute("DELETE FROM providers WHERE id IN (?, ?)", (oldest, newest))
@@ -0,0 +1,43 @@
+import pytest
+from flask import Flask
+
+from instrumentation import REQUEST_SECONDS, instrument
+
+def observations(route, status):
+    counts = REQUEST_SECONDS._series.get(('GET', route, status))
+    return counts[2] if counts else 0
+
+@pytest.fixture
+def app():
+    app = Flask(__name__)
+    instrument(app)
+
+    @app.route('/boom')
+    def boom():
+        raise RuntimeError("unhandled")
+
+    @app.route('/fine')
+    def fine():
+        return {'ok': True}
+
+    return app
+
+def test_requests_are_timed_by_route_and_status(app):
+    before = observations('/fine', 200), observations('unmatched', 404)
+    client = app.test_client()
+    assert client.get('/fine').status_code == 200
+    assert client.get('/missing').status_code == 404
+    assert (observations('/fine', 200), observations('unmatched', 404)) == (before[0] + 1, before[1] + 1)
+
+@pytest.mark.parametrize("propagate", [False, True])
+def test_unhandled_exceptions_are_timed_as_500s(app, propagate):
+    # Propagated (debug, testing), the exception skips after_request altogether
+    app.config['PROPAGATE_EXCEPTIONS'] = propagate
+    before = observations('/boom', 500)
+    client = app.test_client()
+    if propagate:
+        with pytest.raises(RuntimeError):
+            client.get('/boom')
+    else:
+        assert client.get('/boom').status_code == 500
+    assert observations('/boom', 500) == before + 1
@@ -0,0 +1,138 @@
+import sqlite3
+import time
+from contextlib import closing
+from datetime import date, timedelta
+
+import pytest
+
+import db
+from jobs import JobQueue, run_worker, schedule_day
+
+@pytest.fixture
+def accounts(db_path):
+    with db.connect(db_path) as conn:
+        conn.execute("UPDATE accounts SET status = 0")
+        return [conn.execute('''
+            INSERT INTO accounts (email, password, daily_limit, warmup_style, status) VALUES (?, 'secret', 20, 3, 1)
+        ''', (f"user{n}@example.com",)).lastrowid for n in range(3)]
+
+@pytest.fixture
+def queue(db_path):
+    return JobQueue(db_path, lease_seconds=60, max_attempts=2, retry_delay=0)
+
+def statuses(queue):
+    with closing(queue._connect()) as conn:
+        return dict(conn.execute("SELECT id, status FROM send_jobs"))
+
+def records(db_path):
+    with db.connect(db_path) as conn:
+        return conn.execute("SELECT sender, receiver, message_id FROM records WHERE message_id LIKE '<job%'").fetchall()
+
+def expire_leases(queue):
+    with closing(queue._connect()) as conn:
+        conn.execute("UPDATE send_jobs SET lease_until = ? WHERE status = 'leased'", (time.time() - 1,))
+
+def test_claim_leases_due_jobs_once(queue, accounts):
+    queue.enqueue_many([(accounts[0], accounts[1], None, 0), (accounts[1], accounts[2], None, 0),
+                        (accounts[2], accounts[0], None, time.time() + 3600)])
+    jobs = queue.claim("w1", limit=10)
+    assert sorted(job['sender'] for job in jobs) == accounts[:2]
+    assert jobs[0]['receiver_email'].endswith("@example.com")
+    assert queue.claim("w2", limit=10) == []
+    assert queue.counts() == {'leased': 2, 'queued': 1}
+
+def test_claim_respects_partition(queue, accounts):
+    queue.enqueue_many([(sender, accounts[0], None, 0) for sender in accounts])
+    jobs = queue.claim("w1", partition=lambda sender: sender == accounts[1])
+    assert [job['sender'] for job in jobs] == [accounts[1]]
+
+def test_complete_records_sends_and_retries_failures(queue, accounts, db_path):
+    queue.enqueue_many([(accounts[0], accounts[1], None, 0), (accounts[1], accounts[2], None, 0)])
+    sent, failed = queue.claim("w1")
+    sent['message_id'] = "<job1@example.com>"
+    queue.complete("w1", [(sent, True, None), (failed, False, "451 try later")])
+    assert statuses(queue) == {sent['id']: 'done', failed['id']: 'queued'}
+    assert records(db_path) == [(accounts[0], accounts[1], "<job1@example.com>")]
+    # The second failure is the last attempt
+    failed, = queue.claim("w1")
+    queue.complete("w1", [(failed, False, "451 try later")])
+    assert statuses(queue)[failed['id']] == 'failed'
+
+def test_expired_lease_counts_as_an_attempt(queue, accounts):
+    queue.enqueue_many([(accounts[0], accounts[1], None, 0)])
+    job, = queue.claim("w1")
+    expire_leases(queue)
+    assert queue.requeue_expired() == 1
+    assert statuses(queue)[job['id']] == 'queued'
+    job, = queue.claim("w2")
+    assert job['attempts'] == 1
+    expire_leases(queue)
+    assert queue.requeue_expired() == 1
+    assert statuses(queue)[job['id']] == 'failed'
+    assert queue.claim("w3") == []
+
+def test_complete_after_losing_the_lease_records_nothing(queue, accounts, db_path):
+    queue.enqueue_many([(accounts[0], accounts[1], None, 0)])
+    job, = queue.claim("w1")
+    expire_leases(queue)
+    queue.requeue_expired()
+    again, = queue.claim("w2")
+    job['message_id'] = "<job-late@example.com>"
+    queue.complete("w1", [(job, True, None)])
+    assert records(db_path) == []
+    assert statuses(queue)[job['id']] == 'leased'
+    again['message_id'] = "<job-owner@example.com>"
+    queue.complete("w2", [(again, True, None)])
+    assert records(db_path) == [(accounts[0], accounts[1], "<job-owner@example.com>")]
+
+def test_leases_are_renewed_while_a_batch_outlasts_them(accounts, db_path):
+    queue = JobQueue(db_path, lease_seconds=0.3)
+    queue.enqueue_many([(accounts[0], accounts[1], None, 0), (accounts[1], accounts[2], None, 0)])
+    rivals = []
+
+    def slow_send(jobs):
+        time.sleep(1)
+        # Another worker's housekeeping finds nothing to take over
+        rivals.append((queue.requeue_expired(), queue.claim("w2")))
+        for n, job in enumerate(jobs):
+            job['message_id'] = f"<job-slow{n}@example.com>"
+        return [(job, True, None) for job in jobs]
+
+    run_worker(db_path, None, stop_when_empty=True, send_many=slow_send, lease_seconds=0.3)
+    assert rivals == [(0, [])]
+    assert len(records(db_path)) == 2
+    assert set(statuses(queue).values()) == {'done'}
+
+def test_claim_gives_up_cleanly_when_locked(queue, accounts, db_path, monkeypatch):
+    connect = queue._connect
+
+    def impatient():
+        conn = connect()
+        conn.execute("PRAGMA busy_timeout = 50")
+        return conn
+
+    monkeypatch.setattr(queue, "_connect", impatient)
+    holder = sqlite3.connect(db_path, isolation_level=None)
+    holder.execute("BEGIN IMMEDIATE")
+    try:
+        # The lock error, not "cannot rollback - no transaction is active"
+        with pytest.raises(sqlite3.OperationalError, match="locked"):
+            queue.claim("w1")
+    finally:
+        holder.execute("ROLLBACK")
+    assert queue.claim("w1") == []
+
+def test_schedule_day_is_idempotent(queue, accounts):
+    tomorrow = date.today() + timedelta(days=1)
+    first = schedule_day(queue, tomorrow)
+    assert first == 60
+    assert schedule_day(queue, tomorrow) == 0
+    assert queue.counts() == {'queued': 60}
+
+def test_schedule_day_adds_only_new_senders(queue, accounts, db_path):
+    tomorrow = date.today() + timedelta(days=1)
+    assert schedule_day(queue, tomorrow, senders=lambda sender: sender == accounts[0]) == 20
+    assert schedule_day(queue, tomorrow) == 40
+    with closing(queue._connect()) as conn:
+        counts = dict(conn.execute("SELECT sender, COUNT(*) FROM send_jobs GROUP BY sender"))
+    assert counts == {sender: 20 for sender in accounts}
@@ -0,0 +1,37 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from metrics import MAX_POINTS, fill, parse_range
+
+def test_aware_times_become_local_time():
+    start = datetime(2025, 3, 1, 12, tzinfo=timezone(timedelta(hours=5)))
+    period, parsed, end = parse_range({'start': start.isoformat(), 'end': '2025-03-02'})
+    assert period == 'hour'
+    assert parsed.tzinfo is None and parsed == start.astimezone().replace(tzinfo=None)
+
+def test_aware_start_with_default_end():
+    now = datetime(2025, 3, 10)
+    period, start, end = parse_range({'start': '2025-03-01T00:00:00+00:00'}, now=now)
+    assert (period, end) == ('day', now) and start.tzinfo is None
+
+@pytest.mark.parametrize("args", [
+    {'start': '2025-01-01', 'end': '2025-03-01', 'granularity': 'hour'},
+    {'start': '0001-01-01'},
+    {'start': '0001-01-01T00:00+05:00'},
+    {'start': '9999-12-30', 'end': '9999-12-31T23:30'},
+])
+def test_unbounded_ranges_are_rejected(args):
+    with pytest.raises(ValueError):
+        parse_range(args)
+
+@pytest.mark.parametrize("period, days", [('hour', 41), ('day', 999), ('week', 6993)])
+def test_points_are_capped(period, days):
+    args = {'start': '2000-01-03', 'end': (datetime(2000, 1, 3) + timedelta(days=days)).isoformat(), 'granularity': period}
+    period, start, end = parse_range(args)
+    assert len(fill(period, start, end, {})) <= MAX_POINTS
+
+def test_metrics_route_answers_400_not_500(client):
+    assert client.get('/api/metrics?start=2025-01-01T00:00:00%2B00:00&end=2025-01-02T00:00:00%2B00:00').status_code == 200
+    response = client.get('/api/metrics?start=1900-01-01&granularity=hour')
+    assert response.status_code == 400 and 'buckets' in response.get_json()['error']
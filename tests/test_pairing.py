@@ -0,0 +1,25 @@
+from pairing import PairingEngine
+
+def accounts(count, daily_limit=100):
+    return {id: {'id': id, 'email': f"user{id}@d{id % 3}.example", 'provider': id % 2, 'daily_limit': daily_limit}
+            for id in range(1, count + 1)}
+
+def picks(engine, sender, count, spacing):
+    return [engine.pick(sender, now=1000 + n * spacing) for n in range(count)]
+
+def test_sender_reaches_its_daily_limit_with_few_accounts():
+    # Three accounts: each sender has two receivers for 100 sends a day
+    engine = PairingEngine(default_cap=1000)
+    engine.sync(accounts(3))
+    sent = [receiver for receiver in picks(engine, 1, 100, 24 * 3600 / 100) if receiver is not None]
+    assert len(sent) == 100
+    assert {receiver['id'] for receiver in sent} == {2, 3}
+
+def test_repeat_window_holds_with_many_accounts():
+    engine = PairingEngine(repeat_window=600)
+    engine.sync(accounts(50))
+    receivers = [receiver['id'] for receiver in picks(engine, 1, 49, 1)]
+    assert len(set(receivers)) == 49 and 1 not in receivers
+    # Everyone was paired within the last ten minutes
+    assert engine.pick(1, now=1000 + 60) is None
+    assert engine.pick(1, now=1000 + 600 + 49) is not None
@@ -0,0 +1,84 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import db
+from fake_imap import FakeIMAPServer
+from placement import Mailbox, PlacementMonitor
+
+@pytest.fixture
+def server():
+    server = FakeIMAPServer().start()
+    yield server
+    server.stop()
+
+@pytest.fixture
+def mailboxes(db_path, server):
+    """Five active accounts on the local IMAP server, each sent one warmup message by the next."""
+    with db.connect(db_path) as conn:
+        provider = conn.execute('''
+            INSERT INTO providers (provider_name, smtp_server, imap_server, smtp_port, imap_port)
+            VALUES ('Local', '127.0.0.1', '127.0.0.1', '25', ?)
+        ''', (str(server.port),)).lastrowid
+        conn.execute("UPDATE accounts SET status = 0")
+        ids = [conn.execute('''
+            INSERT INTO accounts (email, password, provider, daily_limit, warmup_style, status) VALUES (?, 'secret', ?, 100, 1, 1)
+        ''', (f"box{n}@example.com", provider)).lastrowid for n in range(5)]
+    deliver(db_path, server, ids, "first")
+    return ids
+
+def deliver(db_path, server, ids, tag):
+    records = []
+    for n, receiver in enumerate(ids):
+        message_id = f"<{tag}.{n}@example.com>"
+        server.deliver(f"box{n}@example.com", f"Message-ID: {message_id}\r\nSubject: hi\r\n\r\nbody\r\n".encode(),
+                       "Spam" if n == 0 else "INBOX")
+        records.append((None, ids[(n + 1) % len(ids)], receiver, None, message_id, "2025-01-01 00:00:00", "hi"))
+    with db.connect(db_path) as conn:
+        db.insert_records(conn, records)
+
+def open_sessions(monitor):
+    return sum(mailbox.manager.imap_conn is not None for mailbox in monitor._mailboxes.values())
+
+def test_open_sessions_are_capped(db_path, server, mailboxes):
+    monitor = PlacementMonitor(db_path, max_workers=2, use_tls=False, max_sessions=2)
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        assert len(monitor.poll_once(executor)) == 5
+        assert len(monitor._sessions) == open_sessions(monitor) == 2
+        # Closed sessions keep their UID cursors, so reconnecting finds only the new mail
+        deliver(db_path, server, mailboxes, "second")
+        assert len(monitor.poll_once(executor)) == 5
+        assert open_sessions(monitor) == 2
+    assert (monitor.rescued, monitor.inbox, monitor.errors) == (2, 8, 0)
+
+def test_idle_sessions_are_closed(db_path, server, mailboxes):
+    monitor = PlacementMonitor(db_path, max_workers=2, use_tls=False, idle_seconds=3600)
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        monitor.poll_once(executor)
+        assert open_sessions(monitor) == 5
+        idle = monitor._mailboxes["box0@example.com"]
+        idle.last_used -= 7200
+        idle_conn = idle.manager.imap_conn
+        monitor.poll_once(executor)
+    assert idle.manager.imap_conn is not idle_conn
+    assert open_sessions(monitor) == 5
+
+def test_unexpected_errors_are_counted_per_mailbox(db_path, server, mailboxes, monkeypatch):
+    new_message_ids = Mailbox.new_message_ids
+
+    def parse(mailbox, folder):
+        if mailbox.account['email'] == "box1@example.com":
+            raise ValueError("unexpected FETCH response")
+        return new_message_ids(mailbox, folder)
+
+    monkeypatch.setattr(Mailbox, "new_message_ids", parse)
+    monitor = PlacementMonitor(db_path, max_workers=2, use_tls=False)
+    monitor.start()
+    try:
+        monitor._stopping.wait(0.5)
+        assert monitor.running
+    finally:
+        monitor.stop()
+    assert monitor.polls == 1 and monitor.errors == 1
+    assert monitor.rescued + monitor.inbox == 4
+    assert "box1@example.com" not in monitor._sessions
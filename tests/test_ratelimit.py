@@ -0,0 +1,65 @@
+import smtplib
+
+import pytest
+
+from ratelimit import BASE_BACKOFF, RateLimiter
+
+@pytest.fixture
+def limiter(db_path):
+    limiter = RateLimiter(db_path, max_wait=0.5)
+    # One send a second, two at once
+    limiter.configure("provider:smtp.example.com", 60, 2)
+    return limiter
+
+def tokens(limiter, key="provider:smtp.example.com"):
+    return {bucket['key']: bucket['tokens'] for bucket in limiter.budgets()}[key]
+
+def test_burst_then_wait_for_the_refill(limiter):
+    assert limiter.reserve("smtp.example.com", "example.com") == 0
+    assert limiter.reserve("smtp.example.com", "Example.COM") == 0
+    wait = limiter.reserve("smtp.example.com", "example.com")
+    assert 0.9 < wait <= 1
+    assert tokens(limiter, "domain:example.com") == pytest.approx(27, abs=0.1)
+
+def test_processes_share_one_budget(limiter, db_path):
+    other = RateLimiter(db_path)
+    assert other.reserve("smtp.example.com", "example.com") == 0
+    assert limiter.reserve("smtp.example.com", "example.com") == 0
+    assert other.reserve("smtp.example.com", "example.com") > 0.9
+
+def test_wait_refunds_what_it_gives_up(limiter):
+    assert limiter.wait("smtp.example.com", "example.com")
+    assert limiter.wait("smtp.example.com", "example.com")
+    assert not limiter.wait("smtp.example.com", "example.com")
+    assert tokens(limiter) == pytest.approx(0, abs=0.1)
+
+def test_configure_caps_the_tokens(limiter):
+    limiter.configure("provider:smtp.example.com", 6, 1)
+    assert limiter.reserve("smtp.example.com", "example.com") == 0
+    assert 9 < limiter.reserve("smtp.example.com", "example.com") <= 10
+
+def test_temporary_failures_back_off_the_bucket(limiter):
+    assert limiter.reserve("smtp.example.com", "example.com") == 0
+    error = smtplib.SMTPRecipientsRefused({"bob@example.com": (450, b"Mailbox busy")})
+    assert limiter.record_failure("smtp.example.com", "example.com", error) == ('domain', 450)
+    assert limiter.record_failure("smtp.example.com", "example.com", smtplib.SMTPDataError(554, b"Rejected")) is None
+    budgets = {bucket['key']: bucket for bucket in limiter.budgets()}
+    assert budgets["domain:example.com"]['throttles'] == 1
+    assert budgets["domain:example.com"]['backoff_seconds'] == pytest.approx(BASE_BACKOFF, abs=0.1)
+    assert budgets["provider:smtp.example.com"]['throttles'] == 0
+    assert limiter.reserve("smtp.example.com", "example.com") > BASE_BACKOFF - 0.1
+
+@pytest.mark.parametrize("body", [
+    {'key': "provider:smtp.example.com", 'per_minute': "fast", 'burst': 10},
+    {'key': "provider:smtp.example.com", 'per_minute': 30, 'burst': None},
+    {'key': "provider:smtp.example.com", 'per_minute': 0, 'burst': 10},
+    {'key': "provider:smtp.example.com", 'per_minute': "nan", 'burst': 10},
+    {'key': "provider:smtp.example.com", 'per_minute': 30, 'burst': "-1"},
+    {'key': 5, 'per_minute': 30, 'burst': 10},
+    {'key': "provider:smtp.example.com", 'per_minute': 30},
+    ["provider:smtp.example.com", 30, 10],
+])
+def test_rate_limit_route_refuses_bad_limits(client, body):
+    response = client.post('/api/ratelimits', json=body)
+    assert response.status_code == 400
+    assert "error" in response.get_json()
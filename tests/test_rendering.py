@@ -0,0 +1,33 @@
+import sqlite3
+
+import db
+from rendering import TemplateCache
+
+def write(db_path, sql, params=()):
+    """A write through a connection of its own, like the API's while a job worker renders."""
+    conn = sqlite3.connect(db_path)
+    with conn:
+        conn.execute(sql, params)
+    conn.close()
+
+def test_edits_from_other_connections_reach_the_cache(db_path):
+    with db.connect(db_path) as conn:
+        conn.execute("DELETE FROM templates")
+        kept, dropped = [conn.execute("INSERT INTO templates (subject, language, content) VALUES (?, 'German', 'Hallo')",
+                                      (subject,)).lastrowid for subject in ("Kept", "Dropped")]
+    cache = TemplateCache(db_path)
+    assert cache.get(kept).static_subject == "Kept"
+    assert cache.pick('German') in (kept, dropped)
+
+    write(db_path, "UPDATE templates SET subject = 'Edited {{ receiver_name }}' WHERE id = ?", (kept,))
+    write(db_path, "DELETE FROM templates WHERE id = ?", (dropped,))
+    assert cache.get(dropped) is None
+    assert {cache.pick('German') for _ in range(20)} == {kept}
+    _, _, subject = cache.message(kept, "ann@example.com", "bob@example.com")
+    assert subject == "Edited Bob"
+
+    # Other tables leave the compiled templates alone
+    hits = cache.hits
+    write(db_path, "DELETE FROM records")
+    cache.get(kept)
+    assert cache.hits == hits + 1
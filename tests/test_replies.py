@@ -0,0 +1,94 @@
+import db
+from replies import MAX_THREAD_DEPTH, REPLY_DECAY, REPLY_RATES, ReplyEngine, reply_probability
+
+def seed(db_path, sends):
+    """Two active accounts and a record per (template subject, recorded subject) sent between them."""
+    with db.connect(db_path) as conn:
+        sender, receiver = [conn.execute('''
+            INSERT INTO accounts (email, password, daily_limit, warmup_style, status) VALUES (?, 'secret', 100, 1, 1)
+        ''', (email,)).lastrowid for email in ("ann@example.com", "bob@example.com")]
+        ids = []
+        for n, (template_subject, subject) in enumerate(sends):
+            template = conn.execute("INSERT INTO templates (subject, language, content) VALUES (?, 'English', 'hi')",
+                                    (template_subject,)).lastrowid
+            db.insert_records(conn, [(template, sender, receiver, None, f"<{n}@example.com>", "2025-01-01 00:00:00", subject)])
+            ids.append(conn.execute("SELECT max(id) FROM records").fetchone()[0])
+    return ids
+
+def scheduled_subjects(db_path, ids):
+    engine = ReplyEngine(db_path, lambda account, replies: [None] * len(replies), min_delay=3600, max_delay=3600,
+                         reply_rates={1: 1.0}, seed=0)
+    assert engine.add(ids) == len(ids)
+    return [reply['subject'] for pending in engine._pending.values() for _, reply in sorted(pending, key=lambda p: p[1]['reply_to'])]
+
+def test_replies_quote_the_rendered_subject(db_path):
+    ids = seed(db_path, [("Hi {{ receiver_name }}", "Hi Bob"), ("Re: our call", "Re: our call")])
+    assert scheduled_subjects(db_path, ids) == ["Re: Hi Bob", "Re: our call"]
+
+def test_unrecorded_subject_falls_back_to_static_template_subject(db_path):
+    ids = seed(db_path, [("Quarterly notes", None), ("Hi {{ receiver_name }}", None)])
+    assert scheduled_subjects(db_path, ids) == ["Re: Quarterly notes", "Re: Welcome Email"]
+
+def test_render_warmup_returns_template_and_subject(db_path, monkeypatch):
+    import sending
+    import state
+    from rendering import TemplateCache
+    seed(db_path, [("Hi {{ receiver_name }}", None)])
+    monkeypatch.setattr(state, "templates", TemplateCache(db_path), raising=False)
+    with db.connect(db_path) as conn:
+        template = conn.execute("SELECT max(id) FROM templates").fetchone()[0]
+    message_id, message, template_id, subject = sending.render_warmup({'email': "ann@example.com"}, "bob@example.com", template)
+    assert (template_id, subject) == (template, "Hi Bob")
+    assert b"Subject: Hi Bob\r\n" in message and message_id.encode() in message
+
+def test_reply_probability_decays_down_the_thread():
+    assert reply_probability(2, 0) == REPLY_RATES[2]
+    assert reply_probability(2, 1) == REPLY_RATES[2] * REPLY_DECAY
+    assert reply_probability(None, 0) == REPLY_RATES[1]
+    assert reply_probability(1, MAX_THREAD_DEPTH) == 0.0
+
+class Executor:
+    def map(self, func, items):
+        return map(func, items)
+
+def test_replies_thread_through_reply_to_and_retry(db_path):
+    root, = seed(db_path, [("Plans", "Plans")])
+    batches = []
+
+    def send(account, replies):
+        batches.append((account['email'], [dict(reply) for reply in replies]))
+        # The first attempt is refused, the second accepted
+        return [None] if len(batches) == 1 else [f"<reply{len(batches)}@example.com>"]
+
+    # Sure to answer the root and its first reply
+    engine = ReplyEngine(db_path, send, min_delay=0, max_delay=0, reply_rates={1: 1 / REPLY_DECAY}, seed=0)
+    assert engine.add([root]) == 1
+    # Already scheduled
+    assert engine.add([root]) == 0
+    assert engine.send_due(Executor()) == 0
+    assert engine.send_due(Executor()) == 1
+    (email, _), (_, (second,)) = batches
+    assert email == "bob@example.com"
+    assert (second['in_reply_to'], second['references'], second['subject']) == ("<0@example.com>", ["<0@example.com>"], "Re: Plans")
+    with db.connect(db_path) as conn:
+        reply, isreply, sender = conn.execute("SELECT id, isreply, sender FROM records WHERE reply_to = ?", (root,)).fetchone()
+        bob = conn.execute("SELECT max(id) FROM accounts WHERE email = 'bob@example.com'").fetchone()[0]
+    assert (isreply, sender) == (1, bob)
+    # Replied to already; the reply itself is answered in turn, quoting the whole thread
+    assert engine.add([root]) == 0
+    assert engine.add([reply]) == 1
+    engine.send_due(Executor())
+    _, (third,) = batches[-1]
+    assert third['in_reply_to'] == "<reply2@example.com>"
+    assert third['references'] == ["<0@example.com>", "<reply2@example.com>"]
+    assert third['subject'] == "Re: Plans"
+    assert engine.status()['sent'] == 2 and engine.status()['failed'] == 0
+
+def test_refused_replies_give_up_after_max_attempts(db_path):
+    root, = seed(db_path, [("Plans", "Plans")])
+    engine = ReplyEngine(db_path, lambda account, replies: [None] * len(replies), min_delay=0, max_delay=0,
+                         max_attempts=2, reply_rates={1: 1.0}, seed=0)
+    engine.add([root])
+    assert engine.send_due(Executor()) == engine.send_due(Executor()) == 0
+    assert engine.status()['failed'] == 1 and engine.status()['queued'] == 0
+    assert engine.send_due(Executor()) == 0 and engine.status()['batches'] == 2
@@ -0,0 +1,28 @@
+from datetime import datetime
+
+import db
+from reputation import update_reputations
+
+NOW = datetime(2025, 6, 1, 12)
+
+def test_null_emails_and_sent_times_do_not_stall_updates(db_path):
+    with db.connect(db_path) as conn:
+        conn.execute("DELETE FROM records")
+        conn.execute("DELETE FROM reputations")
+        sender, receiver = [conn.execute("INSERT INTO accounts (email, status) VALUES (?, 0)", (email,)).lastrowid
+                            for email in ("ann@sender.example", "bob@receiver.example")]
+        conn.execute("INSERT INTO accounts (email, status) VALUES (NULL, 0)")
+        rows = [(sender, receiver, 0, "2025-05-01 00:00:00"), (sender, receiver, 1, None),
+                (sender, receiver, 1, "2025-05-01 00:00:00"), (sender, receiver, None, "2025-06-01 11:00:00")]
+        ids = [conn.execute('''
+            INSERT INTO records (sender, receiver, isspam, isreply, sent_time) VALUES (?, ?, ?, 0, ?)
+        ''', row).lastrowid for row in rows]
+
+        report = update_reputations(conn, now=NOW)
+        # The last send has not settled yet
+        assert report == {'processed': 2, 'skipped': 1, 'domains': 1, 'watermark': ids[2]}
+        spam_rate, = conn.execute("SELECT spam_rate FROM reputations WHERE domain = 'sender.example'").fetchone()
+        assert spam_rate == 0.5
+
+        assert update_reputations(conn, now=NOW)['processed'] == 0
+        assert update_reputations(conn, now=datetime(2025, 6, 3))['watermark'] == ids[3]
@@ -0,0 +1,148 @@
+import smtplib
+import socket
+from email.message import EmailMessage
+
+import pytest
+
+from fake_smtp import FakeSMTPServer
+from smtp import EmailManager
+from smtp_pool import SMTPPool
+
+SENDER = "sender@example.com"
+
+@pytest.fixture
+def delivered():
+    return []
+
+@pytest.fixture
+def server(request, delivered):
+    options = getattr(request, "param", {})
+    server = FakeSMTPServer(deliver=lambda recipients, data: delivered.append((recipients, data)), **options).start()
+    yield server
+    server.stop()
+
+@pytest.fixture
+def manager(server):
+    manager = EmailManager("127.0.0.1", server.port, None, None, SENDER, None, use_tls=False)
+    manager.connect_smtp()
+    yield manager
+    manager.smtp_conn.close()
+
+def message(n):
+    msg = EmailMessage()
+    msg["From"] = SENDER
+    msg["Subject"] = f"Message {n}"
+    msg.set_content(f"Body {n}\n.leading dot\n")
+    return msg
+
+def batch(*recipients):
+    return [(recipient, message(n)) for n, recipient in enumerate(recipients)]
+
+def errors(results):
+    return [None if error is None else type(error) for _, error in results]
+
+def test_pipelined_batch_is_delivered_in_order(manager, server, delivered):
+    recipients = [f"r{n}@example.com" for n in range(5)]
+    results = manager.send_batch(batch(*recipients))
+    assert results == [(recipient, None) for recipient in recipients]
+    assert [to for to, _ in delivered] == [[recipient] for recipient in recipients]
+    assert b"\r\n..leading dot\r\n" not in delivered[0][1] and b"\r\n.leading dot\r\n" in delivered[0][1]
+
+@pytest.mark.parametrize("server", [{"throttle_every": 2}], indirect=True)
+def test_451_on_mail_fails_that_message_only(manager, server, delivered):
+    results = manager.send_batch(batch("a@example.com", "b@example.com", "c@example.com", "d@example.com"))
+    assert errors(results) == [None, smtplib.SMTPSenderRefused, None, smtplib.SMTPSenderRefused]
+    assert results[1][1].smtp_code == 451
+    assert [to for to, _ in delivered] == [["a@example.com"], ["c@example.com"]]
+
+@pytest.mark.parametrize("server", [{"reject_recipients": {"gone@example.com"}}], indirect=True)
+def test_rejected_recipient_fails_that_message_only(manager, server, delivered):
+    results = manager.send_batch(batch("a@example.com", "gone@example.com", "c@example.com"))
+    assert errors(results) == [None, smtplib.SMTPRecipientsRefused, None]
+    assert results[1][1].recipients == {"gone@example.com": (550, b"5.1.1 Recipient address rejected: User unknown")}
+    assert [to for to, _ in delivered] == [["a@example.com"], ["c@example.com"]]
+
+@pytest.mark.parametrize("server", [{"refuse_data_every": 2}], indirect=True)
+def test_data_refused_instead_of_354(manager, server, delivered):
+    results = manager.send_batch(batch("a@example.com", "b@example.com", "c@example.com"))
+    assert errors(results) == [None, smtplib.SMTPDataError, None]
+    assert results[1][1].smtp_code == 554
+    assert [to for to, _ in delivered] == [["a@example.com"], ["c@example.com"]]
+
+@pytest.mark.parametrize("bad", ["josé@example.com", 123, None])
+def test_unencodable_address_mid_group(manager, server, delivered, bad):
+    results = manager.send_batch(batch("a@example.com", bad, "c@example.com"))
+    assert errors(results) == [None, smtplib.SMTPNotSupportedError, None]
+    assert [to for to, _ in delivered] == [["a@example.com"], ["c@example.com"]]
+    # The session is still between transactions
+    assert manager.send_batch(batch("d@example.com")) == [("d@example.com", None)]
+
+def test_unencodable_address_first_and_last(manager, server, delivered):
+    results = manager.send_batch(batch("ü@example.com", "b@example.com", "ü@example.com"))
+    assert errors(results) == [smtplib.SMTPNotSupportedError, None, smtplib.SMTPNotSupportedError]
+    assert [to for to, _ in delivered] == [["b@example.com"]]
+
+def test_message_that_cannot_be_flattened_fails_alone(manager, server, delivered):
+    messages = batch("a@example.com", "b@example.com", "c@example.com")
+    messages[1] = ("b@example.com", object())
+    results = manager.send_batch(messages)
+    assert errors(results)[::2] == [None, None] and results[1][1] is not None
+    assert [to for to, _ in delivered] == [["a@example.com"], ["c@example.com"]]
+
+@pytest.mark.parametrize("server", [{"pipelining": False}], indirect=True)
+def test_unencodable_address_without_pipelining(manager, server, delivered):
+    results = manager.send_batch(batch("a@example.com", "ü@example.com", "c@example.com"))
+    assert errors(results) == [None, smtplib.SMTPNotSupportedError, None]
+    assert [to for to, _ in delivered] == [["a@example.com"], ["c@example.com"]]
+
+def test_dropped_connection_fails_the_rest(manager, server, delivered):
+    manager.smtp_conn.sock.shutdown(socket.SHUT_RDWR)
+    results = manager.send_batch(batch("a@example.com", "b@example.com"))
+    assert errors(results) == [smtplib.SMTPServerDisconnected] * 2
+    assert manager.smtp_conn.sock is None
+
+def test_pool_discards_session_on_any_error(server):
+    pool = SMTPPool()
+    manager = EmailManager("127.0.0.1", server.port, None, None, SENDER, None, use_tls=False)
+    with pytest.raises(RuntimeError):
+        with pool.session(manager) as session:
+            raise RuntimeError("failed between MAIL and DATA")
+    assert session.conn.sock is None
+    assert pool._open[("127.0.0.1", server.port)] == 0
+    with pool.session(manager) as fresh:
+        assert fresh is not session
+
+def pooled_manager(server, username=SENDER):
+    return EmailManager("127.0.0.1", server.port, None, None, username, None, use_tls=False)
+
+def test_pool_reuses_one_session_per_account(server, delivered):
+    pool = SMTPPool(max_messages=3)
+    manager = pooled_manager(server)
+    for n in range(5):
+        pool.sendmail(manager, SENDER, [f"r{n}@example.com"], message(n).as_bytes())
+    assert len(delivered) == 5
+    # Retired after max_messages, so a second connection for the last two
+    assert server.connections == 2
+    pool.close_all()
+    assert pool._open[("127.0.0.1", server.port)] == 0
+
+def test_pool_caps_sessions_per_provider(server):
+    pool = SMTPPool(max_per_provider=1, acquire_timeout=0.1)
+    first = pool.acquire(pooled_manager(server))
+    with pytest.raises(TimeoutError):
+        pool.acquire(pooled_manager(server, "other@example.com"))
+    pool.release(first)
+    # The idle session of another account on the provider makes room
+    other = pool.acquire(pooled_manager(server, "other@example.com"))
+    assert other is not first and first.conn.sock is None
+    pool.release(other)
+
+def test_pool_retries_once_on_a_dropped_session(server, delivered):
+    pool = SMTPPool(noop_after=3600)
+    manager = pooled_manager(server)
+    pool.sendmail(manager, SENDER, ["a@example.com"], message(1).as_bytes())
+    # Dropped while idle; not probed with NOOP this soon
+    pool._idle[("127.0.0.1", server.port, SENDER)][0].conn.sock.shutdown(socket.SHUT_RDWR)
+    pool.sendmail(manager, SENDER, ["b@example.com"], message(2).as_bytes())
+    assert [recipients for recipients, _ in delivered] == [["a@example.com"], ["b@example.com"]]
+    assert server.connections == 2
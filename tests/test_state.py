@@ -0,0 +1,48 @@
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+import state
+from conftest import ROOT
+
+HEAVY_MODULES = ('numpy', 'pandas', 'pyarrow', 'smtplib', 'imaplib', 'dispatcher', 'placement', 'replies', 'sending')
+
+def test_entry_point_imports_no_heavy_modules(db_path):
+    loaded = subprocess.run(
+        [sys.executable, "-c", f"import sys, index; print(' '.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"],
+        cwd=os.path.join(ROOT, "api"), env={**os.environ, "EMAIL_WARMUP_DB": db_path}, capture_output=True, text=True, check=True,
+    ).stdout.split()
+    assert loaded == []
+
+@pytest.fixture
+def probe(monkeypatch):
+    """A state factory that counts its calls, built slowly so concurrent first uses overlap."""
+    calls = []
+
+    def factory():
+        calls.append(None)
+        time.sleep(0.05)
+        return object()
+
+    monkeypatch.setitem(state.FACTORIES, 'probe', factory)
+    yield calls
+    vars(state).pop('probe', None)
+
+def test_state_is_built_once_on_first_use(probe):
+    assert state.peek('probe') is None
+    seen = []
+    threads = [threading.Thread(target=lambda: seen.append(state.probe)) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(probe) == 1
+    assert all(instance is state.peek('probe') for instance in seen)
+
+def test_unknown_state_is_an_attribute_error():
+    with pytest.raises(AttributeError):
+        state.nothing_here
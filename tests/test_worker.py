@@ -0,0 +1,105 @@
+import time
+from contextlib import closing
+
+import pytest
+
+import db
+import worker
+from conftest import APP_DB
+from jobs import JobQueue, schedule_day
+from worker import HashRing, ShardLeases
+
+@pytest.fixture
+def active_accounts():
+    with db.connect(APP_DB) as conn:
+        ids = [conn.execute('''
+            INSERT INTO accounts (email, password, daily_limit, warmup_style, status) VALUES (?, 'secret', 24, 3, 1)
+        ''', (f"scheduled{n}@example.com",)).lastrowid for n in range(4)]
+    yield ids
+    with db.connect(APP_DB) as conn:
+        conn.execute("DELETE FROM send_jobs")
+        conn.execute("DELETE FROM scheduled_days")
+        conn.execute(f"DELETE FROM accounts WHERE id IN ({', '.join('?' * len(ids))})", ids)
+
+def jobs_by_sender(queue):
+    with closing(queue._connect()) as conn:
+        return dict(conn.execute("SELECT sender, COUNT(*) FROM send_jobs GROUP BY sender"))
+
+def test_api_and_worker_schedule_a_day_once(client, active_accounts):
+    queue = JobQueue(APP_DB)
+    response = client.post('/api/jobs/schedule')
+    assert response.status_code == 201
+    queued = jobs_by_sender(queue)
+    assert sum(queued.values()) == response.get_json()['queued']
+
+    # A worker owning half the shards schedules after the API did
+    ring = HashRing(8)
+    assert schedule_day(queue, senders=lambda sender: ring.shard_of(sender) < 4) == 0
+    assert client.post('/api/jobs/schedule').get_json()['queued'] == 0
+    assert jobs_by_sender(queue) == queued
+
+def scheduled_senders():
+    with db.connect(APP_DB) as conn:
+        return {sender for (sender,) in conn.execute("SELECT sender FROM scheduled_days WHERE day = date('now', 'localtime')")}
+
+def test_accounts_activated_mid_day_are_scheduled(active_accounts, monkeypatch):
+    monkeypatch.setattr(worker.signal, 'signal', lambda *args: None)
+
+    def run():
+        # Sends nothing, so the worker stops as soon as no job is due
+        worker.run(APP_DB, shards=1, shard=0, stop_when_empty=True, send_many=lambda jobs: [])
+
+    run()
+    assert set(active_accounts) <= scheduled_senders()
+    with db.connect(APP_DB) as conn:
+        late = conn.execute('''
+            INSERT INTO accounts (email, password, daily_limit, warmup_style, status) VALUES ('late@example.com', 'secret', 24, 3, 1)
+        ''').lastrowid
+    try:
+        run()
+        assert late in scheduled_senders()
+    finally:
+        with db.connect(APP_DB) as conn:
+            conn.execute("DELETE FROM accounts WHERE id = ?", (late,))
+
+def test_adding_a_shard_moves_accounts_only_onto_it():
+    before, after = HashRing(8), HashRing(9)
+    moved = [account_id for account_id in range(10000) if before.shard_of(account_id) != after.shard_of(account_id)]
+    assert {after.shard_of(account_id) for account_id in moved} == {8}
+    assert 0.05 < len(moved) / 10000 < 0.2
+
+def test_rebalance_moves_few_shards(db_path):
+    leases = ShardLeases(db_path, shards=8, lease_seconds=60)
+    leases.heartbeat("w1")
+    assert leases.rebalance() == {"w1": list(range(8))}
+    leases.heartbeat("w2")
+    first = leases.rebalance()
+    assert (len(first["w1"]), len(first["w2"])) == (4, 4)
+    assert leases.heartbeat("w2") == first["w2"]
+
+    leases.heartbeat("w3")
+    second = leases.rebalance()
+    assert sorted(len(shards) for shards in second.values()) == [2, 3, 3]
+    # Existing owners only give shards up
+    assert set(second["w1"]) <= set(first["w1"]) and set(second["w2"]) <= set(first["w2"])
+
+    with closing(leases._connect()) as conn:
+        conn.execute("UPDATE worker_leases SET lease_until = ? WHERE worker_id = 'w1'", (time.time() - 1,))
+    third = leases.rebalance()
+    assert set(third) == {"w2", "w3"}
+    assert sorted(third["w2"] + third["w3"]) == list(range(8))
+    assert set(second["w3"]) <= set(third["w3"])
+
+    leases.leave("w2")
+    assert sorted(leases.rebalance()["w3"]) == list(range(8))
+
+def test_dispatcher_route_refuses_while_workers_send(client):
+    with db.connect(APP_DB) as conn:
+        conn.execute("INSERT INTO worker_leases (worker_id, started, lease_until) VALUES ('w1', ?, ?)", (time.time(), time.time() + 60))
+    try:
+        response = client.post('/api/dispatcher/start')
+        assert response.status_code == 409
+        assert not client.get('/api/dispatcher/status').get_json()['running']
+    finally:
+        with db.connect(APP_DB) as conn:
+            conn.execute("DELETE FROM worker_leases WHERE worker_id = 'w1'")